@@ -0,0 +1,403 @@
+"""导入、导出和列表接口的基准测试
+
+在临时目录的SQLite数据库中生成指定规模的货物数据和导入用Excel（N行×M个工作表×K张图片），
+在进程内通过ASGI调用接口，统计吞吐量、p50/p99延迟和峰值内存，结果写入JSON文件，
+可与之前的结果比较。每个场景默认在独立的子进程中执行，峰值内存互不影响。
+
+依赖httpx，需先安装requirements-dev.txt。
+
+用法（在backend目录下执行）：
+    python -m benchmarks.endpoints --rows 1000 --sheets 2 --images 20 --catalogue 20000 --output before.json
+    python -m benchmarks.endpoints --output after.json --compare before.json
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI
+from openpyxl import Workbook
+from openpyxl.drawing.image import Image as XLImage
+from PIL import Image as PILImage
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import cache_service
+import database
+import image_service
+import import_service
+import job_service
+import models
+import routers
+import search_service
+import storage_service
+from benchmarks import query_plans
+
+SCENARIOS = ("import", "export", "list", "list_cached")
+# 比较结果时关注的指标：名称 -> 数值越大越好
+COMPARE_METRICS = {"throughput_rps": True, "rows_per_second": True, "p50_ms": False, "p99_ms": False, "peak_rss_mb": False}
+# 列表请求使用的检索条件，与页码组合轮流使用
+LIST_FILTERS = [
+    {},
+    {"factory_name": "moon toys", "match": "exact"},
+    {"factory_code": "ak-0001", "match": "prefix"},
+    {"name": "Toy12"},
+    {"name": "玩具"},
+]
+IMAGE_SIZE = (640, 480)
+
+
+def percentile(values, pct):
+    """线性插值的百分位数"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * pct / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(latencies, elapsed, rows=None):
+    """汇总一个场景的延迟（毫秒）和吞吐量"""
+    result = {
+        "requests": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+    }
+    if rows is not None:
+        result["rows"] = rows
+        result["rows_per_second"] = round(rows / elapsed, 1) if elapsed else None
+    return result
+
+
+def reset_peak_rss():
+    """Linux上重置进程的峰值内存统计，只统计之后的峰值"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），不支持的平台返回None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux上单位为KB，macOS上为字节
+    return round(usage / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def random_image_bytes(rng, size=IMAGE_SIZE):
+    """随机像素的PNG图片，压缩率与照片接近，每个种子生成的内容固定"""
+    img = PILImage.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3))
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_workbook(path, rows, sheets, images, seed=0):
+    """生成导入用的Excel：每个工作表rows行，images张图片依次锚定到各工作表的行"""
+    rng = random.Random(seed)
+    wb = Workbook()
+    wb.remove(wb.active)
+    headers = list(import_service.FIELD_MAPPING)
+    for sheet_index in range(sheets):
+        ws = wb.create_sheet(f"报价{sheet_index + 1}")
+        ws.append(headers)
+        for row in range(rows):
+            ws.append([
+                None, f"S{sheet_index}-{seed}-{row:06d}", rng.choice(query_plans.FACTORIES), f"玩具{row} Toy{row}",
+                "彩盒", rng.choice([6, 12, 24, 48]), round(rng.uniform(1, 50), 2), 5.5, 4.5,
+                "50*40*30", "10*10*5", 6, ""
+            ])
+    for index in range(images):
+        ws = wb.worksheets[index % sheets]
+        row = 2 + (index // sheets) % rows
+        ws.add_image(XLImage(BytesIO(random_image_bytes(rng))), f"A{row}")
+    wb.save(path)
+    return path
+
+
+def seed_catalogue(engine, rows, images, seed=0):
+    """写入rows条货物，每10条中有1条带图片（共images张不同图片，保存原图和派生图）"""
+    query_plans.populate(engine, rows, seed)
+    if not images:
+        return
+    rng = random.Random(seed)
+    with engine.begin() as conn:
+        for index in range(images):
+            image_path, _ = image_service.store_image_bytes(random_image_bytes(rng), ".png")
+            image_service.generate_derivatives_from_file(image_path)
+            conn.execute(
+                text("UPDATE toy_items SET image_path = :path WHERE id % 10 = 0 AND (id / 10) % :count = :index"),
+                {"path": image_path, "count": images, "index": index}
+            )
+
+
+@contextmanager
+def environment(directory):
+    """将数据库和文件目录指向临时目录，结束时恢复"""
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    engine = database.create_db_engine(url)
+    database.run_migrations(engine)
+    search_service.ensure_search_index(engine)
+    async_engine = database.create_async_db_engine(url)
+    patches = [
+        (models, "engine", engine),
+        (models, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=engine)),
+        (models, "async_engine", async_engine),
+        (models, "AsyncSessionLocal", async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)),
+        (image_service, "UPLOAD_DIR", os.path.join(directory, "uploads")),
+        (import_service, "TEMP_DIR", os.path.join(directory, "tmp")),
+        (job_service, "JOBS_DIR", os.path.join(directory, "jobs")),
+        (storage_service, "EXPORTS_DIR", os.path.join(directory, "exports")),
+    ]
+    saved = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    cache_service.invalidate_items()
+    try:
+        yield engine
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
+        cache_service.invalidate_items()
+        asyncio.run(async_engine.dispose())
+        engine.dispose()
+
+
+def make_client():
+    # 不使用main.app，避免启动时对正式数据库执行迁移和定期回收
+    app = FastAPI()
+    app.include_router(routers.router)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None)
+
+
+async def run_requests(send, count, concurrency):
+    """以concurrency个并发执行count次请求，返回(各请求耗时, 总耗时)"""
+    latencies = []
+    indexes = iter(range(count))
+
+    async def worker():
+        for index in indexes:
+            start = time.perf_counter()
+            response = await send(index)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"请求失败: {response.status_code} {response.text[:200]}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+async def bench_import(client, options, directory):
+    paths = [
+        make_workbook(os.path.join(directory, f"import_{i}.xlsx"), options["rows"], options["sheets"],
+                      options["images"], seed=options["seed"] + i)
+        for i in range(options["import_repeat"])
+    ]
+
+    async def send(index):
+        with open(paths[index], "rb") as f:
+            return await client.post(
+                "/items/import", data={"factory_name": "基准测试厂"},
+                files={"file": ("bench.xlsx", f.read(), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
+            )
+
+    # 导入为整批处理，逐个执行
+    latencies, elapsed = await run_requests(send, len(paths), 1)
+    return summarize(latencies, elapsed, rows=options["rows"] * options["sheets"] * len(paths))
+
+
+async def bench_export(client, options, directory):
+    item_ids = list(range(1, min(options["export_rows"], options["catalogue"]) + 1))
+
+    async def send(index):
+        return await client.post("/items/export", json={"item_ids": item_ids})
+
+    latencies, elapsed = await run_requests(send, options["export_repeat"], 1)
+    return summarize(latencies, elapsed, rows=len(item_ids) * options["export_repeat"])
+
+
+def list_params(index, options):
+    # 检索条件轮流使用，页码在前10页内循环（列表页的访问集中在前几页，list_cached场景可命中缓存）
+    params = dict(LIST_FILTERS[index % len(LIST_FILTERS)])
+    pages = max(1, min(10, options["catalogue"] // 20))
+    params.update(page=index // len(LIST_FILTERS) % pages + 1, page_size=20)
+    return params
+
+
+async def bench_list(client, options, directory):
+    async def send(index):
+        return await client.get("/items/", params=list_params(index, options))
+
+    latencies, elapsed = await run_requests(send, options["requests"], options["concurrency"])
+    return summarize(latencies, elapsed)
+
+
+BENCHMARKS = {
+    "import": bench_import,
+    "export": bench_export,
+    "list": bench_list,
+    "list_cached": bench_list,
+}
+
+
+def run_scenario(name, options):
+    """在临时目录中准备数据并执行一个场景，返回统计结果"""
+    with tempfile.TemporaryDirectory() as directory, environment(directory) as engine:
+        # 列表场景关闭结果缓存以测量查询本身，list_cached场景使用默认缓存设置
+        saved_ttl = cache_service.list_cache.ttl
+        if name == "list":
+            cache_service.list_cache.ttl = 0
+        try:
+            seed_catalogue(engine, options["catalogue"], options["catalogue_images"], options["seed"])
+            reset_peak_rss()
+
+            async def run():
+                async with make_client() as client:
+                    return await BENCHMARKS[name](client, options, directory)
+
+            result = asyncio.run(run())
+        finally:
+            cache_service.list_cache.ttl = saved_ttl
+            image_service.shutdown_process_pool()
+        result["peak_rss_mb"] = peak_rss_mb()
+        return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(options, scenarios=SCENARIOS, isolate=True):
+    """执行各场景；isolate为True时每个场景在新的子进程中执行"""
+    results = {}
+    for name in scenarios:
+        if isolate:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results[name] = pool.submit(run_scenario, name, options).result()
+        else:
+            results[name] = run_scenario(name, options)
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "options": options,
+        },
+        "results": results,
+    }
+
+
+def compare(previous, current):
+    """比较两次结果，返回[(场景, 指标, 旧值, 新值, 变化百分比, 是否变好)]"""
+    rows = []
+    for name, result in current["results"].items():
+        old = previous.get("results", {}).get(name)
+        if not old:
+            continue
+        for metric, higher_is_better in COMPARE_METRICS.items():
+            before, after = old.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            rows.append((name, metric, before, after, round(change, 1), (change >= 0) == higher_is_better))
+    return rows
+
+
+def print_results(report):
+    for name, result in report["results"].items():
+        line = f"{name:12s} {result['requests']:5d} 次  {result['throughput_rps']:9.2f} 次/秒  " \
+               f"p50 {result['p50_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms"
+        if "rows_per_second" in result:
+            line += f"  {result['rows_per_second']:10.1f} 行/秒"
+        if result.get("peak_rss_mb") is not None:
+            line += f"  峰值内存 {result['peak_rss_mb']:.1f} MB"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="导入Excel每个工作表的行数")
+    parser.add_argument("--sheets", type=int, default=2, help="导入Excel的工作表数")
+    parser.add_argument("--images", type=int, default=20, help="导入Excel中嵌入的图片数")
+    parser.add_argument("--import-repeat", type=int, default=3, help="导入次数（每次使用不同的图片）")
+    parser.add_argument("--catalogue", type=int, default=20000, help="预先写入的货物条数")
+    parser.add_argument("--catalogue-images", type=int, default=50, help="预先写入的货物中使用的不同图片数")
+    parser.add_argument("--export-rows", type=int, default=1000, help="每次导出的货物条数")
+    parser.add_argument("--export-repeat", type=int, default=3, help="导出次数")
+    parser.add_argument("--requests", type=int, default=300, help="列表接口的请求次数")
+    parser.add_argument("--concurrency", type=int, default=8, help="列表接口的并发数")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子，相同参数和种子生成相同的数据")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"执行的场景，可选: {', '.join(SCENARIOS)}")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果JSON文件")
+    parser.add_argument("--compare", help="与之前的结果JSON文件比较")
+    parser.add_argument("--in-process", action="store_true", help="所有场景在当前进程中执行（峰值内存会相互影响）")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"不支持的场景: {', '.join(unknown)}")
+    options = {
+        key: value for key, value in vars(args).items()
+        if key not in ("scenarios", "output", "compare", "in_process")
+    }
+
+    report = run_suite(options, scenarios, isolate=not args.in_process)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_results(report)
+    print(f"\n结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        print(f"\n与 {args.compare} 比较：")
+        for name, metric, before, after, change, better in compare(previous, report):
+            print(f"{name:12s} {metric:16s} {before:>12} -> {after:>12}  {change:+6.1f}%  {'变好' if better else '变差'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""货物列表常用查询的执行计划与耗时
+
+在临时SQLite数据库中生成测试数据，打印每种查询的EXPLAIN QUERY PLAN及平均耗时，
+用于确认查询使用了预期的索引而不是全表扫描。
+
+用法（在backend目录下执行）：
+    python -m benchmarks.query_plans --rows 100000
+"""
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+
+import database
+import models
+import pagination
+import search_service
+
+FACTORIES = ["星星玩具厂", "Moon Toys", "宏达塑胶", "Sunny Plastic", "永乐玩具"]
+
+
+def populate(engine, rows, seed=0):
+    """批量写入测试数据：厂名集中在少数几个值，货号唯一"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    batch = []
+    with engine.begin() as conn:
+        for i in range(rows):
+            batch.append({
+                "factory_code": f"{rng.choice('ABCDEFGH')}{rng.choice('KLMN')}-{i:06d}",
+                "factory_name": rng.choice(FACTORIES),
+                "name": f"玩具{i % 997}号 Toy{i}",
+                "packaging": "彩盒",
+                "updated_at": start + timedelta(seconds=i * 37),
+                "created_at": start + timedelta(seconds=i * 37),
+            })
+            if len(batch) >= 5000:
+                conn.execute(insert(models.ToyItem.__table__), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(models.ToyItem.__table__), batch)
+        conn.execute(text("ANALYZE"))
+
+
+def list_query(session, page_size=20, match="contains", cursor=None, **terms):
+    """与get_items相同的查询构造方式"""
+    query, ranked = search_service.apply_search(session.query(models.ToyItem), session.get_bind(), match=match, **terms)
+    order_by = pagination.keyset_order()
+    if cursor:
+        query = pagination.apply_cursor(query, cursor)
+    elif ranked:
+        order_by.insert(0, search_service.rank_order())
+    return query.order_by(*order_by).limit(page_size)
+
+
+def access_paths(session):
+    """列表页的常用访问路径：名称 -> 查询"""
+    latest = session.query(models.ToyItem).order_by(*pagination.keyset_order()).first()
+    return {
+        "最新货物（第一页）": list_query(session),
+        "游标翻页": list_query(session, cursor=pagination.encode_cursor(latest)),
+        "某工厂的最新货物": list_query(session, match="exact", factory_name="moon toys"),
+        "按货号精确查找": list_query(session, match="exact", factory_code="ak-000123"),
+        "按货号前缀查找": list_query(session, match="prefix", factory_code="ak-0001"),
+        "按品名前缀查找": list_query(session, match="prefix", name="玩具12号"),
+        "按品名包含查找（全文索引）": list_query(session, name="Toy123"),
+    }
+
+
+def explain(session, query):
+    """返回查询的执行计划（每个步骤一行）"""
+    sql = str(query.statement.compile(dialect=session.get_bind().dialect, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+
+def timed(session, query, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        query.all()
+        session.expunge_all()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="测试数据行数")
+    parser.add_argument("--repeat", type=int, default=20, help="每个查询的执行次数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = database.create_db_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        database.run_migrations(engine)
+        search_service.ensure_search_index(engine)
+        start = time.perf_counter()
+        populate(engine, args.rows)
+        print(f"生成 {args.rows} 行测试数据，耗时 {time.perf_counter() - start:.1f} 秒\n")
+
+        with Session(engine) as session:
+            for name, query in access_paths(session).items():
+                print(f"{name}: {timed(session, query, args.repeat):.2f} ms")
+                for step in explain(session, query):
+                    print(f"    {step}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
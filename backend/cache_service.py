@@ -0,0 +1,115 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
+import pagination
+import serialization
+
+# 列表查询结果缓存：有效期（秒，设为0关闭缓存）与最多缓存的条目数
+LIST_CACHE_TTL = float(os.environ.get("TOY_LIST_CACHE_TTL", 30))
+LIST_CACHE_MAX_ENTRIES = int(os.environ.get("TOY_LIST_CACHE_SIZE", 512))
+
+# 列表结果需要浏览器每次携带ETag校验，数据未变化时返回304
+LIST_CACHE_CONTROL = "no-cache"
+
+
+class DataVersion:
+    """货物数据版本号，每次写入后加一
+
+    缓存键包含查询开始时的版本号：查询期间发生写入时，结果以旧版本号存入，不会被后续请求读到。
+    版本号只在当前进程内有效，多个uvicorn进程时其他进程的写入依靠缓存有效期失效。
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self._value
+
+    def bump(self):
+        with self._lock:
+            self._value += 1
+            return self._value
+
+
+class CachedPage:
+    """一页列表结果序列化后的JSON及其ETag，命中缓存时直接返回，不再编码"""
+
+    __slots__ = ("body", "etag", "created_at")
+
+    def __init__(self, payload):
+        self.body = serialization.dumps(payload)
+        self.etag = make_etag(self.body)
+        self.created_at = time.monotonic()
+
+
+class ListCache:
+    """按查询条件缓存列表结果，超过有效期或条目数上限时淘汰（最近最少使用）"""
+
+    def __init__(self, ttl=LIST_CACHE_TTL, max_entries=LIST_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if now - entry.created_at >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, payload):
+        entry = CachedPage(payload)
+        if self.ttl <= 0:
+            return entry
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+data_version = DataVersion()
+list_cache = ListCache()
+
+
+def make_etag(body):
+    # 按返回内容计算，内容相同则ETag相同（与进程、重启无关）
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """判断请求头If-None-Match是否包含当前ETag（忽略弱校验前缀W/）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def invalidate_items():
+    """货物数据写入后调用：版本号加一，清空列表缓存和总数缓存"""
+    version = data_version.bump()
+    list_cache.clear()
+    pagination.count_cache.clear()
+    return version
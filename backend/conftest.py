@@ -0,0 +1,65 @@
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import cache_service
+import database
+import models
+import routers
+
+
+@pytest.fixture(autouse=True)
+def clear_list_cache():
+    # 列表缓存是进程级的，每个测试使用新的数据库，需从空缓存开始
+    cache_service.invalidate_items()
+
+
+@pytest.fixture
+def db_engine(tmp_path):
+    # 每个测试使用独立的SQLite文件，避免污染开发数据库；与正式环境使用相同的连接参数
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db_session(db_engine):
+    session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+async def async_db_engine(db_engine):
+    # 与db_engine指向同一个数据库文件，测试可用同步会话准备数据、用异步会话调用接口
+    engine = database.create_async_db_engine(db_engine.url)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+async def async_db_session(async_db_engine):
+    async with async_sessionmaker(async_db_engine, autoflush=False, expire_on_commit=False)() as session:
+        yield session
+
+
+@pytest.fixture
+def list_items(async_db_session):
+    """通过HTTP调用列表接口，返回解析后的响应内容；错误响应转换为HTTPException"""
+    app = FastAPI()
+    app.include_router(routers.router)
+    app.dependency_overrides[models.get_async_db] = lambda: async_db_session
+
+    async def call(**params):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.get("/items/", params=params)
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=response.json()["detail"])
+        return response.json()
+    return call
@@ -0,0 +1,335 @@
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.units import pixels_to_EMU, points_to_pixels
+from PIL import Image as PILImage
+from xml.sax.saxutils import escape
+from decimal import Decimal
+from io import BytesIO
+import models
+import database
+import image_service
+import metrics_service
+import tempfile
+import time
+import zipfile
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SHEET_TITLE = "货物报价表"
+HEADERS = ["图片", "货号", "厂名", "品名", "包装", "装箱量PCS", "单价", "毛重KG", "净重KG", "外箱规格CM", "产品规格", "内箱", "备注"]
+# 与表头顺序对应的字段（第一列为图片）
+FIELDS = ["factory_code", "factory_name", "name", "packaging", "packing_quantity", "unit_price",
+          "gross_weight", "net_weight", "outer_box_size", "product_size", "inner_box", "remarks"]
+# 列宽：图片列20，品名列30，其余15
+COLUMN_WIDTHS = [20, 15, 15, 30] + [15] * (len(HEADERS) - 4)
+ROW_HEIGHT = 75
+IMAGE_PADDING = 4
+# 图片单元格的像素尺寸（与原导出逻辑保持一致）
+CELL_WIDTH_PX = points_to_pixels(COLUMN_WIDTHS[0] * 7)
+CELL_HEIGHT_PX = points_to_pixels(ROW_HEIGHT)
+
+# 每次从数据库读取的记录数
+FETCH_SIZE = 500
+# 临时文件内容分块写入zip的大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_XDR = "http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing"
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Default Extension="jpeg" ContentType="image/jpeg"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/drawings/drawing1.xml" ContentType="application/vnd.openxmlformats-officedocument.drawing+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    f'<Relationships xmlns="{NS_PKG_REL}">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    f'<workbook xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+    f'<sheets><sheet name="{SHEET_TITLE}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    f'<Relationships xmlns="{NS_PKG_REL}">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# 全表共用一个居中+自动换行的单元格样式（s="1"），不再为每个单元格创建对齐对象
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    f'<styleSheet xmlns="{NS_MAIN}">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center" wrapText="1"/></xf>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+SHEET_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    f'<Relationships xmlns="{NS_PKG_REL}">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/drawing" Target="../drawings/drawing1.xml"/>'
+    '</Relationships>'
+)
+
+
+class _ChunkBuffer:
+    """zipfile的输出目标：只追加不回写，写入的数据随时取出发送给客户端"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _cell_xml(ref, value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        value = str(value)
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c r="{ref}" s="1"><v>{value}</v></c>'
+    # 去除XML不允许的控制字符
+    text = ILLEGAL_CHARACTERS_RE.sub("", str(value))
+    return f'<c r="{ref}" s="1" t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _row_xml(row, values, height=None):
+    height_attr = f' ht="{height}" customHeight="1"' if height else ""
+    cells = "".join(
+        _cell_xml(f"{get_column_letter(col_idx)}{row}", value)
+        for col_idx, value in enumerate(values, 1)
+    )
+    return f'<row r="{row}"{height_attr}>{cells}</row>'
+
+
+def _anchor_xml(row, media_index, width, height):
+    """图片按单元格居中放置（oneCellAnchor），row为1开始的行号"""
+    col_offset = pixels_to_EMU((CELL_WIDTH_PX - width) // 2)
+    row_offset = pixels_to_EMU((CELL_HEIGHT_PX - height) // 2)
+    return (
+        '<xdr:oneCellAnchor>'
+        f'<xdr:from><xdr:col>0</xdr:col><xdr:colOff>{col_offset}</xdr:colOff>'
+        f'<xdr:row>{row - 1}</xdr:row><xdr:rowOff>{row_offset}</xdr:rowOff></xdr:from>'
+        f'<xdr:ext cx="{pixels_to_EMU(width)}" cy="{pixels_to_EMU(height)}"/>'
+        '<xdr:pic>'
+        f'<xdr:nvPicPr><xdr:cNvPr id="{row}" name="Image {row}"/>'
+        '<xdr:cNvPicPr><a:picLocks noChangeAspect="1"/></xdr:cNvPicPr></xdr:nvPicPr>'
+        f'<xdr:blipFill><a:blip r:embed="rId{media_index}"/><a:stretch><a:fillRect/></a:stretch></xdr:blipFill>'
+        '<xdr:spPr><a:xfrm><a:off x="0" y="0"/>'
+        f'<a:ext cx="{pixels_to_EMU(width)}" cy="{pixels_to_EMU(height)}"/></a:xfrm>'
+        '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></xdr:spPr>'
+        '</xdr:pic><xdr:clientData/>'
+        '</xdr:oneCellAnchor>'
+    )
+
+
+def fit_to_cell(img_width, img_height):
+    """按单元格大小等比缩放，返回图片在单元格中的显示尺寸"""
+    max_width = CELL_WIDTH_PX - IMAGE_PADDING
+    max_height = CELL_HEIGHT_PX - IMAGE_PADDING
+    scale = min(max_width / img_width, max_height / img_height)
+    return max(int(img_width * scale), 1), max(int(img_height * scale), 1)
+
+
+def load_export_image(image_path):
+    """读取预先缩放好的导出用派生图，返回(jpeg数据, 显示宽, 显示高)
+
+    派生图以原图内容哈希命名并持久保存在uploads/export下，已是JPEG格式，
+    无需再次解码和编码。派生图不存在时返回None。
+    """
+    file_path = image_service.derivative_abs_path(image_path, "export")
+    try:
+        with open(file_path, "rb") as f:
+            image_bytes = f.read()
+        # 只读取文件头获取尺寸，不解码像素
+        with PILImage.open(BytesIO(image_bytes)) as img:
+            width, height = fit_to_cell(*img.size)
+    except Exception as e:
+        logger.error(f"读取导出图片失败: {image_path} - {str(e)}")
+        return None
+    return image_bytes, width, height
+
+
+def _iter_items(db, item_ids):
+    """按id顺序分批读取导出的记录，每次查询的IN列表不超过IN_CHUNK_SIZE"""
+    for chunk in database.chunked(sorted(set(item_ids))):
+        query = db.query(models.ToyItem).filter(models.ToyItem.id.in_(chunk)).order_by(models.ToyItem.id)
+        yield from query
+
+
+def _batches(iterable, size):
+    batch = []
+    for entry in iterable:
+        batch.append(entry)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_into_zip(zf, name, source, out):
+    """将临时文件内容分块写入zip条目，每块写完即可发送"""
+    source.seek(0)
+    with zf.open(name, "w", force_zip64=True) as entry:
+        while True:
+            chunk = source.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            entry.write(chunk)
+            data = out.drain()
+            if data:
+                yield data
+
+
+def stream_export(item_ids, session_factory=None, progress=None):
+    """流式生成导出的xlsx文件内容
+
+    记录按批从数据库读取；图片处理完立即写入zip并发送，工作表和图片锚点的XML
+    先写入磁盘临时文件，最后分块拷贝进zip。内存占用与导出行数无关。
+    progress回调在每批记录写完后调用：progress(阶段, 已完成数, 总数, 说明)。
+    """
+    session_factory = session_factory or models.SessionLocal
+    start_time = time.time()
+    out = _ChunkBuffer()
+    db = session_factory()
+    sheet_file = tempfile.TemporaryFile(mode="w+b")
+    drawing_file = tempfile.TemporaryFile(mode="w+b")
+    try:
+        zf = zipfile.ZipFile(out, mode="w", compression=zipfile.ZIP_DEFLATED)
+        zf.writestr("[Content_Types].xml", CONTENT_TYPES_XML)
+        zf.writestr("_rels/.rels", ROOT_RELS_XML)
+        zf.writestr("xl/workbook.xml", WORKBOOK_XML)
+        zf.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS_XML)
+        zf.writestr("xl/styles.xml", STYLES_XML)
+        zf.writestr("xl/worksheets/_rels/sheet1.xml.rels", SHEET_RELS_XML)
+        yield out.drain()
+
+        cols = "".join(
+            f'<col min="{idx}" max="{idx}" width="{width}" customWidth="1"/>'
+            for idx, width in enumerate(COLUMN_WIDTHS, 1)
+        )
+        sheet_file.write((
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<worksheet xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+            f'<cols>{cols}</cols><sheetData>'
+            + _row_xml(1, HEADERS)
+        ).encode("utf-8"))
+        drawing_file.write((
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<xdr:wsDr xmlns:xdr="{NS_XDR}" xmlns:a="{NS_A}" xmlns:r="{NS_REL}">'
+        ).encode("utf-8"))
+
+        # 相同图片只写入一次，多行共用同一个媒体文件
+        media_indices = {}
+        media_sizes = {}
+        row = 1
+        for batch in _batches(_iter_items(db, item_ids), FETCH_SIZE):
+            # 先在进程池中并行补齐本批缺失的导出用派生图，写zip时只需读取文件
+            new_paths = [
+                item.image_path for item in batch
+                if item.image_path and item.image_path not in media_indices
+            ]
+            failed = image_service.ensure_derivatives_parallel(new_paths, "export")
+            for image_path in failed:
+                media_indices[image_path] = None
+
+            for item in batch:
+                row += 1
+                sheet_file.write(_row_xml(
+                    row, [None] + [getattr(item, field) for field in FIELDS], ROW_HEIGHT
+                ).encode("utf-8"))
+
+                if not item.image_path:
+                    continue
+                if item.image_path not in media_indices:
+                    prepared = load_export_image(item.image_path)
+                    if prepared is None:
+                        media_indices[item.image_path] = None
+                        continue
+                    image_bytes, width, height = prepared
+                    media_index = len(media_sizes) + 1
+                    media_indices[item.image_path] = media_index
+                    media_sizes[media_index] = (width, height)
+                    # JPEG已是压缩格式，直接存储不再压缩
+                    zf.writestr(f"xl/media/image{media_index}.jpeg", image_bytes, compress_type=zipfile.ZIP_STORED)
+                    yield out.drain()
+                media_index = media_indices[item.image_path]
+                if media_index is not None:
+                    drawing_file.write(_anchor_xml(row, media_index, *media_sizes[media_index]).encode("utf-8"))
+
+            if progress:
+                progress("export_rows", row - 1, len(set(item_ids)), None)
+
+        sheet_file.write(b'</sheetData><drawing r:id="rId1"/></worksheet>')
+        drawing_file.write(b'</xdr:wsDr>')
+        process_time = time.time() - start_time
+        metrics_service.observe("export", "process_data", process_time)
+        metrics_service.ROWS_PROCESSED.labels("export").inc(row - 1)
+        metrics_service.IMAGES_PROCESSED.labels("export").inc(len(media_sizes))
+        logger.info(f"数据处理完成，共{row - 1}行、{len(media_sizes)}张图片，耗时：{process_time:.2f}秒")
+
+        save_start_time = time.time()
+        yield from _copy_into_zip(zf, "xl/worksheets/sheet1.xml", sheet_file, out)
+        yield from _copy_into_zip(zf, "xl/drawings/drawing1.xml", drawing_file, out)
+        drawing_rels = "".join(
+            f'<Relationship Id="rId{idx}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target="../media/image{idx}.jpeg"/>'
+            for idx in media_sizes
+        )
+        zf.writestr(
+            "xl/drawings/_rels/drawing1.xml.rels",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<Relationships xmlns="{NS_PKG_REL}">{drawing_rels}</Relationships>'
+        )
+        zf.close()
+        yield out.drain()
+        save_time = time.time() - save_start_time
+        metrics_service.observe("export", "generate_file", save_time)
+        metrics_service.observe("export", "total", time.time() - start_time)
+        logger.info(f"文件生成完成，耗时：{save_time:.2f}秒")
+    finally:
+        sheet_file.close()
+        drawing_file.close()
+        db.close()
@@ -0,0 +1,443 @@
+from PIL import Image as PILImage
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+import database
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import hashlib
+import threading
+import time
+import os
+import re
+import uuid
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+
+# 派生图规格：名称 -> (最大宽, 最大高, JPEG质量)
+DERIVATIVE_SIZES = {
+    "thumb": (160, 160, 80),       # 列表缩略图（列表图片列100x80，按2倍屏生成）
+    "preview": (1024, 1024, 85),   # 点击预览/编辑对话框用图
+    "export": (364, 192, 85),      # 导出Excel图片列（20列宽×75磅行高单元格的2倍）
+}
+
+# 内容寻址的文件名：64位十六进制SHA-256摘要
+CONTENT_NAME_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# 内容寻址文件内容永不改变，可长期缓存；历史文件名需每次用ETag校验
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# 图片处理进程池的工作进程数，可通过环境变量调整
+IMAGE_WORKERS = int(os.environ.get("TOY_IMAGE_WORKERS", 0)) or os.cpu_count() or 1
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# 批量删除图片文件时的线程数（删除文件以IO等待为主）
+FILE_CLEANUP_WORKERS = 8
+
+# 按文件名主干（内容摘要）分段加锁：复用已有图片与删除图片互斥
+IMAGE_LOCK_STRIPES = 64
+_image_locks = [threading.Lock() for _ in range(IMAGE_LOCK_STRIPES)]
+
+# 接口上传图片的大小上限（字节）和像素数上限（宽×高，防止小文件解码后占用大量内存）
+MAX_UPLOAD_IMAGE_BYTES = int(os.environ.get("TOY_MAX_IMAGE_BYTES", 20 * 1024 * 1024))
+MAX_UPLOAD_IMAGE_PIXELS = int(os.environ.get("TOY_MAX_IMAGE_PIXELS", 40_000_000))
+# 保存上传图片时每次读取的字节数
+UPLOAD_READ_SIZE = 1024 * 1024
+# 允许上传的图片格式（按文件头识别，MPO为部分相机拍摄的JPEG）
+UPLOAD_IMAGE_FORMATS = {"JPEG", "MPO", "PNG", "GIF", "BMP"}
+
+
+class ImageTooLargeError(ValueError):
+    """上传的图片超过大小或像素数上限"""
+
+
+def flatten_alpha(img):
+    """将带透明通道或调色板的图片转换为白底RGB，便于保存为JPEG"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = PILImage.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def content_file_name(digest, file_ext):
+    return f"{digest}{file_ext}"
+
+
+def is_content_addressed(file_name):
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    return bool(CONTENT_NAME_PATTERN.match(stem))
+
+
+def cache_control_for(file_name):
+    return IMMUTABLE_CACHE_CONTROL if is_content_addressed(file_name) else REVALIDATE_CACHE_CONTROL
+
+
+def image_lock(image_path):
+    """图片（原图及派生图）对应的锁，同一内容摘要总是得到同一把锁"""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return _image_locks[hash(stem) % IMAGE_LOCK_STRIPES]
+
+
+def touch_image(image_path, upload_dir=None):
+    """复用已保存的图片时更新原图和派生图的修改时间（需持有image_lock）
+
+    删除图片前据此判断决定删除之后图片是否又被复用；存储回收的宽限期也按修改时间计算。
+    """
+    now = time.time()
+    paths = [original_abs_path(image_path, upload_dir)]
+    paths += [derivative_abs_path(image_path, size, upload_dir) for size in DERIVATIVE_SIZES]
+    for path in paths:
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            pass
+
+
+def write_atomic(target, data):
+    """先写临时文件再改名，读取方不会看到写了一半的文件"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_target = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_target, "wb") as f:
+            f.write(data)
+        os.replace(temp_target, target)
+    finally:
+        if os.path.exists(temp_target):
+            os.remove(temp_target)
+
+
+def store_image_bytes(contents, file_ext):
+    """按内容SHA-256保存图片，相同内容只保存一份
+
+    返回(相对路径, 是否新写入)。
+    """
+    file_name = content_file_name(content_hash(contents), file_ext)
+    target = os.path.join(UPLOAD_DIR, file_name)
+    with image_lock(file_name):
+        created = not os.path.exists(target)
+        if created:
+            write_atomic(target, contents)
+        else:
+            touch_image(file_name)
+    return f"uploads/{file_name}", created
+
+
+def validate_image_header(path, max_pixels=None):
+    """只解析文件头识别格式和尺寸，不解码像素数据；无效图片抛出ValueError"""
+    max_pixels = max_pixels or MAX_UPLOAD_IMAGE_PIXELS
+    try:
+        img = PILImage.open(path)
+    except PILImage.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    except Exception as e:
+        raise _unrecognized_image(e)
+    with img:
+        if img.format not in UPLOAD_IMAGE_FORMATS:
+            raise ValueError(f"不支持的图片格式: {img.format}")
+        width, height = img.size
+        if width * height > max_pixels:
+            raise ImageTooLargeError(f"图片尺寸{width}x{height}超过{max_pixels}像素上限")
+        try:
+            # 检查文件结构（PNG会校验各数据块），不解码像素
+            img.verify()
+        except Exception as e:
+            raise _unrecognized_image(e)
+
+
+def _unrecognized_image(error):
+    # Pillow的错误信息包含临时文件的绝对路径，只记录日志，返回给客户端的信息不含路径
+    logger.warning(f"无法识别上传的图片: {str(error)}")
+    return ValueError("无法识别的图片格式")
+
+
+def store_image_stream(fileobj, file_ext, max_bytes=None, max_pixels=None):
+    """从文件对象读取一次上传的图片：边写临时文件边计算SHA-256，超过大小上限立即停止，
+    校验文件头后按内容哈希改名发布，相同内容只保存一份
+
+    在工作线程中执行，返回(相对路径, 是否新写入)。
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_IMAGE_BYTES
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    # 临时文件与目标在同一目录，改名是原子操作；中断残留的.tmp文件由存储回收清理
+    temp_path = os.path.join(UPLOAD_DIR, f"upload_{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, "wb") as f:
+            for chunk in iter(lambda: fileobj.read(UPLOAD_READ_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageTooLargeError(f"图片超过{max_bytes}字节上限")
+                digest.update(chunk)
+                f.write(chunk)
+        if size == 0:
+            raise ValueError("图片文件为空")
+        validate_image_header(temp_path, max_pixels)
+
+        file_name = content_file_name(digest.hexdigest(), file_ext)
+        target = os.path.join(UPLOAD_DIR, file_name)
+        with image_lock(file_name):
+            created = not os.path.exists(target)
+            if created:
+                os.replace(temp_path, target)
+            else:
+                touch_image(file_name)
+        return f"uploads/{file_name}", created
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def derivative_file_name(image_path):
+    # 派生图统一保存为JPEG，文件名沿用原图文件名主干
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return f"{stem}.jpg"
+
+
+def derivative_url(image_path, size):
+    """派生图的访问路径（images/<规格>/<原图文件名>），缺少派生图时接口会按需补生成"""
+    return f"images/{size}/{os.path.basename(image_path)}"
+
+
+def derivative_abs_path(image_path, size, upload_dir=None):
+    return os.path.join(upload_dir or UPLOAD_DIR, size, derivative_file_name(image_path))
+
+
+def original_abs_path(image_path, upload_dir=None):
+    # image_path格式为"uploads/filename.jpg"，UPLOAD_DIR已包含uploads目录
+    return os.path.join(upload_dir or UPLOAD_DIR, os.path.basename(image_path))
+
+
+def generate_derivatives(img, image_path, sizes=None, upload_dir=None):
+    """根据已解码的原图生成派生图，写入时一次性生成全部规格"""
+    img = flatten_alpha(img)
+    for size in sizes or DERIVATIVE_SIZES:
+        max_width, max_height, quality = DERIVATIVE_SIZES[size]
+        derivative = img.copy()
+        derivative.thumbnail((max_width, max_height), PILImage.LANCZOS)
+        target = derivative_abs_path(image_path, size, upload_dir)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # 先写临时文件再改名，避免并发请求读到写了一半的图片
+        temp_target = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            derivative.save(temp_target, 'JPEG', quality=quality, optimize=True)
+            os.replace(temp_target, target)
+        finally:
+            if os.path.exists(temp_target):
+                os.remove(temp_target)
+
+
+def generate_derivatives_from_file(image_path, sizes=None, upload_dir=None):
+    """从已保存的原图生成派生图（可在进程池中执行，upload_dir由调用方传入）"""
+    sizes = list(sizes or DERIVATIVE_SIZES)
+    with PILImage.open(original_abs_path(image_path, upload_dir)) as img:
+        # JPEG可在解码时直接按比例缩小，大图生成缩略图时省去大部分解码开销
+        largest = max(max(DERIVATIVE_SIZES[size][:2]) for size in sizes)
+        img.draft('RGB', (largest, largest))
+        img.load()
+        generate_derivatives(img, image_path, sizes, upload_dir)
+
+
+def ensure_derivative(image_path, size):
+    """返回派生图绝对路径，历史图片缺少派生图时按需补生成"""
+    target = derivative_abs_path(image_path, size)
+    if not os.path.exists(target):
+        generate_derivatives_from_file(image_path, [size])
+    return target
+
+
+def get_process_pool():
+    """图片解码/缩放等CPU密集任务共用的进程池，首次使用时创建"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+        return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def ensure_derivatives_parallel(image_paths, size):
+    """在进程池中并行补齐缺失的派生图，返回无法生成的图片路径集合"""
+    missing = [
+        path for path in dict.fromkeys(image_paths)
+        if not os.path.exists(derivative_abs_path(path, size))
+    ]
+    failed = set()
+    if not missing:
+        return failed
+
+    try:
+        pool = get_process_pool()
+        futures = {
+            pool.submit(generate_derivatives_from_file, path, [size], UPLOAD_DIR): path
+            for path in missing
+        }
+    except (BrokenProcessPool, RuntimeError) as e:
+        # 进程池不可用时退回当前线程逐张处理
+        logger.warning(f"进程池不可用，改为串行生成派生图: {str(e)}")
+        shutdown_process_pool()
+        futures = None
+
+    if futures is None:
+        for path in missing:
+            try:
+                generate_derivatives_from_file(path, [size])
+            except Exception as e:
+                logger.error(f"生成派生图失败: {path} - {str(e)}")
+                failed.add(path)
+        return failed
+
+    for future in as_completed(futures):
+        path = futures[future]
+        try:
+            future.result()
+        except Exception as e:
+            logger.error(f"生成派生图失败: {path} - {str(e)}")
+            failed.add(path)
+    return failed
+
+
+def has_derivatives(image_path, upload_dir=None):
+    return all(os.path.exists(derivative_abs_path(image_path, size, upload_dir)) for size in DERIVATIVE_SIZES)
+
+
+def is_referenced(db, image_path, exclude_ids=()):
+    """相同内容的图片可能被多条记录共用，检查是否还有其他记录引用"""
+    query = db.query(models.ToyItem.id).filter(models.ToyItem.image_path == image_path)
+    if exclude_ids:
+        query = query.filter(models.ToyItem.id.notin_(list(exclude_ids)))
+    return query.first() is not None
+
+
+def release_image(db, image_path, exclude_ids=()):
+    """记录不再使用某图片时调用，仅在没有其他记录引用时删除文件
+
+    引用检查和删除都在图片锁内进行，检查期间被复用（修改时间更新）的图片保留。
+    """
+    if not image_path:
+        return False
+    released_at = time.time()
+    with image_lock(image_path):
+        if is_referenced(db, image_path, exclude_ids):
+            return False
+        return remove_image_if_unused(image_path, released_at)
+
+
+def unreferenced_images(db, image_paths):
+    """返回已没有任何记录引用的图片路径（删除记录并提交后调用）"""
+    image_paths = list(dict.fromkeys(path for path in image_paths if path))
+    referenced = set()
+    for chunk in database.chunked(image_paths):
+        referenced.update(
+            row[0] for row in db.query(models.ToyItem.image_path).filter(models.ToyItem.image_path.in_(chunk)).distinct()
+        )
+    return [path for path in image_paths if path not in referenced]
+
+
+def remove_images(image_paths, released_at=None):
+    """并行删除多张图片及其派生图，用于批量删除记录后的后台清理
+
+    传入released_at时跳过此后被复用的图片。
+    """
+    image_paths = list(image_paths)
+    if not image_paths:
+        return
+    if released_at is None:
+        remove = remove_image
+    else:
+        def remove(image_path):
+            return remove_image_if_unused_locked(image_path, released_at)
+    with ThreadPoolExecutor(max_workers=min(FILE_CLEANUP_WORKERS, len(image_paths))) as pool:
+        list(pool.map(remove, image_paths))
+    logger.info(f"已清理 {len(image_paths)} 张不再使用的图片")
+
+
+def release_images(db, image_paths):
+    """记录更新并提交后调用：删除已没有记录引用、且检查之后没有被复用的图片"""
+    released_at = time.time()
+    orphaned = unreferenced_images(db, image_paths)
+    remove_images(orphaned, released_at)
+    return orphaned
+
+
+async def release_images_async(bind, image_paths, released_at):
+    """删除记录并提交后在后台调用：用新会话重新检查引用后再删除文件
+
+    bind为请求会话使用的异步引擎。请求结束到后台任务执行之间，相同内容的图片可能被
+    其他请求复用：已提交的引用由重新检查排除，尚未提交的由修改时间和图片锁保留。
+    """
+    image_paths = [path for path in dict.fromkeys(image_paths) if path]
+    if not image_paths:
+        return
+    async with AsyncSession(bind) as db:
+        orphaned = await db.run_sync(unreferenced_images, image_paths)
+    if orphaned:
+        await asyncio.to_thread(remove_images, orphaned, released_at)
+
+
+async def release_image_async(db, image_path, exclude_ids=()):
+    """release_image的异步会话版本，引用检查和文件删除都不阻塞事件循环
+
+    引用检查之后才删除文件，检查之后被其他请求复用的图片由remove_image_if_unused保留。
+    """
+    if not image_path:
+        return False
+    released_at = time.time()
+    if await db.run_sync(is_referenced, image_path, exclude_ids):
+        return False
+    return await asyncio.to_thread(remove_image_if_unused_locked, image_path, released_at)
+
+
+def remove_image_if_unused(image_path, released_at):
+    """released_at之后没有被复用时删除图片及派生图，返回是否删除（需持有image_lock）
+
+    复用已有图片时会在同一把锁内更新修改时间，因此决定删除之后被复用的图片不会被删除。
+    """
+    try:
+        if os.stat(original_abs_path(image_path)).st_mtime >= released_at:
+            logger.info(f"图片在决定删除后又被使用，保留: {image_path}")
+            return False
+    except FileNotFoundError:
+        pass
+    remove_image(image_path)
+    return True
+
+
+def remove_image_if_unused_locked(image_path, released_at):
+    with image_lock(image_path):
+        return remove_image_if_unused(image_path, released_at)
+
+
+def remove_image(image_path):
+    """删除原图及其全部派生图"""
+    paths = [original_abs_path(image_path)]
+    paths += [derivative_abs_path(image_path, size) for size in DERIVATIVE_SIZES]
+    for path in paths:
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except Exception as e:
+                # 记录错误但不影响数据库操作
+                logger.error(f"删除图片文件失败: {path} - {str(e)}")
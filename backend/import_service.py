@@ -1,18 +1,29 @@
 from fastapi import UploadFile, File, Form, HTTPException, Depends
+from sqlalchemy import insert, update, func
 from sqlalchemy.orm import Session
 import models
-from datetime import datetime
+import database
+import image_service
+import cache_service
+import metrics_service
 import os
 import shutil
 import uuid
+import json
+import hashlib
 from openpyxl import load_workbook
 from PIL import Image as PILImage
 from io import BytesIO
 import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
 import re
+import itertools
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 import time
+from datetime import datetime
 import logging
 # ValidationError removed - using ValueError instead
 
@@ -20,445 +31,633 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
+# 导入文件的临时目录（不放在对外提供静态访问的uploads目录下）
+TEMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp")
+# 导入时每次批量插入的行数，可通过环境变量调整
+IMPORT_BATCH_SIZE = int(os.environ.get("TOY_IMPORT_BATCH_SIZE", 1000))
+# insert：每行都新增记录；upsert：按(厂名, 货号)匹配已有记录，内容未变化的跳过，变化的原地更新
+IMPORT_MODES = ("insert", "upsert")
+# 计算文件哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
 
-async def import_items(
-    file: UploadFile = File(...),
-    factory_name: str = Form(...),
-    db: Session = Depends(models.get_db),
-    batch_size: int = 50,  # 批量提交数据库的大小
-    max_workers: int = 8,  # 并行处理图片的工作线程数
-    max_image_size: int = 3500,  # 图片最大尺寸（宽或高）
-    image_quality: int = 100,  # 图片压缩质量
-    timeout_per_image: int = 10  # 每张图片处理的超时时间（秒）
-):
-    # 检查文件类型
-    if not file.filename.endswith((".xlsx", ".xls")):
-        raise HTTPException(status_code=400, detail="只支持Excel文件格式(.xlsx, .xls)")
 
-    # 创建上传目录
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
+def report_progress(progress, stage, done=0, total=0, message=None):
+    """向调用方（如后台任务）报告导入进度，未提供回调时忽略"""
+    if progress:
+        progress(stage, done, total, message)
 
-    # 保存上传的文件到临时位置
-    start_time = time.time()
-    temp_file_path = f"uploads/temp_{file.filename}"
+
+def save_upload_to_temp(file):
+    """将上传的Excel保存为唯一命名的临时文件，返回绝对路径"""
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    file_ext = os.path.splitext(file.filename)[1].lower()
+    temp_file_path = os.path.join(TEMP_DIR, f"import_{uuid.uuid4().hex}{file_ext}")
     with open(temp_file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
-    logger.info(f"文件保存耗时: {time.time() - start_time:.2f}秒")
+    return temp_file_path
+
+
+# 定义字段映射（Excel列名 -> 数据库字段名）
+FIELD_MAPPING = {
+    "图片": "image_path",
+    "货号": "factory_code",
+    "厂名": "factory_name",
+    "品名": "name",
+    "包装": "packaging",
+    "装箱量PCS": "packing_quantity",
+    "单价": "unit_price",
+    "毛重KG": "gross_weight",
+    "净重KG": "net_weight",
+    "外箱规格CM": "outer_box_size",
+    "产品规格": "product_size",
+    "内箱": "inner_box",
+    "备注": "remarks"
+}
+REQUIRED_FIELDS = ["factory_code", "name", "packaging", "packing_quantity"]
+# 参与行指纹计算的字段：写入数据库的全部内容，图片路径按图片内容命名，图片变化时指纹也会变化
+FINGERPRINT_FIELDS = list(FIELD_MAPPING.values()) + ["origin_sheet"]
+
+
+def row_fingerprint(values):
+    """行内容指纹（SHA-256），只与本模块计算的指纹比较，不需要与数据库中的取值格式一致"""
+    content = json.dumps([values.get(field) for field in FINGERPRINT_FIELDS], ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def row_key(values):
+    # Excel中的货号可能是数字，数据库中为字符串，统一按字符串匹配
+    return str(values["factory_name"]), str(values["factory_code"])
+
+
+def file_sha256(file_path):
+    """分块计算文件的SHA-256，不把整个文件读入内存"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clean_numeric_value(value):
+    """清理数值字段，处理包含换行符、特殊字符的情况"""
+    if value is None:
+        return 0.0
+
+    # 如果已经是数字类型，直接返回
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    # 转换为字符串并清理
+    str_value = str(value).strip()
+    if not str_value:
+        return 0.0
+
+    # 移除换行符和多余空格
+    str_value = re.sub(r'\s+', ' ', str_value)
+
+    # 尝试提取第一个数字（处理类似"(带音乐)27.8\n（不带音乐）26.8"的情况）
+    # 查找所有数字（包括小数）
+    numbers = re.findall(r'\d+\.?\d*', str_value)
+    if numbers:
+        try:
+            return float(numbers[0])  # 返回第一个找到的数字
+        except ValueError:
+            pass
+
+    # 如果无法提取数字，返回0
+    logger.warning(f"无法解析数值: '{str_value}'，使用默认值0")
+    return 0.0
+
+
+def validate_unit_price(value, row_idx, col_name):
+    """严格验证单价字段，必须是数字类型"""
+    if value is None or value == "":
+        return 0.0
+
+    # 如果已经是数字类型，直接返回
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    # 转换为字符串并清理
+    str_value = str(value).strip()
+    if not str_value:
+        return 0.0
+
+    # 严格的数字格式验证（只允许数字、小数点、负号）
+    if not re.match(r'^-?\d+(\.\d+)?$', str_value):
+        raise ValueError(f"数据异常，请检查单价列第{row_idx}行数据")
 
     try:
-        # 使用新方法处理Excel文件
-        # 1. 将.xlsx文件当作zip文件打开，直接提取其中的图片
-        images = []
-        image_extraction_start = time.time()
-        if file.filename.endswith('.xlsx'):
-            try:
-                # 尝试从xlsx文件中提取图片
-                with zipfile.ZipFile(temp_file_path, 'r') as zip_ref:
-                    # 查找所有图片文件
-                    media_files = [item for item in zip_ref.namelist()
-                                  if item.startswith('xl/media/') and
-                                  item.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp'))]
-
-                    # 并行提取图片数据
-                    for item in media_files:
-                        # 提取图片数据
-                        image_data = zip_ref.read(item)
-                        images.append(image_data)
-                        logger.info(f"从Excel中提取图片: {item}")
-
-                    logger.info(f"共提取了 {len(images)} 张图片")
-            except Exception as e:
-                logger.error(f"提取Excel图片时出错: {str(e)}")
-                # 继续处理，即使没有图片
+        numeric_value = float(str_value)
+        return numeric_value
+    except ValueError:
+        raise ValueError(f"数据异常，请检查单价列第{row_idx}行数据")
 
-        logger.info(f"图片提取耗时: {time.time() - image_extraction_start:.2f}秒")
 
-        # 2. 使用openpyxl读取所有sheet数据
-        workbook = load_workbook(temp_file_path)
-        total_imported = 0
+def clean_int_value(value):
+    """清理整数字段"""
+    if value is None:
+        return 0
 
-        # 遍历所有工作表
-        for sheet_idx, sheet in enumerate(workbook.worksheets, 1):
-            # 跳过空表
-            if sheet.max_row < 2:
-                continue
+    if isinstance(value, int):
+        return value
 
-            # 获取表头（第一行）
-            headers = [cell.value for cell in sheet[1]]
-            logger.info(f"正在处理工作表 {sheet.title}（第{sheet_idx}个），共{sheet.max_row-1}行数据")
-
-            # 定义字段映射（Excel列名 -> 数据库字段名）
-            field_mapping = {
-                "图片": "image_path",
-                "货号": "factory_code",
-                "厂名": "factory_name",
-                "品名": "name",
-                "包装": "packaging",
-                "装箱量PCS": "packing_quantity",
-                "单价": "unit_price",
-                "毛重KG": "gross_weight",
-                "净重KG": "net_weight",
-                "外箱规格CM": "outer_box_size",
-                "产品规格": "product_size",
-                "内箱": "inner_box",
-                "备注": "remarks"
-            }
-
-            # 找出每个字段在Excel中的列索引
-            field_indices = {}
-            for i, header in enumerate(headers):
-                if header in field_mapping:
-                    field_indices[field_mapping[header]] = i
-
-            # 检查必填字段是否存在
-            required_fields = ["factory_code", "name", "packaging", "packing_quantity"]
-            missing_fields = [field for field in required_fields if field not in field_indices]
-            if missing_fields:
-                missing_headers = [key for key, value in field_mapping.items() if value in missing_fields]
-                raise HTTPException(status_code=400, detail=f"Excel文件缺少必要的列: {', '.join(missing_headers)}")
-
-            # 创建内存缓存，避免重复处理相同的图片数据
-            image_cache = {}
-
-            # 定义图片处理函数
-            async def process_image(image_data, row_idx):
-                # 检查缓存中是否已有相同的图片数据
-                image_hash = hash(image_data)
-                if image_hash in image_cache:
-                    logger.info(f"使用缓存的图片处理结果: {row_idx}")
-                    return image_cache[image_hash]
+    if isinstance(value, float):
+        return int(value)
 
-                try:
-                    # 使用超时机制处理图片
-                    try:
-                        # 从图片数据创建PIL Image对象
-                        img = PILImage.open(BytesIO(image_data))
-
-                        # 如果是RGBA模式，转换为RGB
-                        if img.mode in ('RGBA', 'LA'):
-                            background = PILImage.new('RGB', img.size, (255, 255, 255))
-                            background.paste(img, mask=img.split()[-1])
-                            img = background
-
-                        # 调整图片大小以减少处理时间和文件大小
-                        width, height = img.size
-                        if width > max_image_size or height > max_image_size:
-                            # 保持宽高比例
-                            if width > height:
-                                new_width = max_image_size
-                                new_height = int(height * (max_image_size / width))
-                            else:
-                                new_height = max_image_size
-                                new_width = int(width * (max_image_size / height))
-                            # 使用LANCZOS重采样算法获得更好的质量和速度平衡
-                            img = img.resize((new_width, new_height), PILImage.LANCZOS)
-                            logger.info(f"调整图片大小: {width}x{height} -> {new_width}x{new_height}")
-                    except Exception as e:
-                        logger.error(f"无效的图片格式: {str(e)}")
-                        return None  # 跳过无效的图片
-
-                    # 生成唯一的文件名
-                    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-                    unique_id = uuid.uuid4().hex[:8]
-                    # 使用jpg格式替代png，可以大幅减小文件大小
-                    file_name = f"{timestamp}_{unique_id}_{row_idx}.jpg"
-                    file_path = os.path.abspath(os.path.join(UPLOAD_DIR, file_name))
-
-                    # 确保文件路径在uploads目录内
-                    if not os.path.commonpath([file_path, os.path.abspath(UPLOAD_DIR)]) == os.path.abspath(UPLOAD_DIR):
-                        raise ValueError("无效的文件路径")
-
-                    # 保存为JPG格式 - 使用异步IO操作和超时控制
-                    def save_image():
-                        # 使用上下文管理器确保文件正确关闭
-                        try:
-                            with open(file_path, 'wb') as f:
-                                img.save(f, 'JPEG',
-                                        optimize=True,
-                                        quality=image_quality,
-                                        progressive=True)
-                        except IOError as e:
-                            logger.error(f'图片保存失败：{file_path} - {str(e)}')
-                            raise
-                        return file_path
-
-                    # 在线程池中执行IO密集型操作，并添加超时控制
-                    loop = asyncio.get_event_loop()
-                    try:
-                        # 使用超时机制避免单个图片处理时间过长
-                        saved_path = await asyncio.wait_for(
-                            loop.run_in_executor(None, save_image),
-                            timeout=timeout_per_image
-                        )
-
-                        logger.info(f'成功保存图片到：{saved_path}')
-
-                        # 设置为相对URL路径以便前端访问
-                        image_path = f"uploads/{file_name}"
-
-                        # 将结果存入缓存
-                        image_cache[image_hash] = image_path
-
-                        return image_path
-                    except asyncio.TimeoutError:
-                        logger.warning(f"处理第 {row_idx} 行图片超时，跳过处理")
-                        return None
-                except Exception as e:
-                    logger.error(f"处理第 {row_idx} 行图片时出错: {str(e)}")
-                    return None
-
-            # 预处理图片 - 并行处理所有图片
-            image_paths = {}
-            if images:
-                logger.info(f"开始并行处理 {len(images)} 张图片")
-                image_processing_start = time.time()
-
-                # 检测重复图片数据，减少处理量
-                unique_images = {}
-                for img_index, image_data in enumerate(images):
-                    image_hash = hash(image_data)
-                    if image_hash not in unique_images:
-                        unique_images[image_hash] = [img_index]
-                    else:
-                        unique_images[image_hash].append(img_index)
-
-                logger.info(f"检测到 {len(images)} 张图片中有 {len(unique_images)} 张唯一图片")
-
-                # 创建线程池执行器
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    # 创建图片处理任务 - 只处理唯一的图片
-                    tasks = []
-                    for image_hash, indices in unique_images.items():
-                        # 使用第一个索引作为处理标识
-                        img_index = indices[0]
-                        task = process_image(images[img_index], img_index)
-                        tasks.append((task, indices))
-
-                    # 等待所有图片处理完成，使用as_completed获取先完成的结果
-                    completed_tasks = 0
-                    total_tasks = len(tasks)
-
-                    # 使用semaphore限制并发任务数量，避免内存过载
-                    semaphore = asyncio.Semaphore(max_workers * 2)
-
-                    async def process_with_semaphore(task_info):
-                        task, indices = task_info
-                        async with semaphore:
-                            result = await task
-                            return result, indices
-
-                    # 创建所有任务
-                    all_tasks = [process_with_semaphore(task_info) for task_info in tasks]
-
-                    # 处理完成的任务
-                    for future in asyncio.as_completed(all_tasks):
-                        result, indices = await future
-                        completed_tasks += 1
-
-                        # 更新进度
-                        if completed_tasks % 5 == 0 or completed_tasks == total_tasks:
-                            logger.info(f"图片处理进度: {completed_tasks}/{total_tasks}")
-
-                        if result:  # 只存储成功处理的图片路径
-                            # 将结果应用到所有使用相同图片的索引
-                            for img_index in indices:
-                                image_paths[img_index] = result
-
-                logger.info(f"图片处理完成，共处理 {len(image_paths)} 张图片，耗时: {time.time() - image_processing_start:.2f}秒")
-
-            # 导入数据
-            data_import_start = time.time()
-            imported_count = 0
-            batch_items = []  # 用于批量提交的项目列表
-
-            # 计算全局行号（跨sheet累计）
-            global_row_offset = total_imported
-            for row_idx, row in enumerate(sheet.iter_rows(min_row=2), start=2):  # 从第二行开始（跳过表头）
-                # 计算全局行索引（用于图片匹配）
-                global_row_index = global_row_offset + (row_idx - 2)
-                try:
-                    # 获取图片路径（如果有）
-                    image_path = None
-                    if "image_path" in field_indices and image_paths:
-                        # 计算当前行对应的图片索引（使用全局行索引）
-                        img_index = global_row_index
-                        # 如果有对应的图片，使用预处理的路径
-                        image_path = image_paths.get(img_index)
-                        logger.debug(f"第 {row_idx} 行（全局索引 {img_index}）关联图片: {image_path}")
-
-                    # 数据清理函数
-                    def clean_numeric_value(value):
-                        """清理数值字段，处理包含换行符、特殊字符的情况"""
-                        if value is None:
-                            return 0.0
-                        
-                        # 如果已经是数字类型，直接返回
-                        if isinstance(value, (int, float)):
-                            return float(value)
-                        
-                        # 转换为字符串并清理
-                        str_value = str(value).strip()
-                        if not str_value:
-                            return 0.0
-                        
-                        # 移除换行符和多余空格
-                        str_value = re.sub(r'\s+', ' ', str_value)
-                        
-                        # 尝试提取第一个数字（处理类似"(带音乐)27.8\n（不带音乐）26.8"的情况）
-                        # 查找所有数字（包括小数）
-                        numbers = re.findall(r'\d+\.?\d*', str_value)
-                        if numbers:
-                            try:
-                                return float(numbers[0])  # 返回第一个找到的数字
-                            except ValueError:
-                                pass
-                        
-                        # 如果无法提取数字，返回0
-                        logger.warning(f"无法解析数值: '{str_value}'，使用默认值0")
-                        return 0.0
-                    
-                    def validate_unit_price(value, row_idx, col_name):
-                        """严格验证单价字段，必须是数字类型"""
-                        if value is None or value == "":
-                            return 0.0
-                        
-                        # 如果已经是数字类型，直接返回
-                        if isinstance(value, (int, float)):
-                            return float(value)
-                        
-                        # 转换为字符串并清理
-                        str_value = str(value).strip()
-                        if not str_value:
-                            return 0.0
-                        
-                        # 严格的数字格式验证（只允许数字、小数点、负号）
-                        if not re.match(r'^-?\d+(\.\d+)?$', str_value):
-                            raise ValueError(f"数据异常，请检查单价列第{row_idx}行数据")
-                        
-                        try:
-                            numeric_value = float(str_value)
-                            return numeric_value
-                        except ValueError:
-                            raise ValueError(f"数据异常，请检查单价列第{row_idx}行数据")
-                    
-                    def clean_int_value(value):
-                        """清理整数字段"""
-                        if value is None:
-                            return 0
-                        
-                        if isinstance(value, int):
-                            return value
-                        
-                        if isinstance(value, float):
-                            return int(value)
-                        
-                        # 转换为字符串并清理
-                        str_value = str(value).strip()
-                        if not str_value:
-                            return 0
-                        
-                        # 移除换行符和多余空格
-                        str_value = re.sub(r'\s+', ' ', str_value)
-                        
-                        # 尝试提取第一个整数
-                        numbers = re.findall(r'\d+', str_value)
-                        if numbers:
-                            try:
-                                return int(numbers[0])
-                            except ValueError:
-                                pass
-                        
-                        logger.warning(f"无法解析整数: '{str_value}'，使用默认值0")
-                        return 0
-
-                    # 创建新记录
-                    new_item = models.ToyItem(
-                        factory_code=row[field_indices.get("factory_code")].value if "factory_code" in field_indices else None,
-                        factory_name=row[field_indices.get("factory_name")].value if "factory_name" in field_indices else factory_name,
-                        name=row[field_indices.get("name")].value if "name" in field_indices else None,
-                        packaging=row[field_indices.get("packaging")].value if "packaging" in field_indices else None,
-                        packing_quantity=clean_int_value(row[field_indices.get("packing_quantity")].value) if "packing_quantity" in field_indices else 0,
-                        unit_price=validate_unit_price(row[field_indices.get("unit_price")].value, row_idx, "单价") if "unit_price" in field_indices else 0.0,
-                        gross_weight=clean_numeric_value(row[field_indices.get("gross_weight")].value) if "gross_weight" in field_indices else 0.0,
-                        net_weight=clean_numeric_value(row[field_indices.get("net_weight")].value) if "net_weight" in field_indices else 0.0,
-                        outer_box_size=row[field_indices.get("outer_box_size")].value if "outer_box_size" in field_indices else None,
-                        product_size=row[field_indices.get("product_size")].value if "product_size" in field_indices else None,
-                        inner_box=row[field_indices.get("inner_box")].value if "inner_box" in field_indices else None,
-                        remarks=row[field_indices.get("remarks")].value if "remarks" in field_indices else None,
-                        image_path=image_path,
-                        origin_sheet=sheet.title  # 记录来源工作表
-                    )
-
-                    # 如果提供了厂名但Excel中没有厂名字段，使用表单提供的厂名
-                    if not new_item.factory_name:
-                        new_item.factory_name = factory_name
-
-                    # 检查必填字段
-                    missing_fields = []
-                    if not new_item.factory_code:
-                        missing_fields.append("货号")
-                    if not new_item.name:
-                        missing_fields.append("品名")
-                    if not new_item.packaging:
-                        missing_fields.append("包装")
-
-                    if missing_fields:
-                        logger.warning(f"导入第 {row_idx} 行时缺少必填字段: {', '.join(missing_fields)}")
-                        continue
+    # 转换为字符串并清理
+    str_value = str(value).strip()
+    if not str_value:
+        return 0
+
+    # 移除换行符和多余空格
+    str_value = re.sub(r'\s+', ' ', str_value)
+
+    # 尝试提取第一个整数
+    numbers = re.findall(r'\d+', str_value)
+    if numbers:
+        try:
+            return int(numbers[0])
+        except ValueError:
+            pass
+
+    logger.warning(f"无法解析整数: '{str_value}'，使用默认值0")
+    return 0
 
-                    try:
-                        # 添加到批处理列表
-                        batch_items.append(new_item)
-                        imported_count += 1
 
-                        # 当达到批处理大小时，批量提交到数据库
-                        if len(batch_items) >= batch_size:
-                            db.add_all(batch_items)
-                            db.commit()  # 立即提交这批数据
-                            batch_items = []  # 清空批处理列表
-                            logger.info(f"已批量提交 {imported_count} 条记录到数据库")
+def stored_image_path(digest, upload_dir):
+    """内容哈希为digest的导入图片已保存且派生图齐全时返回其相对路径，否则返回None
 
-                    except Exception as e:
-                        logger.error(f"导入第 {row_idx} 行时数据库操作失败: {str(e)}")
+    复用时在图片锁内更新修改时间，避免正被删除或回收的图片被复用。图片锁只在本进程内有效，
+    因此只在主进程中调用（process_images分发任务前），进程池中只写入新图片。
+    """
+    file_name = image_service.content_file_name(digest, ".jpg")
+    image_path = f"uploads/{file_name}"
+    with image_service.image_lock(file_name):
+        if os.path.exists(os.path.join(upload_dir, file_name)) and image_service.has_derivatives(image_path, upload_dir):
+            image_service.touch_image(image_path, upload_dir)
+            return image_path
+    return None
+
+
+def process_image_data(image_data, upload_dir, max_image_size=3500, image_quality=100):
+    """解码、缩放并保存一张导入的图片，同时生成派生图
+
+    在图片进程池中执行，upload_dir由调用方传入。返回图片相对路径，无效图片返回None。
+    是否复用已保存的图片由调用方在主进程中判断，这里总是写入新文件。
+    """
+    # 按原始图片内容的SHA-256命名
+    digest = image_service.content_hash(image_data)
+    file_name = image_service.content_file_name(digest, ".jpg")
+    image_path = f"uploads/{file_name}"
+    file_path = os.path.abspath(os.path.join(upload_dir, file_name))
+
+    try:
+        # 从图片数据创建PIL Image对象
+        img = PILImage.open(BytesIO(image_data))
+        img.load()
+        # 带透明通道的图片转换为白底RGB
+        img = image_service.flatten_alpha(img)
+
+        # 调整图片大小以减少处理时间和文件大小
+        width, height = img.size
+        if width > max_image_size or height > max_image_size:
+            # 保持宽高比例
+            if width > height:
+                new_width = max_image_size
+                new_height = int(height * (max_image_size / width))
+            else:
+                new_height = max_image_size
+                new_width = int(width * (max_image_size / height))
+            # 使用LANCZOS重采样算法获得更好的质量和速度平衡
+            img = img.resize((new_width, new_height), PILImage.LANCZOS)
+            logger.info(f"调整图片大小: {width}x{height} -> {new_width}x{new_height}")
+    except Exception as e:
+        logger.error(f"无效的图片格式: {str(e)}")
+        return None  # 跳过无效的图片
+
+    # 确保文件路径在uploads目录内
+    if not os.path.commonpath([file_path, os.path.abspath(upload_dir)]) == os.path.abspath(upload_dir):
+        raise ValueError("无效的文件路径")
+
+    # 使用jpg格式替代png，可以大幅减小文件大小
+    # 先写临时文件再改名，同一图片被并发导入时也不会读到不完整的文件
+    os.makedirs(upload_dir, exist_ok=True)
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            img.save(f, 'JPEG', optimize=True, quality=image_quality, progressive=True)
+        os.replace(temp_path, file_path)
+    except IOError as e:
+        logger.error(f'图片保存失败：{file_path} - {str(e)}')
+        raise
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    # 复用已解码的图片生成缩略图等派生图，避免列表页加载原图
+    image_service.generate_derivatives(img, image_path, upload_dir=upload_dir)
+    logger.info(f'成功保存图片到：{file_path}')
+    return image_path
+
+
+# xlsx中各部件XML使用的命名空间
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_XDR = "http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing"
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+
+def _rels_path(part):
+    # xl/drawings/drawing1.xml 的关系文件为 xl/drawings/_rels/drawing1.xml.rels
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, "_rels", f"{name}.rels")
+
+
+def _read_rels(zip_ref, part):
+    """读取部件的关系文件，返回 {关系ID: 目标部件路径}"""
+    try:
+        root = ET.fromstring(zip_ref.read(_rels_path(part)))
+    except KeyError:
+        return {}
+    base = posixpath.dirname(part)
+    targets = {}
+    for rel in root.iter(f"{{{NS_PKG_REL}}}Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target", "")
+        # 目标路径相对于部件所在目录，以/开头时为包内绝对路径
+        if target.startswith("/"):
+            targets[rel.get("Id")] = posixpath.normpath(target.lstrip("/"))
+        else:
+            targets[rel.get("Id")] = posixpath.normpath(posixpath.join(base, target))
+    return targets
+
+
+def _drawing_anchor_rows(zip_ref, drawing_part):
+    """解析绘图XML，返回按出现顺序排列的(锚定行号, 图片部件路径)，行号从1开始"""
+    media = _read_rels(zip_ref, drawing_part)
+    root = ET.fromstring(zip_ref.read(drawing_part))
+    anchors = []
+    for anchor in root:
+        # 只有单元格锚定（twoCellAnchor/oneCellAnchor）的图片才属于某一行，absoluteAnchor没有行号
+        row = anchor.find(f"{{{NS_XDR}}}from/{{{NS_XDR}}}row")
+        blip = anchor.find(f".//{{{NS_A}}}blip")
+        if row is None or blip is None:
+            continue
+        target = media.get(blip.get(f"{{{NS_REL}}}embed"))
+        if target and target.lower().endswith(IMAGE_EXTENSIONS):
+            anchors.append((int(row.text) + 1, target))
+    return anchors
+
+
+def extract_images(file_path):
+    """解析xlsx中的绘图XML，找出每张图片所在的工作表和锚定行
+
+    返回(图片数据, 锚点)：图片数据为 {图片部件路径: 字节}，只包含被单元格引用的图片；
+    锚点为 {工作表名: {行号: 图片部件路径}}，同一行有多张图片时取第一张。
+    """
+    images = {}
+    anchors = {}
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            workbook_part = "xl/workbook.xml"
+            sheet_parts = _read_rels(zip_ref, workbook_part)
+            workbook_root = ET.fromstring(zip_ref.read(workbook_part))
+            for sheet in workbook_root.iter(f"{{{NS_MAIN}}}sheet"):
+                sheet_part = sheet_parts.get(sheet.get(f"{{{NS_REL}}}id"))
+                if not sheet_part:
+                    continue
+                rows = {}
+                # 工作表通过关系文件引用绘图部件，绘图部件再引用xl/media下的图片
+                for target in _read_rels(zip_ref, sheet_part).values():
+                    if not target.startswith("xl/drawings/") or not target.endswith(".xml"):
                         continue
-                except Exception as e:
-                    error_msg = f"导入第 {row_idx} 行时出错: {e}"
-                    logger.error(error_msg)
-                    # 立即停止导入并返回错误信息
-                    try:
-                        db.rollback()
-                    except Exception as rollback_error:
-                        logger.error(f"回滚失败: {rollback_error}")
-                    # 清理临时文件
-                    if os.path.exists(temp_file_path):
-                        os.remove(temp_file_path)
-                    raise Exception(f"Excel导入失败: {error_msg}")
-
-            # 处理剩余的批次
-            if batch_items:
-                db.add_all(batch_items)
-
-            # 提交事务
-            commit_start = time.time()
-            db.commit()
-            logger.info(f"数据库提交耗时: {time.time() - commit_start:.2f}秒")
-            logger.info(f"数据导入耗时: {time.time() - data_import_start:.2f}秒")
-
-            # 计算总耗时
-            total_time = time.time() - start_time
-            logger.info(f"总耗时: {total_time:.2f}秒")
-
-            # 累计总导入数量
-            total_imported += imported_count
+                    for row, media in _drawing_anchor_rows(zip_ref, target):
+                        rows.setdefault(row, media)
+                if rows:
+                    anchors[sheet.get("name")] = rows
+
+            for media in sorted({media for rows in anchors.values() for media in rows.values()}):
+                try:
+                    images[media] = zip_ref.read(media)
+                    logger.info(f"从Excel中提取图片: {media}")
+                except KeyError:
+                    logger.warning(f"Excel中引用的图片不存在: {media}")
+        logger.info(f"共提取了 {len(images)} 张被单元格引用的图片")
+    except Exception as e:
+        logger.error(f"提取Excel图片时出错: {str(e)}")
+        # 继续处理，即使没有图片
+        return {}, {}
+    return images, anchors
+
+
+def process_images(images, max_workers=8, max_image_size=3500, image_quality=100,
+                   timeout_per_image=10, progress=None):
+    """在图片进程池中并行处理去重后的图片
+
+    images为 {图片部件路径: 字节}，返回 {图片部件路径: 保存后的图片相对路径}，处理失败的图片不包含在内。
+    """
+    # 检测重复图片数据，减少处理量
+    unique_images = {}
+    for media, image_data in images.items():
+        unique_images.setdefault(image_service.content_hash(image_data), []).append(media)
+    logger.info(f"检测到 {len(images)} 张图片中有 {len(unique_images)} 张唯一图片")
+
+    upload_dir = image_service.UPLOAD_DIR
+    image_paths = {}
+
+    def apply_result(result, names):
+        if result:  # 只存储成功处理的图片路径
+            # 将结果应用到所有内容相同的图片
+            for media in names:
+                image_paths[media] = result
+
+    # 之前导入过的图片（按内容哈希命名）直接复用，不再把图片数据发送到进程池
+    groups = []
+    for digest, names in unique_images.items():
+        existing = stored_image_path(digest, upload_dir)
+        if existing:
+            apply_result(existing, names)
+        else:
+            groups.append(names)
+    if len(groups) < len(unique_images):
+        logger.info(f"{len(unique_images) - len(groups)} 张图片之前已导入，跳过处理")
+    total_tasks = len(groups)
+
+    try:
+        pool = image_service.get_process_pool()
+    except (BrokenProcessPool, RuntimeError) as e:
+        logger.warning(f"进程池不可用，改为串行处理图片: {str(e)}")
+        pool = None
+
+    # 每次最多提交max_workers*2张图片，避免图片数据一次性全部复制到进程池队列中
+    window = max(1, max_workers * 2)
+    completed_tasks = 0
+    for start in range(0, total_tasks, window):
+        chunk = groups[start:start + window]
+        futures = None
+        if pool is not None:
+            try:
+                futures = [
+                    pool.submit(process_image_data, images[names[0]], upload_dir, max_image_size, image_quality)
+                    for names in chunk
+                ]
+            except (BrokenProcessPool, RuntimeError) as e:
+                # 进程池不可用时退回当前线程逐张处理
+                logger.warning(f"进程池不可用，改为串行处理图片: {str(e)}")
+                image_service.shutdown_process_pool()
+                pool = None
+
+        for i, names in enumerate(chunk):
+            media = names[0]
+            try:
+                if futures is None:
+                    result = process_image_data(images[media], upload_dir, max_image_size, image_quality)
+                else:
+                    # 使用超时机制避免单个图片处理时间过长
+                    result = futures[i].result(timeout=timeout_per_image)
+            except FutureTimeoutError:
+                logger.warning(f"处理图片超时，跳过处理: {media}")
+                result = None
+            except Exception as e:
+                logger.error(f"处理图片时出错: {media} - {str(e)}")
+                result = None
+            apply_result(result, names)
+
+            # 更新进度
+            completed_tasks += 1
+            if completed_tasks % 5 == 0 or completed_tasks == total_tasks:
+                logger.info(f"图片处理进度: {completed_tasks}/{total_tasks}")
+                report_progress(progress, "process_images", completed_tasks, total_tasks)
+
+    return image_paths
+
+
+async def import_items(
+    file: UploadFile = File(...),
+    factory_name: str = Form(...),
+    db: Session = Depends(models.get_db),
+    batch_size: int = IMPORT_BATCH_SIZE,  # 每次批量插入数据库的行数
+    max_workers: int = 8,  # 每批提交到图片进程池的图片数为其2倍
+    max_image_size: int = 3500,  # 图片最大尺寸（宽或高）
+    image_quality: int = 100,  # 图片压缩质量
+    timeout_per_image: int = 10,  # 每张图片处理的超时时间（秒）
+    mode: str = "insert"  # 导入方式，见IMPORT_MODES
+):
+    # 检查文件类型
+    if not file.filename.endswith((".xlsx", ".xls")):
+        raise HTTPException(status_code=400, detail="只支持Excel文件格式(.xlsx, .xls)")
+    validate_mode(mode)
+
+    # 保存上传的文件到临时位置（文件读写放到线程中，不阻塞事件循环）
+    start_time = time.time()
+    temp_file_path = await asyncio.to_thread(save_upload_to_temp, file)
+    save_elapsed = time.time() - start_time
+    metrics_service.observe("import", "save_file", save_elapsed)
+    logger.info(f"文件保存耗时: {save_elapsed:.2f}秒")
 
+    try:
+        return await import_workbook(
+            temp_file_path, file.filename, factory_name, db,
+            batch_size=batch_size,
+            max_workers=max_workers,
+            max_image_size=max_image_size,
+            image_quality=image_quality,
+            timeout_per_image=timeout_per_image,
+            mode=mode
+        )
+    finally:
+        # 清理临时文件
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+
+async def import_workbook(
+    file_path,
+    filename,
+    factory_name,
+    db,
+    batch_size=IMPORT_BATCH_SIZE,
+    max_workers=8,
+    max_image_size=3500,
+    image_quality=100,
+    timeout_per_image=10,
+    progress=None,  # 进度回调：progress(阶段, 已完成数, 总数, 说明)，在工作线程中调用
+    mode="insert"
+):
+    """导入已保存在本地的Excel文件（上传请求和后台任务共用）
+
+    解析Excel和读写数据库在工作线程中执行，图片解码/缩放在图片进程池中执行，
+    导入大文件期间事件循环仍可正常处理其他请求。
+    """
+    return await asyncio.to_thread(
+        import_workbook_sync,
+        file_path, filename, factory_name, db,
+        batch_size=batch_size,
+        max_workers=max_workers,
+        max_image_size=max_image_size,
+        image_quality=image_quality,
+        timeout_per_image=timeout_per_image,
+        progress=progress,
+        mode=mode
+    )
+
+
+def validate_mode(mode):
+    if mode not in IMPORT_MODES:
+        raise HTTPException(status_code=400, detail=f"导入方式只支持: {', '.join(IMPORT_MODES)}")
+
+
+def factory_snapshot(db, factories):
+    """这些厂名下的记录数与最后更新时间，记录被增删改后会变化"""
+    if not factories:
+        return "0:"
+    count, latest = db.query(func.count(models.ToyItem.id), func.max(models.ToyItem.updated_at)).filter(
+        models.ToyItem.factory_name.in_(factories)
+    ).one()
+    return f"{count}:{latest.isoformat() if latest else ''}"
+
+
+def find_unchanged_file(db, file_hash, factory_name):
+    """同一文件（内容哈希相同）以相同厂名导入过，且之后相关记录没有变化时返回导入记录"""
+    record = db.query(models.ImportFile).filter(
+        models.ImportFile.file_hash == file_hash,
+        models.ImportFile.factory_name == factory_name
+    ).first()
+    if record and record.snapshot == factory_snapshot(db, json.loads(record.factories or "[]")):
+        return record
+    return None
+
+
+def record_import_file(db, file_hash, filename, factory_name, factories, row_count):
+    record = db.query(models.ImportFile).filter(
+        models.ImportFile.file_hash == file_hash,
+        models.ImportFile.factory_name == factory_name
+    ).first()
+    if record is None:
+        record = models.ImportFile(file_hash=file_hash, factory_name=factory_name)
+        db.add(record)
+    record.file_name = filename
+    record.factories = json.dumps(sorted(factories), ensure_ascii=False)
+    record.snapshot = factory_snapshot(db, factories)
+    record.row_count = row_count
+    db.commit()
+
+
+def import_workbook_sync(
+    file_path,
+    filename,
+    factory_name,
+    db,
+    batch_size=IMPORT_BATCH_SIZE,
+    max_workers=8,
+    max_image_size=3500,
+    image_quality=100,
+    timeout_per_image=10,
+    progress=None,
+    mode="insert",
+    file_hash=None  # 调用方已计算的文件SHA-256（如分块上传完成时），未提供时按需计算
+):
+    """import_workbook的同步实现，会阻塞当前线程直到导入完成"""
+    validate_mode(mode)
+    start_time = time.time()
+    try:
+        if mode == "upsert":
+            # 内容完全相同的文件之前已导入且数据没有被修改过，无需解析
+            file_hash = file_hash or file_sha256(file_path)
+            previous = find_unchanged_file(db, file_hash, factory_name)
+            if previous:
+                logger.info(f"文件与 {previous.created_at} 导入的 {previous.file_name} 相同，跳过导入")
+                return {
+                    "imported_count": 0,
+                    "inserted": 0,
+                    "updated": 0,
+                    "unchanged": previous.row_count,
+                    "duplicate_file": True,
+                    "message": "文件与之前导入的相同，数据未变化",
+                    "total_time": f"{time.time() - start_time:.2f}秒",
+                    "rows_per_second": 0.0
+                }
+
+        # 1. 将.xlsx文件当作zip文件打开，按绘图XML中的锚点提取各行引用的图片
+        images, anchors = {}, {}
+        image_extraction_start = time.time()
+        if filename.endswith('.xlsx'):
+            images, anchors = extract_images(file_path)
+        extraction_elapsed = time.time() - image_extraction_start
+        metrics_service.observe("import", "extract_images", extraction_elapsed)
+        logger.info(f"图片提取耗时: {extraction_elapsed:.2f}秒")
+        report_progress(progress, "extract_images", len(images), len(images))
+
+        # 2. 预处理图片 - 在进程池中并行处理所有被引用的图片，每张图片只处理一次
+        image_paths = {}
+        if images:
+            logger.info(f"开始并行处理 {len(images)} 张图片")
+            image_processing_start = time.time()
+            image_paths = process_images(
+                images,
+                max_workers=max_workers,
+                max_image_size=max_image_size,
+                image_quality=image_quality,
+                timeout_per_image=timeout_per_image,
+                progress=progress
+            )
+            processing_elapsed = time.time() - image_processing_start
+            metrics_service.observe("import", "process_images", processing_elapsed)
+            metrics_service.IMAGES_PROCESSED.labels("import").inc(len(image_paths))
+            logger.info(f"图片处理完成，共处理 {len(image_paths)} 张图片，耗时: {processing_elapsed:.2f}秒")
+            # 图片数据已处理完毕，尽早释放内存
+            images = None
+        # 工作表名 -> {行号: 图片相对路径}
+        row_images = {
+            sheet_title: {row: image_paths[media] for row, media in rows.items() if media in image_paths}
+            for sheet_title, rows in anchors.items()
+        }
+
+        # 3. 以只读模式流式读取各sheet数据，逐行解析而不是一次性加载全部单元格
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            counts, sheet_count, rows_elapsed = import_sheets(
+                workbook, factory_name, db, row_images,
+                batch_size=batch_size, progress=progress, start_time=start_time, mode=mode
+            )
+        finally:
+            # 只读模式会一直占用文件句柄，需显式关闭
+            workbook.close()
+        total_imported = counts["inserted"] + counts["updated"]
+        # 更新后被替换的旧图片：全部工作表提交后，删除已没有记录引用的图片
+        if counts["replaced_images"]:
+            image_service.release_images(db, counts["replaced_images"])
+        if mode == "upsert":
+            record_import_file(
+                db, file_hash, filename, factory_name, counts["factories"],
+                total_imported + counts["unchanged"]
+            )
+
+        total_time = time.time() - start_time
+        metrics_service.observe("import", "total", total_time)
         # 返回导入结果
         return {
             "imported_count": total_imported,
-            "message": f"成功导入{len(workbook.worksheets)}个工作表",
-            "total_time": f"{total_time:.2f}秒"
+            "inserted": counts["inserted"],
+            "updated": counts["updated"],
+            "unchanged": counts["unchanged"],
+            "duplicate_file": False,
+            "message": f"成功导入{sheet_count}个工作表",
+            "total_time": f"{total_time:.2f}秒",
+            "rows_per_second": round(rows_per_second(total_imported + counts["unchanged"], rows_elapsed), 1)
         }
 
+    except HTTPException:
+        # 文件内容校验失败（如缺少必要的列）直接返回给调用方
+        try:
+            db.rollback()
+        except Exception as rollback_error:
+            logger.error(f"回滚失败: {rollback_error}")
+        raise
     except Exception as e:
         # 回滚事务
         try:
@@ -467,7 +666,225 @@ async def import_items(
             logger.error(f"回滚失败: {rollback_error}")
         raise HTTPException(status_code=500, detail=f"导入失败: {str(e)}")
 
-    finally:
-        # 清理临时文件
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
\ No newline at end of file
+
+def rows_per_second(count, elapsed):
+    return count / elapsed if elapsed > 0 else 0.0
+
+
+def cell_value(row, field_indices, field):
+    """按表头映射取当前行某字段的值，只读模式下行尾的空单元格可能不返回"""
+    index = field_indices.get(field)
+    if index is None or index >= len(row):
+        return None
+    return row[index]
+
+
+def existing_fingerprints(db, rows):
+    """查询与这批行(厂名, 货号)相同的已有记录，返回 {(厂名, 货号): [(记录ID, 行指纹, 图片路径), ...]}"""
+    codes_by_factory = {}
+    for values in rows:
+        factory, code = row_key(values)
+        codes_by_factory.setdefault(factory, set()).add(code)
+    existing = {}
+    for factory, codes in codes_by_factory.items():
+        for chunk in database.chunked(sorted(codes)):
+            query = db.query(
+                models.ToyItem.id, models.ToyItem.factory_code, models.ToyItem.row_fingerprint, models.ToyItem.image_path
+            ).filter(
+                models.ToyItem.factory_name == factory,
+                models.ToyItem.factory_code.in_(chunk)
+            )
+            for item_id, code, fingerprint, image_path in query:
+                existing.setdefault((factory, str(code)), []).append((item_id, fingerprint, image_path))
+    return existing
+
+
+def write_batch(db, rows, mode, counts):
+    """写入一批行数据并累加counts中的新增/更新/未变化数
+
+    upsert模式下按(厂名, 货号)匹配已有记录：指纹相同的跳过，不同的原地更新（重复的记录都更新），没有的新增。
+    行中没有处理成功的图片（图片无效或处理超时）时保留记录原有的图片；被替换的旧图片路径
+    加入counts["replaced_images"]，提交后由调用方删除已无引用的图片。
+    """
+    if mode != "upsert":
+        db.execute(insert(models.ToyItem.__table__), rows)
+        counts["inserted"] += len(rows)
+        return
+    existing = existing_fingerprints(db, rows)
+    inserts, updates = [], []
+    now = datetime.now()
+    for values in rows:
+        matches = existing.get(row_key(values))
+        if not matches:
+            inserts.append(values)
+            continue
+        changed = []
+        for item_id, fingerprint, image_path in matches:
+            merged = values
+            if values["image_path"] is None and image_path:
+                merged = {**values, "image_path": image_path}
+                merged["row_fingerprint"] = row_fingerprint(merged)
+            if fingerprint == merged["row_fingerprint"]:
+                continue
+            changed.append({**merged, "id": item_id, "updated_at": now})
+            if image_path and image_path != merged["image_path"]:
+                counts["replaced_images"].add(image_path)
+        if changed:
+            updates.extend(changed)
+            counts["updated"] += 1
+        else:
+            counts["unchanged"] += 1
+    if inserts:
+        db.execute(insert(models.ToyItem.__table__), inserts)
+        counts["inserted"] += len(inserts)
+    if updates:
+        # 按主键批量更新（executemany），不加载ORM对象
+        db.execute(update(models.ToyItem), updates)
+
+
+def import_sheets(workbook, factory_name, db, row_images, batch_size=IMPORT_BATCH_SIZE, progress=None, start_time=None,
+                  mode="insert"):
+    """逐个工作表流式解析、校验并分批写入数据库，返回(统计, 工作表数, 行数据耗时秒数)
+
+    row_images为 {工作表名: {行号: 图片相对路径}}。统计包含inserted/updated/unchanged行数、
+    涉及的厂名集合factories和被替换的旧图片路径集合replaced_images。
+    """
+    start_time = start_time or time.time()
+    worksheets = workbook.worksheets
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "factories": set(), "replaced_images": set()}
+    rows_elapsed = 0.0  # 解析和写入行数据的累计耗时（不含图片处理）
+
+    # 遍历所有工作表
+    for sheet_idx, sheet in enumerate(worksheets, 1):
+        rows = sheet.iter_rows(values_only=True)
+        # 获取表头（第一行）
+        headers = next(rows, None)
+        # 只读模式下行数来自文件中记录的表格范围，可能缺失
+        row_total = sheet.max_row - 1 if sheet.max_row else 0
+        first_row = next(rows, None)
+        # 跳过空表
+        if headers is None or first_row is None:
+            continue
+        logger.info(f"正在处理工作表 {sheet.title}（第{sheet_idx}个），共{row_total}行数据")
+
+        # 找出每个字段在Excel中的列索引
+        field_indices = {}
+        for i, header in enumerate(headers):
+            if header in FIELD_MAPPING:
+                field_indices[FIELD_MAPPING[header]] = i
+
+        # 检查必填字段是否存在
+        missing_fields = [field for field in REQUIRED_FIELDS if field not in field_indices]
+        if missing_fields:
+            missing_headers = [key for key, value in FIELD_MAPPING.items() if value in missing_fields]
+            raise HTTPException(status_code=400, detail=f"Excel文件缺少必要的列: {', '.join(missing_headers)}")
+
+        # 导入数据：整个工作表在一个事务中写入，每batch_size行批量执行一次
+        data_import_start = time.time()
+        sheet_start_counts = dict(counts)
+        processed_count = 0
+        batch_rows = []  # 待写入的行数据
+        batch_keys = set()  # 本批行的(厂名, 货号)
+
+        # 本工作表中锚定在各行的图片
+        sheet_images = row_images.get(sheet.title, {}) if "image_path" in field_indices else {}
+        data_rows = itertools.chain([first_row], rows)
+        for row_idx, row in enumerate(data_rows, start=2):  # 从第二行开始（跳过表头）
+            try:
+                # 获取锚定在当前行的图片路径（如果有）
+                image_path = sheet_images.get(row_idx)
+                if image_path:
+                    logger.debug(f"第 {row_idx} 行关联图片: {image_path}")
+
+                # 构造行数据，直接用于Core批量插入，不创建ORM对象
+                values = {
+                    "factory_code": cell_value(row, field_indices, "factory_code"),
+                    "factory_name": cell_value(row, field_indices, "factory_name") if "factory_name" in field_indices else factory_name,
+                    "name": cell_value(row, field_indices, "name"),
+                    "packaging": cell_value(row, field_indices, "packaging"),
+                    "packing_quantity": clean_int_value(cell_value(row, field_indices, "packing_quantity")),
+                    "unit_price": validate_unit_price(cell_value(row, field_indices, "unit_price"), row_idx, "单价"),
+                    "gross_weight": clean_numeric_value(cell_value(row, field_indices, "gross_weight")),
+                    "net_weight": clean_numeric_value(cell_value(row, field_indices, "net_weight")),
+                    "outer_box_size": cell_value(row, field_indices, "outer_box_size"),
+                    "product_size": cell_value(row, field_indices, "product_size"),
+                    "inner_box": cell_value(row, field_indices, "inner_box"),
+                    "remarks": cell_value(row, field_indices, "remarks"),
+                    "image_path": image_path,
+                    "origin_sheet": sheet.title  # 记录来源工作表
+                }
+
+                # 如果提供了厂名但Excel中没有厂名字段，使用表单提供的厂名
+                if not values["factory_name"]:
+                    values["factory_name"] = factory_name
+
+                # 检查必填字段
+                missing_fields = []
+                if not values["factory_code"]:
+                    missing_fields.append("货号")
+                if not values["name"]:
+                    missing_fields.append("品名")
+                if not values["packaging"]:
+                    missing_fields.append("包装")
+
+                if missing_fields:
+                    logger.warning(f"导入第 {row_idx} 行时缺少必填字段: {', '.join(missing_fields)}")
+                    continue
+
+                values["row_fingerprint"] = row_fingerprint(values)
+                key = row_key(values)
+                counts["factories"].add(key[0])
+                if mode == "upsert" and key in batch_keys:
+                    # 同一货号在文件中出现多次时后面的行覆盖前面的：先写入本批，再按已有记录处理
+                    write_batch(db, batch_rows, mode, counts)
+                    processed_count += len(batch_rows)
+                    batch_rows, batch_keys = [], set()
+                batch_rows.append(values)
+                batch_keys.add(key)
+            except Exception as e:
+                error_msg = f"导入第 {row_idx} 行时出错: {e}"
+                logger.error(error_msg)
+                # 立即停止导入并返回错误信息，本工作表已写入的数据随事务一起回滚
+                try:
+                    db.rollback()
+                except Exception as rollback_error:
+                    logger.error(f"回滚失败: {rollback_error}")
+                raise Exception(f"Excel导入失败: {error_msg}")
+
+            # 达到批处理大小时批量写入（executemany），事务在工作表结束时统一提交
+            if len(batch_rows) >= batch_size:
+                write_batch(db, batch_rows, mode, counts)
+                processed_count += len(batch_rows)
+                batch_rows, batch_keys = [], set()
+                report_progress(progress, "import_rows", processed_count, row_total, sheet.title)
+
+        # 写入剩余的行
+        if batch_rows:
+            write_batch(db, batch_rows, mode, counts)
+            processed_count += len(batch_rows)
+        imported_count = sum(counts[name] - sheet_start_counts[name] for name in ("inserted", "updated"))
+
+        # 提交事务
+        commit_start = time.time()
+        metrics_service.observe("import", "import_rows", commit_start - data_import_start)
+        db.commit()
+        # 新数据已可见，列表缓存失效
+        cache_service.invalidate_items()
+        commit_elapsed = time.time() - commit_start
+        metrics_service.observe("import", "commit", commit_elapsed)
+        metrics_service.ROWS_PROCESSED.labels("import").inc(imported_count)
+        logger.info(f"数据库提交耗时: {commit_elapsed:.2f}秒")
+        sheet_elapsed = time.time() - data_import_start
+        rows_elapsed += sheet_elapsed
+        logger.info(
+            f"工作表 {sheet.title} 导入 {imported_count} 行（未变化 {counts['unchanged'] - sheet_start_counts['unchanged']} 行），"
+            f"耗时: {sheet_elapsed:.2f}秒，{rows_per_second(processed_count, sheet_elapsed):.0f} 行/秒"
+        )
+
+        # 计算总耗时
+        total_time = time.time() - start_time
+        logger.info(f"总耗时: {total_time:.2f}秒")
+
+        report_progress(progress, "sheets", sheet_idx, len(worksheets), sheet.title)
+
+    return counts, len(worksheets), rows_elapsed
@@ -0,0 +1,297 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import ctypes
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import logging
+import models
+import import_service
+import export_service
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 任务的输入文件和结果文件目录（不对外提供静态访问）
+JOBS_DIR = os.path.join(BASE_DIR, "jobs")
+# 同时执行的后台任务数，可通过环境变量调整
+JOB_WORKERS = int(os.environ.get("TOY_JOB_WORKERS", 2))
+# 进度写入数据库的最小间隔（秒），阶段变化时总会立即写入
+PROGRESS_INTERVAL = 0.5
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# 当前进程的标识，多个uvicorn进程共用数据库时用于区分任务归属
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Windows上查询进程状态用到的常量
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+ERROR_ACCESS_DENIED = 5
+STILL_ACTIVE = 259
+
+
+class JobCancelled(Exception):
+    """任务被用户取消"""
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def new_job_file(suffix):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    return os.path.join(JOBS_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+
+def submit(db, kind, params, input_path=None):
+    """创建任务记录并交给后台线程执行，立即返回任务ID"""
+    job = models.Job(
+        id=uuid.uuid4().hex,
+        kind=kind,
+        status=STATUS_PENDING,
+        params=json.dumps(params, ensure_ascii=False),
+        input_path=input_path,
+        worker=WORKER_ID
+    )
+    db.add(job)
+    db.commit()
+    _get_executor().submit(run_job, job.id)
+    return job.id
+
+
+def request_cancel(db, job):
+    """请求取消任务：未开始的任务直接取消，运行中的任务在下次报告进度时停止"""
+    if job.status in FINISHED_STATUSES:
+        return job
+    job.cancel_requested = True
+    if job.status == STATUS_PENDING:
+        job.status = STATUS_CANCELLED
+        job.finished_at = datetime.now()
+    db.commit()
+    return job
+
+
+def to_dict(job):
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "stage": job.stage,
+        "progress_done": job.progress_done,
+        "progress_total": job.progress_total,
+        "message": job.message,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "has_result_file": bool(job.result_path),
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
+
+
+def _worker_alive(worker):
+    """判断任务所属进程是否仍在运行，只能判断本机进程，其他主机的任务视为存活"""
+    if not worker or ":" not in worker:
+        return False
+    host, pid = worker.rsplit(":", 1)
+    if host != socket.gethostname():
+        return True
+    try:
+        return _pid_alive(int(pid))
+    except ValueError:
+        return False
+
+
+def _pid_alive(pid):
+    """本机进程是否仍在运行
+
+    Windows上os.kill(pid, 0)会向进程组发送CTRL_C_EVENT而不是探测进程，改用OpenProcess查询退出码。
+    """
+    if os.name == "nt":
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            # 拒绝访问说明进程存在，只是属于其他用户
+            return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def recover_jobs(session_factory=None):
+    """服务重启后，所属进程已退出的未完成任务无法继续，标记为失败"""
+    db = (session_factory or models.SessionLocal)()
+    try:
+        stale = [
+            job for job in db.query(models.Job).filter(models.Job.status.in_([STATUS_PENDING, STATUS_RUNNING]))
+            if job.worker != WORKER_ID and not _worker_alive(job.worker)
+        ]
+        for job in stale:
+            job.status = STATUS_FAILED
+            job.error = "服务重启，任务已中断"
+            job.finished_at = datetime.now()
+            _remove_file(job.input_path)
+        db.commit()
+        if stale:
+            logger.info(f"已将 {len(stale)} 个中断的任务标记为失败")
+    finally:
+        db.close()
+
+
+def _remove_file(path):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except Exception as e:
+            logger.error(f"删除任务文件失败: {path} - {str(e)}")
+
+
+class JobContext:
+    """任务执行上下文：把进度写入任务表，并检查是否已被取消"""
+
+    def __init__(self, job_id, session_factory):
+        self.job_id = job_id
+        self.session_factory = session_factory
+        self._last_write = 0.0
+        self._last_stage = None
+
+    def progress(self, stage, done=0, total=0, message=None):
+        now = time.monotonic()
+        if stage == self._last_stage and now - self._last_write < PROGRESS_INTERVAL and done != total:
+            return
+        self._last_stage = stage
+        self._last_write = now
+        db = self.session_factory()
+        try:
+            job = db.get(models.Job, self.job_id)
+            if job.cancel_requested:
+                raise JobCancelled()
+            job.stage = stage
+            job.progress_done = done
+            job.progress_total = total
+            job.message = message
+            db.commit()
+        finally:
+            db.close()
+
+
+def _run_import(job, params, context, session_factory):
+    db = session_factory()
+    try:
+        # 任务本身已在后台线程中执行，直接调用同步实现
+        return import_service.import_workbook_sync(
+            job.input_path, params["filename"], params["factory_name"], db,
+            progress=context.progress,
+            mode=params.get("mode", "insert"),
+            file_hash=params.get("file_hash")
+        ), None
+    finally:
+        db.close()
+
+
+def _run_export(job, params, context, session_factory):
+    result_path = new_job_file(".xlsx")
+    try:
+        with open(result_path, "wb") as f:
+            for chunk in export_service.stream_export(params["item_ids"], session_factory, progress=context.progress):
+                f.write(chunk)
+    except BaseException:
+        _remove_file(result_path)
+        raise
+    return {"file_name": params["file_name"]}, result_path
+
+
+def _run_gc(job, params, context, session_factory):
+    # storage_service依赖本模块的任务目录和状态常量，在此延迟导入
+    import storage_service
+    return storage_service.collect_garbage(
+        session_factory, dry_run=params.get("dry_run", False), progress=context.progress
+    ), None
+
+
+HANDLERS = {
+    "import": _run_import,
+    "export": _run_export,
+    "gc": _run_gc,
+}
+
+
+def run_job(job_id, session_factory=None):
+    """在后台线程中执行任务，结束时写入结果或错误"""
+    session_factory = session_factory or models.SessionLocal
+    db = session_factory()
+    try:
+        job = db.get(models.Job, job_id)
+        if job is None:
+            return
+        if job.status != STATUS_PENDING:
+            # 排队期间已被取消
+            _remove_file(job.input_path)
+            return
+        job.status = STATUS_RUNNING
+        job.started_at = datetime.now()
+        db.commit()
+        params = json.loads(job.params or "{}")
+        context = JobContext(job_id, session_factory)
+
+        status, result, result_path, error = STATUS_SUCCEEDED, None, None, None
+        try:
+            result, result_path = HANDLERS[job.kind](job, params, context, session_factory)
+        except Exception as e:
+            db.expire_all()
+            if isinstance(e, JobCancelled) or db.get(models.Job, job_id).cancel_requested:
+                status = STATUS_CANCELLED
+                logger.info(f"任务已取消: {job_id}")
+            else:
+                status = STATUS_FAILED
+                error = getattr(e, "detail", None) or str(e)
+                logger.error(f"任务执行失败: {job_id} - {error}")
+
+        job = db.get(models.Job, job_id)
+        job.status = status
+        job.result = json.dumps(result, ensure_ascii=False, default=str) if result is not None else None
+        job.result_path = result_path
+        job.error = error
+        job.finished_at = datetime.now()
+        db.commit()
+        _remove_file(job.input_path)
+    except Exception as e:
+        logger.error(f"任务状态更新失败: {job_id} - {str(e)}")
+    finally:
+        db.close()
@@ -3,12 +3,24 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import routers
 import models
+import search_service
+import image_service
+import job_service
+import storage_service
+import metrics_service
+import profiling_service
 import os
 
 app = FastAPI()
 
 # 初始化数据库表
 models.create_tables()
+# 初始化全文检索索引
+search_service.ensure_search_index(models.engine)
+# 上次运行中断的后台任务标记为失败
+job_service.recover_jobs()
+# 定期回收没有记录引用的图片和过期的临时文件
+storage_service.start_periodic_gc()
 
 # 添加CORS中间件
 app.add_middleware(
@@ -18,12 +30,36 @@ app.add_middleware(
     allow_methods=["*"],  # 允许所有HTTP方法
     allow_headers=["*"],  # 允许所有HTTP头
 )
+# 按需剖析请求（TOY_PROFILING=on时生效），慢请求自动保存剖析结果
+app.add_middleware(profiling_service.ProfilingMiddleware)
+# 记录每个请求的次数和耗时，通过/metrics导出（最后添加，位于最外层，耗时包含其他中间件）
+app.add_middleware(metrics_service.MetricsMiddleware)
 
 # 注册路由
 app.include_router(routers.router)
 
+class CachedStaticFiles(StaticFiles):
+    """为上传图片添加缓存头：内容寻址的文件长期缓存，其余文件通过ETag协商缓存"""
+
+    def file_response(self, full_path, *args, **kwargs):
+        response = super().file_response(full_path, *args, **kwargs)
+        response.headers["Cache-Control"] = image_service.cache_control_for(str(full_path))
+        return response
+
 # 配置静态文件服务
-app.mount("/uploads", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "uploads")), name="uploads")
+app.mount("/uploads", CachedStaticFiles(directory=os.path.join(os.path.dirname(__file__), "uploads")), name="uploads")
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    # 关闭后台任务线程池、图片处理进程池和定期回收线程
+    job_service.shutdown()
+    storage_service.stop_periodic_gc()
+    image_service.shutdown_process_pool()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    # 关闭异步引擎的连接池
+    await models.async_engine.dispose()
 
 @app.get("/")
 async def read_root():
@@ -0,0 +1,125 @@
+from contextlib import contextmanager
+import os
+import time
+import logging
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 多个uvicorn进程时设置PROMETHEUS_MULTIPROC_DIR，各进程的指标写入该目录，由/metrics汇总
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# 接口耗时：列表查询在毫秒级，导入导出可达数分钟
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# 导入导出各阶段与数据库查询的耗时
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HTTP_REQUESTS = Counter(
+    "toy_http_requests_total", "HTTP请求数", ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "toy_http_request_duration_seconds", "HTTP请求耗时（含流式响应的发送时间）",
+    ["method", "route"], buckets=REQUEST_BUCKETS
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "toy_http_requests_in_progress", "正在处理的HTTP请求数", ["method"], multiprocess_mode="livesum"
+)
+# operation为import/export/list，stage为其中的阶段
+STAGE_DURATION = Histogram(
+    "toy_stage_duration_seconds", "导入、导出和列表查询各阶段耗时",
+    ["operation", "stage"], buckets=STAGE_BUCKETS
+)
+ROWS_PROCESSED = Counter(
+    "toy_rows_processed_total", "导入写入和导出生成的行数", ["operation"]
+)
+IMAGES_PROCESSED = Counter(
+    "toy_images_processed_total", "导入处理和导出写入的图片数", ["operation"]
+)
+LIST_CACHE_REQUESTS = Counter(
+    "toy_list_cache_requests_total", "列表查询缓存命中情况", ["result"]
+)
+DB_PING_DURATION = Histogram(
+    "toy_db_ping_duration_seconds", "就绪检查中数据库往返耗时", buckets=STAGE_BUCKETS
+)
+
+# 未匹配到路由的请求（如404）统一归为一类，避免任意路径产生大量标签
+UNMATCHED_ROUTE = "unmatched"
+
+
+def observe(operation, stage, seconds):
+    """记录已测得的阶段耗时"""
+    STAGE_DURATION.labels(operation, stage).observe(seconds)
+
+
+@contextmanager
+def timer(operation, stage):
+    """记录代码块耗时到STAGE_DURATION，出错时同样记录"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(operation, stage, time.perf_counter() - start)
+
+
+def route_label(scope):
+    """取路由模板（如/items/{item_id}）作为标签，而不是实际路径"""
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    # 挂载的静态文件等没有APIRoute，取挂载前缀
+    root_path = scope.get("root_path") or ""
+    app_root = scope.get("app_root_path") or ""
+    if root_path and root_path != app_root:
+        return root_path[len(app_root):] or UNMATCHED_ROUTE
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """记录每个HTTP请求的次数和耗时
+
+    使用纯ASGI中间件而不是@app.middleware("http")：耗时计到响应体最后一块发送完毕，
+    流式导出的耗时才完整；同时不会把StreamingResponse再包一层。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.labels(method).dec()
+            route = route_label(scope)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - start)
+
+
+def render_metrics():
+    """返回(Prometheus文本格式的指标, Content-Type)"""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,73 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+import database
+import models
+import search_service
+
+config = context.config
+
+# 通过命令行执行时按alembic.ini配置日志；应用启动时由程序调用，保留应用自己的日志配置
+if config.config_file_name is not None and not config.attributes.get("skip_logging_config"):
+    fileConfig(config.config_file_name)
+
+target_metadata = models.Base.metadata
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # 全文索引表及其影子表由search_service维护（仅SQLite），不纳入迁移
+    if type_ == "table" and reflected and compare_to is None and name.startswith(search_service.FTS_TABLE):
+        return False
+    return True
+
+
+def database_url():
+    return config.attributes.get("url") or database.DATABASE_URL
+
+
+def run_migrations_offline():
+    """只生成SQL脚本，不连接数据库（alembic upgrade head --sql）"""
+    context.configure(
+        url=database_url(),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=database.is_sqlite(database_url()),
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        # 由database.run_migrations传入已有连接
+        _run_with_connection(connection)
+        return
+
+    engine = database.create_db_engine(database_url())
+    try:
+        with engine.connect() as connection:
+            _run_with_connection(connection)
+    finally:
+        engine.dispose()
+
+
+def _run_with_connection(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite不支持大部分ALTER TABLE，用批量模式重建表
+        render_as_batch=connection.dialect.name == "sqlite",
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
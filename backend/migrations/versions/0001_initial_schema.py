@@ -0,0 +1,80 @@
+"""初始结构：toy_items、jobs
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+升级前由create_all创建的数据库已有这些表，迁移只补建缺少的表和索引。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _create_index_if_missing(inspector, table, name, columns):
+    if name not in {index["name"] for index in inspector.get_indexes(table)}:
+        op.create_index(name, table, columns)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if "toy_items" not in tables:
+        op.create_table(
+            "toy_items",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("factory_code", sa.String(100), comment="货号"),
+            sa.Column("factory_name", sa.String(64), comment="厂名"),
+            sa.Column("name", sa.String(100), comment="品名"),
+            sa.Column("packaging", sa.String(100), comment="包装"),
+            sa.Column("packing_quantity", sa.Integer(), comment="装箱量PCS"),
+            sa.Column("unit_price", sa.Numeric(10, 3), comment="单价"),
+            sa.Column("gross_weight", sa.Float(), comment="毛重KG"),
+            sa.Column("net_weight", sa.Float(), comment="净重KG"),
+            sa.Column("outer_box_size", sa.String(100), comment="外箱规格CM"),
+            sa.Column("product_size", sa.String(100), comment="产品规格"),
+            sa.Column("inner_box", sa.String(100), comment="内箱"),
+            sa.Column("remarks", sa.String(255), comment="备注"),
+            sa.Column("image_path", sa.String(255), comment="图片路径"),
+            sa.Column("origin_sheet", sa.String(255), comment="来源工作表名称"),
+            sa.Column("created_at", sa.DateTime()),
+            sa.Column("updated_at", sa.DateTime()),
+        )
+    _create_index_if_missing(inspector, "toy_items", "ix_toy_items_id", ["id"])
+    _create_index_if_missing(inspector, "toy_items", "ix_toy_items_updated_at_id", ["updated_at", "id"])
+
+    if "jobs" not in tables:
+        op.create_table(
+            "jobs",
+            sa.Column("id", sa.String(32), primary_key=True, comment="任务ID"),
+            sa.Column("kind", sa.String(16), nullable=False, comment="任务类型：import/export"),
+            sa.Column("status", sa.String(16), nullable=False, comment="状态：pending/running/succeeded/failed/cancelled"),
+            sa.Column("stage", sa.String(32), comment="当前阶段"),
+            sa.Column("progress_done", sa.Integer(), comment="当前阶段已完成数量"),
+            sa.Column("progress_total", sa.Integer(), comment="当前阶段总数量"),
+            sa.Column("message", sa.String(255), comment="进度说明"),
+            sa.Column("params", sa.Text(), comment="任务参数（JSON）"),
+            sa.Column("input_path", sa.String(255), comment="输入文件路径"),
+            sa.Column("result", sa.Text(), comment="任务结果（JSON）"),
+            sa.Column("result_path", sa.String(255), comment="结果文件路径"),
+            sa.Column("error", sa.Text(), comment="错误信息"),
+            sa.Column("cancel_requested", sa.Boolean(), comment="是否已请求取消"),
+            sa.Column("worker", sa.String(128), comment="执行任务的进程（主机名:PID）"),
+            sa.Column("created_at", sa.DateTime()),
+            sa.Column("started_at", sa.DateTime()),
+            sa.Column("finished_at", sa.DateTime()),
+            sa.Column("updated_at", sa.DateTime()),
+        )
+
+
+def downgrade():
+    op.drop_table("jobs")
+    op.drop_index("ix_toy_items_updated_at_id", table_name="toy_items")
+    op.drop_index("ix_toy_items_id", table_name="toy_items")
+    op.drop_table("toy_items")
@@ -0,0 +1,49 @@
+"""小写检索列及筛选/排序索引
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# 检索列名 -> (原字段, 长度)
+LOWER_COLUMNS = {
+    "factory_code_lower": ("factory_code", 100),
+    "factory_name_lower": ("factory_name", 64),
+    "name_lower": ("name", 100),
+}
+INDEXES = {
+    "ix_toy_items_factory_name_lower_updated_at": ["factory_name_lower", "updated_at", "id"],
+    "ix_toy_items_factory_code_lower": ["factory_code_lower"],
+    "ix_toy_items_name_lower": ["name_lower"],
+}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column["name"] for column in inspector.get_columns("toy_items")}
+    for name, (source, length) in LOWER_COLUMNS.items():
+        if name not in columns:
+            # 生成列由数据库维护，导入、接口和手工SQL写入都会自动更新
+            op.add_column("toy_items", sa.Column(name, sa.String(length), sa.Computed(f"lower({source})")))
+
+    indexes = {index["name"] for index in inspector.get_indexes("toy_items")}
+    for name, index_columns in INDEXES.items():
+        if name not in indexes:
+            op.create_index(name, "toy_items", index_columns)
+
+
+def downgrade():
+    for name in INDEXES:
+        op.drop_index(name, table_name="toy_items")
+    with op.batch_alter_table("toy_items") as batch_op:
+        for name in LOWER_COLUMNS:
+            batch_op.drop_column(name)
@@ -0,0 +1,48 @@
+"""增量导入：行内容指纹、(厂名, 货号)索引及已导入文件表
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column["name"] for column in inspector.get_columns("toy_items")}
+    if "row_fingerprint" not in columns:
+        # 已有记录没有指纹，首次增量导入时按内容不同处理，原地更新后写入指纹
+        op.add_column("toy_items", sa.Column("row_fingerprint", sa.String(64), comment="导入行内容指纹"))
+    if "ix_toy_items_factory_name_code" not in {index["name"] for index in inspector.get_indexes("toy_items")}:
+        op.create_index("ix_toy_items_factory_name_code", "toy_items", ["factory_name", "factory_code"])
+
+    if "import_files" not in inspector.get_table_names():
+        op.create_table(
+            "import_files",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("file_hash", sa.String(64), nullable=False, comment="文件内容SHA-256"),
+            sa.Column("factory_name", sa.String(64), nullable=False, comment="导入时填写的厂名"),
+            sa.Column("file_name", sa.String(255), comment="上传的文件名"),
+            sa.Column("factories", sa.Text(), comment="导入涉及的厂名（JSON）"),
+            sa.Column("snapshot", sa.String(64), comment="导入完成时这些厂名的记录数与最后更新时间"),
+            sa.Column("row_count", sa.Integer(), comment="导入的行数"),
+            sa.Column("created_at", sa.DateTime()),
+            sa.Column("updated_at", sa.DateTime()),
+        )
+        op.create_index("ix_import_files_hash_factory", "import_files", ["file_hash", "factory_name"], unique=True)
+
+
+def downgrade():
+    op.drop_index("ix_import_files_hash_factory", table_name="import_files")
+    op.drop_table("import_files")
+    op.drop_index("ix_toy_items_factory_name_code", table_name="toy_items")
+    with op.batch_alter_table("toy_items") as batch_op:
+        batch_op.drop_column("row_fingerprint")
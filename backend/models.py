@@ -1,14 +1,20 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, create_engine, Numeric
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Numeric, Index, Boolean, Text, Computed
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, deferred
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from datetime import datetime
 import os
+import database
 
-# 创建数据库连接
+# 创建数据库连接（连接地址、连接池和SQLite调优参数见database.py）
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, 'toy_management.db')}"
-engine = create_engine(DATABASE_URL)
+DATABASE_URL = database.DATABASE_URL
+engine = database.create_db_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 异步引擎与会话：列表查询和货物增删改使用，数据库IO期间不阻塞事件循环
+# 提交后不过期对象属性，避免返回结果时触发异步会话中不允许的隐式加载
+async_engine = database.create_async_db_engine(DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -33,19 +39,84 @@ class ToyItem(Base):
     origin_sheet = Column(String(255), default='', comment='来源工作表名称')
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    # 小写规范化的检索列，由数据库根据原字段自动计算，用于不区分大小写的精确/前缀匹配
+    # 只在查询条件中使用，加载记录时不读取；SQLite的lower()只转换ASCII字母，检索词按同样规则转换（见search_service.fold_term）
+    factory_code_lower = deferred(Column(String(100), Computed("lower(factory_code)"), comment="货号（小写）"))
+    factory_name_lower = deferred(Column(String(64), Computed("lower(factory_name)"), comment="厂名（小写）"))
+    name_lower = deferred(Column(String(100), Computed("lower(name)"), comment="品名（小写）"))
+    # 导入时按行内容（含图片路径，图片按内容命名）计算的指纹，重新导入时据此跳过未变化的行；接口修改后清空
+    row_fingerprint = Column(String(64), comment="导入行内容指纹")
+    
+    __table_args__ = (
+        # 列表默认排序及游标分页使用的复合索引
+        Index("ix_toy_items_updated_at_id", "updated_at", "id"),
+        # 按厂名筛选并按更新时间倒序（某工厂的最新货物）
+        Index("ix_toy_items_factory_name_lower_updated_at", "factory_name_lower", "updated_at", "id"),
+        # 按货号/品名精确或前缀查找
+        Index("ix_toy_items_factory_code_lower", "factory_code_lower"),
+        Index("ix_toy_items_name_lower", "name_lower"),
+        # 增量导入按(厂名, 货号)匹配已有记录
+        Index("ix_toy_items_factory_name_code", "factory_name", "factory_code"),
+    )
     
     def __repr__(self):
         return f"<ToyItem {self.factory_code}: {self.name}>"
 
+# 后台任务表（导入/导出任务的状态与进度）
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String(32), primary_key=True, comment="任务ID")
+    kind = Column(String(16), nullable=False, comment="任务类型：import/export")
+    status = Column(String(16), nullable=False, default="pending", comment="状态：pending/running/succeeded/failed/cancelled")
+    stage = Column(String(32), comment="当前阶段")
+    progress_done = Column(Integer, default=0, comment="当前阶段已完成数量")
+    progress_total = Column(Integer, default=0, comment="当前阶段总数量")
+    message = Column(String(255), comment="进度说明")
+    params = Column(Text, comment="任务参数（JSON）")
+    input_path = Column(String(255), comment="输入文件路径")
+    result = Column(Text, comment="任务结果（JSON）")
+    result_path = Column(String(255), comment="结果文件路径")
+    error = Column(Text, comment="错误信息")
+    cancel_requested = Column(Boolean, default=False, comment="是否已请求取消")
+    worker = Column(String(128), comment="执行任务的进程（主机名:PID）")
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f"<Job {self.id}: {self.kind} {self.status}>"
+
+# 已导入文件记录（增量导入时识别内容完全相同的文件）
+class ImportFile(Base):
+    __tablename__ = "import_files"
+
+    id = Column(Integer, primary_key=True)
+    file_hash = Column(String(64), nullable=False, comment="文件内容SHA-256")
+    factory_name = Column(String(64), nullable=False, default="", comment="导入时填写的厂名")
+    file_name = Column(String(255), comment="上传的文件名")
+    factories = Column(Text, comment="导入涉及的厂名（JSON）")
+    snapshot = Column(String(64), comment="导入完成时这些厂名的记录数与最后更新时间")
+    row_count = Column(Integer, default=0, comment="导入的行数")
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        Index("ix_import_files_hash_factory", "file_hash", "factory_name", unique=True),
+    )
+
+    def __repr__(self):
+        return f"<ImportFile {self.file_name}: {self.file_hash[:12]}>"
+
 # 创建数据库表
 def create_tables():
     # 检查数据库文件是否存在
-    db_path = os.path.join(BASE_DIR, 'toy_management.db')
-    db_exists = os.path.exists(db_path)
-    
-    # 创建所有表（如果不存在）
-    Base.metadata.create_all(bind=engine)
+    db_exists = not database.is_sqlite(DATABASE_URL) or os.path.exists(database.SQLITE_PATH)
     
+    # 通过迁移脚本创建或升级表结构（见migrations/versions）
+    database.run_migrations(engine)
+
     if not db_exists:
         print("数据库文件创建成功！")
     else:
@@ -57,4 +128,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# 获取异步数据库会话
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
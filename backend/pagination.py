@@ -0,0 +1,96 @@
+from fastapi import HTTPException
+from sqlalchemy import tuple_, select, func
+from datetime import datetime
+import base64
+import json
+import threading
+import time
+import models
+
+# 总数统计方式：exact精确统计，cached短时缓存精确值，none不统计
+TOTAL_MODES = ("exact", "cached", "none")
+# 缓存的总数有效期（秒）
+COUNT_CACHE_TTL = 30
+COUNT_CACHE_MAX_ENTRIES = 256
+
+
+def keyset_order():
+    # 游标分页的排序键，由复合索引ix_toy_items_updated_at_id支撑
+    return [models.ToyItem.updated_at.desc(), models.ToyItem.id.desc()]
+
+
+def encode_cursor(item):
+    """将当前页最后一条记录的(updated_at, id)编码为不透明的游标"""
+    payload = json.dumps([item.updated_at.isoformat(), item.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        updated_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(updated_at), int(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
+def apply_cursor(query, cursor):
+    """只取游标位置之后的记录，深翻页与第一页代价相同"""
+    updated_at, item_id = decode_cursor(cursor)
+    return query.filter(
+        tuple_(models.ToyItem.updated_at, models.ToyItem.id) < tuple_(updated_at, item_id)
+    )
+
+
+class CountCache:
+    """按筛选条件缓存总数，避免每次翻页都重复count全表"""
+
+    def __init__(self, ttl=COUNT_CACHE_TTL, max_entries=COUNT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回未过期的缓存总数，没有时返回None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] < self.ttl:
+                return entry[0]
+        return None
+
+    def put(self, key, total):
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                # 淘汰最早写入的条目
+                oldest = min(self._entries, key=lambda k: self._entries[k][1])
+                del self._entries[oldest]
+            self._entries[key] = (total, time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+count_cache = CountCache()
+
+
+async def count_rows(db, query):
+    """统计查询结果行数（与Query.count()相同，按子查询计数）"""
+    count_query = select(func.count()).select_from(query.order_by(None).subquery())
+    return (await db.execute(count_query)).scalar_one()
+
+
+async def count_total(db, query, total_mode, key):
+    if total_mode not in TOTAL_MODES:
+        raise HTTPException(status_code=400, detail=f"total_mode只支持: {', '.join(TOTAL_MODES)}")
+    if total_mode == "none":
+        return None
+    if total_mode == "cached":
+        total = count_cache.get(key)
+        if total is None:
+            total = await count_rows(db, query)
+            count_cache.put(key, total)
+        return total
+    return await count_rows(db, query)
@@ -0,0 +1,315 @@
+from collections import Counter
+from datetime import datetime
+from urllib.parse import parse_qs
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 性能剖析结果目录：<请求ID>.folded为折叠栈（可直接生成火焰图），<请求ID>.json为请求信息和样本最多的函数
+PROFILES_DIR = os.path.join(BASE_DIR, "profiles")
+
+# 总开关，关闭时请求头/查询参数不生效，也不自动采集慢请求
+PROFILING_ENABLED = os.environ.get("TOY_PROFILING", "off").lower() == "on"
+# 耗时超过此秒数的请求自动保存剖析结果，0表示只剖析显式要求的请求
+# 开启后每个请求都会采样（采样线程所有请求共用），请求结束时才决定是否保存
+SLOW_REQUEST_SECONDS = float(os.environ.get("TOY_PROFILE_SLOW_SECONDS", 0))
+# 采样间隔（秒）
+SAMPLE_INTERVAL = float(os.environ.get("TOY_PROFILE_INTERVAL", 0.01))
+# 最多保留的剖析结果数，超出时删除最早的
+PROFILE_KEEP = int(os.environ.get("TOY_PROFILE_KEEP", 100))
+# 摘要中每个排序列出的函数数
+TOP_FUNCTIONS = 30
+
+PROFILE_HEADER = "x-profile"
+PROFILE_QUERY = "profile"
+REQUEST_ID_HEADER = "x-request-id"
+# 请求ID用作文件名，只接受安全字符
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# 空闲线程的栈顶：事件循环等待IO、线程池等待任务、Event.wait等待唤醒，不计入剖析结果
+IDLE_FRAMES = {("selectors.py", "select"), ("thread.py", "_worker"), ("queue.py", "get")}
+
+
+def _frame_key(frame):
+    code = frame.f_code
+    return os.path.basename(code.co_filename), code.co_name
+
+
+def _is_idle(frame):
+    leaf = _frame_key(frame)
+    parent = _frame_key(frame.f_back) if frame.f_back else None
+    if leaf in IDLE_FRAMES or parent in IDLE_FRAMES:
+        return True
+    # Event.wait -> Condition.wait；等待Future结果时上一层不是threading.py，仍计入
+    return leaf == ("threading.py", "wait") and parent == ("threading.py", "wait")
+
+
+def _fold(frame, thread_name):
+    """把线程的调用栈转换为折叠格式：线程名;外层函数;...;栈顶函数"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+
+class Profile:
+    """一个请求期间采集到的调用栈"""
+
+    def __init__(self, request_id, method, path, explicit):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.explicit = explicit
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.created_at = datetime.now()
+
+    def add(self, stacks, idle):
+        self.samples += 1
+        self.idle_samples += idle
+        self.stacks.update(stacks)
+
+    def top_functions(self, limit=TOP_FUNCTIONS):
+        """返回(按自身样本数排序的函数, 按累计样本数排序的函数)
+
+        自身样本数为函数位于栈顶的次数；累计样本数含其调用的函数，外层框架函数的累计值都很高。
+        """
+        inclusive, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            for name in set(frames):
+                inclusive[name] += count
+            if frames:
+                own[frames[-1]] += count
+
+        def rows(counter):
+            return [
+                {"function": name, "self_samples": own[name], "samples": inclusive[name]}
+                for name, _ in counter.most_common(limit)
+            ]
+        return rows(own), rows(inclusive)
+
+
+class StackSampler:
+    """按固定间隔采样所有线程的调用栈
+
+    有请求在剖析时才运行一个采样线程，多个请求共用。sys._current_frames()能取到
+    asyncio.to_thread和线程池中的栈，因此导入时工作线程中的解析和写入也会被采集；
+    进程池中的图片处理只能看到主线程在等待结果。并发请求的样本会互相包含。
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile):
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks, idle = [], 0
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if _is_idle(frame):
+                    idle += 1
+                    continue
+                stacks.append(_fold(frame, names.get(thread_id, f"thread-{thread_id}")))
+            # 在锁内写入样本：请求移除剖析后不会再被修改，可以安全保存
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                for profile in self._profiles:
+                    profile.add(stacks, idle)
+            time.sleep(self.interval or SAMPLE_INTERVAL)
+
+
+sampler = StackSampler()
+
+
+def profile_paths(request_id):
+    base = os.path.join(PROFILES_DIR, request_id)
+    return base + ".folded", base + ".json"
+
+
+def _unique_request_id(request_id):
+    return f"{request_id}-{uuid.uuid4().hex[:8]}"
+
+
+def _open_new(path):
+    try:
+        return open(path, "x", encoding="utf-8")
+    except FileExistsError:
+        return None
+
+
+def save_profile(profile, status, duration):
+    """写入折叠栈和请求信息，并删除超出保留数量的旧结果
+
+    不覆盖已有结果：同一ID的请求并发保存时，后保存的改用带后缀的ID。
+    """
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    requested_id = profile.request_id
+    f = _open_new(profile_paths(requested_id)[0])
+    while f is None:
+        request_id = _unique_request_id(requested_id)
+        logger.warning(f"剖析结果{profile.request_id}已存在，改存为{request_id}")
+        profile.request_id = request_id
+        f = _open_new(profile_paths(request_id)[0])
+    meta_path = profile_paths(profile.request_id)[1]
+    with f:
+        for stack, count in profile.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    meta = {
+        "request_id": profile.request_id,
+        "method": profile.method,
+        "path": profile.path,
+        "status": status,
+        "duration_ms": round(duration * 1000, 1),
+        "reason": "requested" if profile.explicit else "slow",
+        "samples": profile.samples,
+        "idle_samples": profile.idle_samples,
+        "created_at": profile.created_at.isoformat(),
+    }
+    meta["top_functions"], meta["top_cumulative"] = profile.top_functions()
+    # 先写折叠栈再写请求信息，列表中出现的结果都可下载
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    prune_profiles()
+    logger.info(f"已保存性能剖析结果: {profile.request_id}（{profile.method} {profile.path}，{meta['duration_ms']}毫秒）")
+
+
+def _meta_files():
+    try:
+        with os.scandir(PROFILES_DIR) as entries:
+            return [entry for entry in entries if entry.name.endswith(".json")]
+    except FileNotFoundError:
+        return []
+
+
+def prune_profiles(keep=None):
+    keep = PROFILE_KEEP if keep is None else keep
+    entries = sorted(_meta_files(), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        for path in profile_paths(entry.name[:-len(".json")]):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def load_profile(request_id):
+    """读取剖析结果的请求信息，不存在或ID不合法时返回None"""
+    if not REQUEST_ID_RE.match(request_id or ""):
+        return None
+    try:
+        with open(profile_paths(request_id)[1], encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def list_profiles(limit=50):
+    """最近的剖析结果（不含函数摘要），按时间倒序"""
+    entries = sorted(_meta_files(), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    result = []
+    for entry in entries[:limit]:
+        meta = load_profile(entry.name[:-len(".json")])
+        if meta:
+            meta.pop("top_functions", None)
+            meta.pop("top_cumulative", None)
+            result.append(meta)
+    return result
+
+
+def _requested(scope):
+    for name, value in scope.get("headers", []):
+        if name == PROFILE_HEADER.encode() and value.decode("latin-1").lower() in ("1", "true", "on"):
+            return True
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return any(value.lower() in ("1", "true", "on") for value in query.get(PROFILE_QUERY, []))
+
+
+def _request_id(scope):
+    """请求头中的X-Request-ID作为剖析结果的ID，该ID已有剖析结果时加随机后缀，不覆盖已有结果"""
+    for name, value in scope.get("headers", []):
+        if name == REQUEST_ID_HEADER.encode():
+            request_id = value.decode("latin-1")
+            # 保留后缀的长度，加后缀后仍符合REQUEST_ID_RE
+            if REQUEST_ID_RE.match(request_id) and len(request_id) <= 55:
+                if os.path.exists(profile_paths(request_id)[0]):
+                    return _unique_request_id(request_id)
+                return request_id
+    return uuid.uuid4().hex
+
+
+class ProfilingMiddleware:
+    """按需剖析请求：请求头X-Profile: 1或查询参数profile=1，以及超过阈值的慢请求
+
+    响应头X-Request-ID为剖析结果的ID，可通过/admin/profiles/{request_id}下载。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        explicit = _requested(scope)
+        if not explicit and SLOW_REQUEST_SECONDS <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(_request_id(scope), scope["method"], scope["path"], explicit)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.encode(), profile.request_id.encode())
+                ]
+            await send(message)
+
+        start = time.perf_counter()
+        sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.remove(profile)
+            duration = time.perf_counter() - start
+            if explicit or duration >= SLOW_REQUEST_SECONDS:
+                try:
+                    await asyncio.to_thread(save_profile, profile, status, duration)
+                except OSError as e:
+                    logger.error(f"保存性能剖析结果失败: {str(e)}")
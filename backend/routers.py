@@ -1,22 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Body, Response
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Body, Response, Request, BackgroundTasks
 from starlette.responses import FileResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, text
 from typing import List
 import models
+import database
 from datetime import datetime
 import os
+import asyncio
 import time
-import shutil
 import uuid
 from openpyxl import Workbook, load_workbook
-from openpyxl.drawing.image import Image
-from PIL import Image as PILImage
-from io import BytesIO
-import openpyxl.styles
 import os
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from urllib.parse import quote
 from starlette.background import BackgroundTask
 from import_service import import_items
+import import_service
+import search_service
+import pagination
+import cache_service
+import serialization
+import image_service
+import export_service
+import job_service
+import storage_service
+import metrics_service
+import profiling_service
+import upload_service
 
 router = APIRouter()
 
@@ -25,59 +37,148 @@ UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # 获取所有货物报价表项目（支持分页）
+# 传入cursor时使用游标分页（按updated_at, id定位），否则按page做偏移分页；
+# total_mode控制总数统计方式：exact精确统计，cached短时缓存，none不统计
+# 使用异步会话，等待数据库时事件循环可继续处理其他请求
+# 结果按查询条件缓存，写入时失效；响应带ETag，浏览器携带的ETag未变化时返回304
+# fields为逗号分隔的字段列表（如id,name,thumbnail_path），只查询并返回这些字段，默认返回全部字段
 @router.get("/items/")
-def get_items(
+async def get_items(
+    request: Request,
     name: str = None, 
     factory_name: str = None, 
     factory_code: str = None, 
     page: int = 1, 
     page_size: int = 10, 
-    db: Session = Depends(models.get_db)
+    cursor: str = None,
+    total_mode: str = "exact",
+    match: str = "contains",
+    fields: str = None,
+    db: AsyncSession = Depends(models.get_async_db)
 ):
-    query = db.query(models.ToyItem)
-    if name:
-        query = query.filter(models.ToyItem.name.ilike(f"%{name}%"))
-    if factory_name:
-        query = query.filter(models.ToyItem.factory_name.ilike(f"%{factory_name}%"))
-    if factory_code:
-        query = query.filter(models.ToyItem.factory_code.ilike(f"%{factory_code}%"))
-    
-    # 按更新时间降序排序，如果更新时间相同则按创建时间降序排序
-    query = query.order_by(models.ToyItem.updated_at.desc(), models.ToyItem.created_at.desc())
+    fields = serialization.parse_fields(fields)
+    # 缓存键包含查询开始时的数据版本号，查询期间有写入时结果不会被后续请求读到
+    key = (cache_service.data_version.value, name, factory_name, factory_code, page, page_size, cursor, total_mode, match, fields)
+    cached = cache_service.list_cache.get(key)
+    if cached is None:
+        metrics_service.LIST_CACHE_REQUESTS.labels("miss").inc()
+        payload = await query_items(db, name, factory_name, factory_code, page, page_size, cursor, total_mode, match, fields)
+        with metrics_service.timer("list", "serialize"):
+            cached = cache_service.list_cache.put(key, payload)
+    else:
+        metrics_service.LIST_CACHE_REQUESTS.labels("hit").inc()
+
+    headers = {"ETag": cached.etag, "Cache-Control": cache_service.LIST_CACHE_CONTROL}
+    if cache_service.etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    # 缓存中已是序列化好的JSON，直接返回，不再经过jsonable_encoder
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+async def query_items(db, name, factory_name, factory_code, page, page_size, cursor, total_mode, match, fields):
+    """查询一页货物列表，返回接口的响应内容"""
+    # 只查询需要返回的列，不构造ORM对象
+    query = select(*serialization.list_columns(fields))
+    # 品名/厂名/货号检索走全文索引或小写检索列的索引，避免每次搜索全表扫描
+    query, ranked = search_service.apply_search(
+        query, db.get_bind(), match=match, name=name, factory_name=factory_name, factory_code=factory_code
+    )
     
     # 计算总数
-    total = query.count()
+    with metrics_service.timer("list", "count"):
+        total = await pagination.count_total(db, query, total_mode, (name, factory_name, factory_code, match))
+    
+    # 按更新时间降序排序，如果更新时间相同则按ID降序排序（与复合索引一致）
+    order_by = pagination.keyset_order()
+    if cursor:
+        # 游标分页：从上一页最后一条记录之后继续读取，不需要偏移扫描
+        query = pagination.apply_cursor(query, cursor)
+        query = query.order_by(*order_by).limit(page_size)
+    else:
+        # 命中全文索引时优先按相关度排序
+        if ranked:
+            order_by.insert(0, search_service.rank_order())
+        # 分页查询
+        offset = (page - 1) * page_size
+        query = query.order_by(*order_by).offset(offset).limit(page_size)
+    with metrics_service.timer("list", "page_query"):
+        rows = (await db.execute(query)).all()
     
-    # 分页查询
-    offset = (page - 1) * page_size
-    items = query.offset(offset).limit(page_size).all()
+    # 满页且按时间排序时返回下一页游标（相关度排序的结果无法用时间游标续读）
+    next_cursor = None
+    if len(rows) == page_size and (cursor or not ranked):
+        next_cursor = pagination.encode_cursor(rows[-1])
     
     # 返回分页数据
     return {
-        "items": [{
-            "id": item.id,
-            "factory_code": item.factory_code,
-            "factory_name": item.factory_name,
-            "name": item.name,
-            "packaging": item.packaging,
-            "packing_quantity": item.packing_quantity,
-            "unit_price": item.unit_price,
-            "gross_weight": item.gross_weight,
-            "net_weight": item.net_weight,
-            "outer_box_size": item.outer_box_size,
-            "product_size": item.product_size,
-            "inner_box": item.inner_box,
-            "remarks": item.remarks,
-            "image_path": item.image_path,
-            "origin_sheet": item.origin_sheet,
-            "created_at": item.created_at,
-            "updated_at": item.updated_at
-        } for item in items],
+        "items": serialization.rows_to_items(rows, fields),
         "total": total,
         "page": page,
-        "page_size": page_size
+        "page_size": page_size,
+        "next_cursor": next_cursor
     }
 
+def save_derivatives(image_path):
+    # 派生图生成失败不影响原图保存，访问时会按需补生成
+    try:
+        image_service.generate_derivatives_from_file(image_path)
+    except Exception as e:
+        logger.error(f"生成派生图失败: {image_path} - {str(e)}")
+
+def store_upload_image(fileobj, file_ext):
+    """校验并保存上传的图片，生成派生图，返回图片相对路径（在工作线程中执行）"""
+    try:
+        # 单次读取上传内容：写临时文件的同时计算SHA-256，按内容哈希命名，相同图片只保存一份
+        image_path, created = image_service.store_image_stream(fileobj, file_ext)
+    except image_service.ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"无效的图片文件: {str(e)}")
+    except IOError as e:
+        raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
+    # 生成缩略图等派生图
+    if created or not image_service.has_derivatives(image_path):
+        save_derivatives(image_path)
+    return image_path
+
+async def save_uploaded_image(image):
+    """新增和修改货物共用的图片上传处理，返回图片相对路径"""
+    # 验证文件类型，只允许图片文件
+    file_ext = os.path.splitext(image.filename)[1].lower()
+    allowed_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+    if file_ext not in allowed_extensions:
+        raise HTTPException(status_code=400, detail="只允许上传图片文件（JPG、JPEG、PNG、GIF、BMP）")
+    # 已知大小超过上限时不再读取
+    if image.size is not None and image.size > image_service.MAX_UPLOAD_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"图片超过{image_service.MAX_UPLOAD_IMAGE_BYTES}字节上限")
+    try:
+        # 读文件、校验、写文件和生成派生图都在工作线程中执行，不阻塞事件循环
+        return await asyncio.to_thread(store_upload_image, image.file, file_ext)
+    finally:
+        await image.close()
+
+# 获取图片派生图（缩略图/预览图/导出图）
+@router.get("/images/{size}/{file_name}")
+def get_image_derivative(size: str, file_name: str, request: Request):
+    if size not in image_service.DERIVATIVE_SIZES:
+        raise HTTPException(status_code=404, detail="不支持的图片规格")
+    # 只取文件名部分，防止路径穿越
+    file_name = os.path.basename(file_name)
+    if not os.path.exists(image_service.original_abs_path(file_name)):
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        path = image_service.ensure_derivative(file_name, size)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"生成派生图失败: {str(e)}")
+    response = FileResponse(path, media_type="image/jpeg", stat_result=os.stat(path))
+    response.headers["Cache-Control"] = image_service.cache_control_for(file_name)
+    # 浏览器携带的ETag未变化时直接返回304
+    if request.headers.get("if-none-match") == response.headers.get("etag"):
+        return Response(status_code=304, headers={
+            "ETag": response.headers["etag"],
+            "Cache-Control": response.headers["Cache-Control"]
+        })
+    return response
+
 # 创建新的货物报价表项目
 @router.post("/items/")
 async def create_item(factory_code: str = Form(...),
@@ -93,50 +194,11 @@ async def create_item(factory_code: str = Form(...),
                      inner_box: str = Form(...),
                      remarks: str = Form(None),
                      image: UploadFile = File(None),
-                     db: Session = Depends(models.get_db)):
+                     db: AsyncSession = Depends(models.get_async_db)):
     # 处理图片上传
     image_path = None
     if image:
-        # 验证文件类型，只允许图片文件
-        file_ext = os.path.splitext(image.filename)[1].lower()
-        allowed_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
-        if file_ext not in allowed_extensions:
-            raise HTTPException(status_code=400, detail="只允许上传图片文件（JPG、JPEG、PNG、GIF、BMP）")
-            
-        # 保存文件前验证文件内容是否为有效图片
-        try:
-            # 保存文件内容到内存中进行验证
-            contents = await image.read()
-            try:
-                # 尝试用PIL打开图片验证格式
-                img = PILImage.open(BytesIO(contents))
-                img.verify()  # 验证图片完整性
-                # 重置文件指针，以便后续保存文件
-                await image.seek(0)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"无效的图片文件: {str(e)}")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"文件验证失败: {str(e)}")
-            
-        file_name = f"{datetime.now().strftime('%Y%m%d%H%M%S')}{file_ext}"
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        try:
-            file_path = os.path.join(UPLOAD_DIR, file_name)
-            # 使用上下文管理器确保文件正确关闭
-            try:
-                with open(file_path, "wb") as buffer:
-                    shutil.copyfileobj(image.file, buffer)
-            except IOError as e:
-                raise HTTPException(status_code=500, detail=f"文件写入失败: {str(e)}")
-            finally:
-                if image.file:
-                    image.file.close()
-            # 确保文件路径正确
-            image_path = os.path.relpath(file_path, os.path.dirname(__file__)).replace('\\', '/')
-            # 设置为相对URL路径以便前端访问
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
-    
+        image_path = await save_uploaded_image(image)
     
     # 创建数据库记录
     db_item = models.ToyItem(
@@ -155,8 +217,9 @@ async def create_item(factory_code: str = Form(...),
         image_path=image_path
     )
     db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    await db.commit()
+    cache_service.invalidate_items()
+    await db.refresh(db_item)
     return db_item
 
 # 更新货物报价表项目
@@ -175,67 +238,16 @@ async def update_item(item_id: int,
                      inner_box: str = Form(...),
                      remarks: str = Form(None),
                      image: UploadFile = File(None),
-                     db: Session = Depends(models.get_db)):
+                     db: AsyncSession = Depends(models.get_async_db)):
     # 查找要更新的记录
-    db_item = db.query(models.ToyItem).filter(models.ToyItem.id == item_id).first()
+    db_item = await db.get(models.ToyItem, item_id)
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found")
     
     # 处理图片上传
     image_path = db_item.image_path
     if image and image.filename:
-        # 验证文件类型，只允许图片文件
-        file_ext = os.path.splitext(image.filename)[1].lower()
-        allowed_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
-        if file_ext not in allowed_extensions:
-            raise HTTPException(status_code=400, detail="只允许上传图片文件（JPG、JPEG、PNG、GIF、BMP）")
-            
-        # 保存文件前验证文件内容是否为有效图片
-        try:
-            # 保存文件内容到内存中进行验证
-            contents = await image.read()
-            try:
-                # 尝试用PIL打开图片验证格式
-                img = PILImage.open(BytesIO(contents))
-                img.verify()  # 验证图片完整性
-                # 重置文件指针，以便后续保存文件
-                await image.seek(0)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"无效的图片文件: {str(e)}")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"文件验证失败: {str(e)}")
-            
-        # 删除旧图片
-        if db_item.image_path:
-            # 正确处理图片路径，db_item.image_path格式为"uploads/filename.jpg"
-            # 需要去除开头的"uploads/"，因为UPLOAD_DIR已经包含了这个路径
-            old_file_name = os.path.basename(db_item.image_path)
-            old_file_path = os.path.join(UPLOAD_DIR, old_file_name)
-            if os.path.exists(old_file_path):
-                try:
-                    os.remove(old_file_path)
-                    print(f"成功删除旧图片: {old_file_path}")
-                except Exception as e:
-                    print(f"删除旧图片失败: {str(e)}")
-        
-        # 保存新图片
-        file_name = f"{datetime.now().strftime('%Y%m%d%H%M%S')}{file_ext}"
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        try:
-            file_path = os.path.join(UPLOAD_DIR, file_name)
-            # 使用上下文管理器确保文件正确关闭
-            try:
-                with open(file_path, "wb") as buffer:
-                    shutil.copyfileobj(image.file, buffer)
-            except IOError as e:
-                raise HTTPException(status_code=500, detail=f"文件写入失败: {str(e)}")
-            finally:
-                if image.file:
-                    image.file.close()
-            # 设置为相对URL路径以便前端访问
-            image_path = f"uploads/{file_name}"
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
+        image_path = await save_uploaded_image(image)
     
     # 更新记录
     db_item.factory_code = factory_code
@@ -250,194 +262,270 @@ async def update_item(item_id: int,
     db_item.product_size = product_size
     db_item.inner_box = inner_box
     db_item.remarks = remarks
+    old_image_path = db_item.image_path
     db_item.image_path = image_path
     db_item.updated_at = datetime.now()
+    # 手工修改后内容与导入时不同，下次增量导入时按变化处理
+    db_item.row_fingerprint = None
+    
+    await db.commit()
+    cache_service.invalidate_items()
+    await db.refresh(db_item)
     
-    db.commit()
-    db.refresh(db_item)
+    # 更换图片后，旧图片没有其他记录引用时才删除
+    if old_image_path and old_image_path != image_path:
+        await image_service.release_image_async(db, old_image_path)
     return db_item
 
 # 批量删除货物报价表项目
+# 每批id一条DELETE语句，全部在同一事务中提交（中途失败时不会只删除一部分）；
+# 提交后在后台删除已没有记录引用的图片文件，不占用请求时间
 @router.delete("/items/batch")
-def batch_delete_items(request: dict = Body(...), db: Session = Depends(models.get_db)):
+async def batch_delete_items(background_tasks: BackgroundTasks, request: dict = Body(...), db: AsyncSession = Depends(models.get_async_db)):
     item_ids = request.get("item_ids", [])
     if not item_ids:
         raise HTTPException(status_code=400, detail="No items specified for deletion")
     
-    # 查询所有要删除的项目
-    items = db.query(models.ToyItem).filter(models.ToyItem.id.in_(item_ids)).all()
     deleted_count = 0
+    image_paths = set()
+    # id较多时分批执行，避免超出数据库参数个数上限
+    for chunk in database.chunked(item_ids):
+        image_paths.update(await db.scalars(
+            select(models.ToyItem.image_path).where(
+                models.ToyItem.id.in_(chunk), models.ToyItem.image_path.isnot(None)
+            ).distinct()
+        ))
+        result = await db.execute(
+            delete(models.ToyItem).where(models.ToyItem.id.in_(chunk)).execution_options(synchronize_session=False)
+        )
+        deleted_count += result.rowcount
     
-    for item in items:
-        # 删除关联的图片文件
-        if item.image_path:
-            file_path = os.path.join(UPLOAD_DIR, os.path.basename(item.image_path))
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    # 记录错误但继续删除数据库记录
-                    print(f"Error deleting image file: {str(e)}")
-        
-        # 删除数据库记录
-        db.delete(item)
-        deleted_count += 1
+    await db.commit()
+    cache_service.invalidate_items()
     
-    db.commit()
+    # 删除关联的图片文件及派生图（相同图片可能被其他记录共用，后台任务用新会话检查引用，只删除已无引用的图片）
+    if image_paths:
+        background_tasks.add_task(image_service.release_images_async, db.bind, image_paths, time.time())
     return {"message": f"{deleted_count} items deleted successfully"}
 
 # 删除货物报价表项目
 @router.delete("/items/{item_id}")
-def delete_item(item_id: int, db: Session = Depends(models.get_db)):
-    db_item = db.query(models.ToyItem).filter(models.ToyItem.id == item_id).first()
+async def delete_item(item_id: int, background_tasks: BackgroundTasks, db: AsyncSession = Depends(models.get_async_db)):
+    db_item = await db.get(models.ToyItem, item_id)
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found")
     
-    # 删除关联的图片文件
-    if db_item.image_path:
-        file_path = os.path.join(UPLOAD_DIR, os.path.basename(db_item.image_path))
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                # 记录错误但继续删除数据库记录
-                print(f"Error deleting image file: {str(e)}")
+    image_path = db_item.image_path
+    await db.delete(db_item)
+    await db.commit()
+    cache_service.invalidate_items()
     
-    db.delete(db_item)
-    db.commit()
+    # 删除关联的图片文件及派生图（相同图片可能被其他记录共用），文件在响应返回后检查引用并删除
+    if image_path:
+        background_tasks.add_task(image_service.release_images_async, db.bind, [image_path], time.time())
     return {"message": "Item deleted successfully"}
 
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
 import logging
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def any_items_exist(db, item_ids):
+    """id列表中是否至少有一条记录存在"""
+    for chunk in database.chunked(item_ids):
+        if db.query(models.ToyItem.id).filter(models.ToyItem.id.in_(chunk)).first():
+            return True
+    return False
+
 # 导出选中的货物报价表为Excel
+# 以流式响应边生成边发送，内存占用不随导出行数增长
 @router.post("/items/export")
-async def export_items(request: dict = Body(...), db: Session = Depends(models.get_db)):
+def export_items(request: dict = Body(...), db: Session = Depends(models.get_db)):
     item_ids = request.get("item_ids", [])
-    items = db.query(models.ToyItem).filter(models.ToyItem.id.in_(item_ids)).all()
-    if not items:
+    if not any_items_exist(db, item_ids):
         raise HTTPException(status_code=400, detail="No items found for export")
 
-    # 创建Excel工作簿
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "货物报价表"
-
-    start_time = time.time()
-
-    headers = ["图片", "货号", "厂名", "品名", "包装", "装箱量PCS", "单价", "毛重KG", "净重KG", "外箱规格CM", "产品规格", "内箱", "备注"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center', wrap_text=True)
-
-    ws.column_dimensions['A'].width = 20
-    ws.column_dimensions['D'].width = 30
-    for col_idx in range(2, len(headers) + 1):
-        if col_idx != 4:
-            col_letter = chr(64 + col_idx)
-            ws.column_dimensions[col_letter].width = 15
-
-    # 只缓存图片的二进制数据，避免openpyxl Image对象复用
-    image_cache = {}
-
-    for row, item in enumerate(items, 2):
-        ws.row_dimensions[row].height = 75
-        for col_idx, value in enumerate([
-            None,
-            item.factory_code,
-            item.factory_name,
-            item.name,
-            item.packaging,
-            item.packing_quantity,
-            item.unit_price,
-            item.gross_weight,
-            item.net_weight,
-            item.outer_box_size,
-            item.product_size,
-            item.inner_box,
-            item.remarks
-        ], 1):
-            if col_idx > 1:
-                cell = ws.cell(row=row, column=col_idx, value=value)
-                cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center', wrap_text=True)
-
-        # 处理图片
-        if item.image_path and os.path.exists(item.image_path):
-            with open(item.image_path, 'rb') as f:
-                image_bytes = f.read()
-            image_hash = hash(image_bytes)
-            # 只缓存图片的二进制数据
-            if image_hash in image_cache:
-                pil_image = image_cache[image_hash]
-            else:
-                pil_image = PILImage.open(BytesIO(image_bytes))
-                if pil_image.mode in ('RGBA', 'LA'):
-                    background = PILImage.new('RGB', pil_image.size, (255, 255, 255))
-                    background.paste(pil_image, mask=pil_image.split()[-1])
-                    pil_image = background
-                image_cache[image_hash] = pil_image
-
-            img_width, img_height = pil_image.size
-            cell_width = ws.column_dimensions['A'].width * 7
-            cell_height = ws.row_dimensions[row].height * 0.75
-            img_byte_arr = BytesIO()
-            pil_image.save(img_byte_arr, format='JPEG', optimize=True, quality=85)
-            img_byte_arr.seek(0)
-            img = Image(img_byte_arr)
-            img._byte_stream = img_byte_arr
-
-            from openpyxl.drawing.spreadsheet_drawing import OneCellAnchor, AnchorMarker
-            from openpyxl.utils.units import pixels_to_EMU, points_to_pixels
-            from openpyxl.drawing.xdr import XDRPositiveSize2D
-
-            cell_width = points_to_pixels(ws.column_dimensions['A'].width * 7)
-            cell_height = points_to_pixels(ws.row_dimensions[row].height)
-            padding = 4
-            max_width = cell_width - padding
-            max_height = cell_height - padding
-            scale = min(max_width/img_width, max_height/img_height)
-            new_width = int(img_width * scale)
-            new_height = int(img_height * scale)
-            col_offset = pixels_to_EMU((cell_width - new_width) // 2)
-            row_offset = pixels_to_EMU((cell_height - new_height) // 2)
-            marker = AnchorMarker(col=0, colOff=col_offset, row=row-1, rowOff=row_offset)
-            size = XDRPositiveSize2D(pixels_to_EMU(new_width), pixels_to_EMU(new_height))
-            anchor = OneCellAnchor(_from=marker, ext=size)
-            img.anchor = anchor
-            img.anchor.editAs = 'oneCell'
-            ws.add_image(img)
-            cell = ws.cell(row=row, column=1)
-            cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center')
-
-    process_time = time.time() - start_time
-    logger.info(f"数据处理完成，耗时：{process_time:.2f}秒")
-    save_start_time = time.time()
     file_name = f"货物报价表_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
-    os.makedirs("exports", exist_ok=True)
-    file_path = os.path.join("exports", file_name)
-    wb.save(file_path)
-    save_time = time.time() - save_start_time
-    logger.info(f"文件保存完成，耗时：{save_time:.2f}秒")
-    return FileResponse(
-        path=file_path,
-        filename=file_name,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        background=BackgroundTask(lambda: os.unlink(file_path))
+    return StreamingResponse(
+        export_service.stream_export(item_ids),
+        media_type=export_service.MEDIA_TYPE,
+        headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(file_name)}"}
     )
 
 # 导入Excel数据
+# mode=upsert时按(厂名, 货号)增量导入：未变化的行跳过，变化的行原地更新，结果中返回新增/更新/未变化行数
 @router.post("/items/import")
-async def import_excel(file: UploadFile = File(...), factory_name: str = Form(...), db: Session = Depends(models.get_db)):
+async def import_excel(file: UploadFile = File(...), factory_name: str = Form(...), mode: str = Form("insert"),
+                       db: Session = Depends(models.get_db)):
     # 调用import_service中的import_items函数
-    return await import_items(file=file, factory_name=factory_name, db=db)
+    return await import_items(file=file, factory_name=factory_name, db=db, mode=mode)
 
 # 导入Excel数据路由已统一，使用唯一的导入方法
 
+# 提交后台导入任务：保存上传文件后立即返回任务ID，通过/jobs/{job_id}查询进度
+@router.post("/jobs/import")
+def submit_import_job(file: UploadFile = File(...), factory_name: str = Form(...), mode: str = Form("insert"),
+                      db: Session = Depends(models.get_db)):
+    if not file.filename.endswith((".xlsx", ".xls")):
+        raise HTTPException(status_code=400, detail="只支持Excel文件格式(.xlsx, .xls)")
+    import_service.validate_mode(mode)
+    input_path = import_service.save_upload_to_temp(file)
+    job_id = job_service.submit(
+        db, "import", {"filename": file.filename, "factory_name": factory_name, "mode": mode}, input_path
+    )
+    return {"job_id": job_id}
+
+# 分块上传大文件：创建上传会话 -> 按序号PUT各分块（可并行，中断后只需重传未完成的分块）-> 完成后提交导入任务
+# 请求体：filename、size（字节），可选sha256（完成时校验整个文件）、chunk_size
+@router.post("/imports/uploads")
+def create_chunked_upload(request: dict = Body(...)):
+    return upload_service.create_upload(
+        request.get("filename"), request.get("size"), request.get("sha256"), request.get("chunk_size")
+    )
+
+# 查询上传进度，续传时上传missing中的分块即可
+@router.get("/imports/uploads/{upload_id}")
+def get_chunked_upload(upload_id: str):
+    return upload_service.upload_status(upload_id)
+
+# 上传一个分块，请求体为分块的原始字节，可带X-Chunk-SHA256头校验分块内容；重复上传同一分块会覆盖
+@router.put("/imports/uploads/{upload_id}/chunks/{index}")
+async def put_upload_chunk(upload_id: str, index: int, request: Request):
+    writer = await asyncio.to_thread(upload_service.ChunkWriter, upload_id, index)
+    try:
+        # 边接收边写入，只缓存不超过WRITE_BUFFER_SIZE的数据
+        async for data in request.stream():
+            if writer.add(data):
+                await asyncio.to_thread(writer.flush)
+        await asyncio.to_thread(writer.finish, request.headers.get("x-chunk-sha256"))
+    finally:
+        writer.close()
+    return {"upload_id": upload_id, "index": index, "size": writer.received}
+
+# 完成上传：校验整个文件的SHA-256后提交后台导入任务，请求体为factory_name和可选的mode（同/items/import）
+@router.post("/imports/uploads/{upload_id}/complete")
+def complete_chunked_upload(upload_id: str, request: dict = Body(...), db: Session = Depends(models.get_db)):
+    factory_name = request.get("factory_name")
+    if not factory_name:
+        raise HTTPException(status_code=400, detail="缺少厂名factory_name")
+    mode = request.get("mode", "insert")
+    import_service.validate_mode(mode)
+    input_path, filename, file_hash = upload_service.assemble_upload(upload_id)
+    job_id = job_service.submit(
+        db, "import",
+        {"filename": filename, "factory_name": factory_name, "mode": mode, "file_hash": file_hash},
+        input_path
+    )
+    return {"job_id": job_id, "sha256": file_hash}
+
+# 放弃上传，删除已收到的分块
+@router.delete("/imports/uploads/{upload_id}")
+def delete_chunked_upload(upload_id: str):
+    upload_service.delete_upload(upload_id)
+    return {"message": "Upload deleted"}
+
+# 提交后台导出任务，完成后通过/jobs/{job_id}/result下载
+@router.post("/jobs/export")
+def submit_export_job(request: dict = Body(...), db: Session = Depends(models.get_db)):
+    item_ids = request.get("item_ids", [])
+    if not any_items_exist(db, item_ids):
+        raise HTTPException(status_code=400, detail="No items found for export")
+    file_name = f"货物报价表_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
+    job_id = job_service.submit(db, "export", {"item_ids": item_ids, "file_name": file_name})
+    return {"job_id": job_id}
+
+# 提交存储回收任务：删除没有记录引用的图片、过期的临时文件和任务结果，结果中包含释放的字节数
+@router.post("/jobs/gc")
+def submit_gc_job(request: dict = Body(None), db: Session = Depends(models.get_db)):
+    dry_run = bool((request or {}).get("dry_run", False))
+    job_id = job_service.submit(db, "gc", {"dry_run": dry_run})
+    return {"job_id": job_id}
+
+# 存储占用统计：各目录当前占用及可回收的文件（只统计，不删除）
+@router.get("/storage/usage")
+def get_storage_usage(db: Session = Depends(models.get_db)):
+    return storage_service.collect_garbage(lambda: db, dry_run=True)
+
+# Prometheus文本格式的监控指标：请求次数与耗时、导入导出各阶段耗时、列表查询耗时等
+@router.get("/metrics")
+def get_metrics():
+    content, content_type = metrics_service.render_metrics()
+    return Response(content=content, media_type=content_type)
+
+# 就绪检查：执行一次数据库往返并返回耗时，数据库不可用时返回503
+@router.get("/readyz")
+async def readiness(db: AsyncSession = Depends(models.get_async_db)):
+    start = time.perf_counter()
+    try:
+        await db.execute(text("SELECT 1"))
+    except Exception as e:
+        logger.error(f"就绪检查失败: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"数据库不可用: {str(e)}")
+    latency = time.perf_counter() - start
+    metrics_service.DB_PING_DURATION.observe(latency)
+    return {"status": "ok", "db_latency_ms": round(latency * 1000, 2)}
+
+def require_profiling():
+    # 未开启剖析时不暴露剖析结果（其中包含请求路径和代码调用栈）
+    if not profiling_service.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+# 最近的性能剖析结果（需设置TOY_PROFILING=on，请求带X-Profile: 1头或profile=1参数，或超过慢请求阈值）
+@router.get("/admin/profiles", dependencies=[Depends(require_profiling)])
+def get_profiles(limit: int = 50):
+    return profiling_service.list_profiles(limit)
+
+# 下载剖析结果：format=folded为折叠栈（可用flamegraph.pl/speedscope查看），json为请求信息和样本最多的函数
+@router.get("/admin/profiles/{request_id}", dependencies=[Depends(require_profiling)])
+def download_profile(request_id: str, format: str = "folded"):
+    meta = profiling_service.load_profile(request_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "json":
+        return meta
+    if format != "folded":
+        raise HTTPException(status_code=400, detail="format只支持: folded, json")
+    return FileResponse(
+        profiling_service.profile_paths(request_id)[0],
+        filename=f"{request_id}.folded",
+        media_type="text/plain; charset=utf-8"
+    )
+
+def get_job_or_404(job_id, db):
+    job = db.get(models.Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# 查询后台任务状态与进度
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str, db: Session = Depends(models.get_db)):
+    return job_service.to_dict(get_job_or_404(job_id, db))
+
+# 取消后台任务
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str, db: Session = Depends(models.get_db)):
+    job = job_service.request_cancel(db, get_job_or_404(job_id, db))
+    return job_service.to_dict(job)
+
+# 获取后台任务结果：导出任务返回Excel文件，导入任务返回导入结果
+@router.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str, db: Session = Depends(models.get_db)):
+    job = get_job_or_404(job_id, db)
+    if job.status != job_service.STATUS_SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"任务尚未完成，当前状态: {job.status}")
+    if job.result_path:
+        if not os.path.exists(job.result_path):
+            raise HTTPException(status_code=410, detail="结果文件已被清理")
+        result = job_service.to_dict(job)["result"] or {}
+        return FileResponse(
+            path=job.result_path,
+            filename=result.get("file_name", os.path.basename(job.result_path)),
+            media_type=export_service.MEDIA_TYPE
+        )
+    return job_service.to_dict(job)["result"]
+
 # 获取Excel导入模板
 @router.get("/items/import-template")
 async def get_import_template():
@@ -459,8 +547,9 @@ async def get_import_template():
     ws.column_dimensions['A'].width = 20
     
     # 保存到临时文件
-    template_path = "exports/import_template.xlsx"
-    os.makedirs("exports", exist_ok=True)
+    # 响应发送后删除；删除未执行时由存储回收任务清理
+    template_path = os.path.join(storage_service.EXPORTS_DIR, f"import_template_{uuid.uuid4().hex}.xlsx")
+    os.makedirs(storage_service.EXPORTS_DIR, exist_ok=True)
     wb.save(template_path)
     
     # 返回文件
@@ -0,0 +1,148 @@
+from sqlalchemy import text, table, column, literal_column, and_
+from fastapi import HTTPException
+import models
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 全文检索表（SQLite FTS5外部内容表，数据本体仍在toy_items中）
+FTS_TABLE = "toy_items_fts"
+# 参与检索的字段（品名、厂名、货号）
+FTS_COLUMNS = ("name", "factory_name", "factory_code")
+# trigram分词器按3个字符切分，短于3个字符的检索词无法命中索引
+MIN_TERM_LENGTH = 3
+
+# 匹配方式：contains包含（全文索引），prefix前缀，exact精确（均不区分大小写）
+MATCH_MODES = ("contains", "prefix", "exact")
+
+fts = table(FTS_TABLE, column("rowid"), column("rank"))
+
+# SQLite的lower()只转换ASCII字母（全角字母、带重音的字母保持原样）
+ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+# 记录各数据库是否已启用全文索引（按连接URL区分）
+_fts_ready = {}
+
+
+def _database_key(bind):
+    # 同一数据库的同步与异步引擎驱动不同，去掉驱动名后共用一条记录
+    url = bind.url
+    return url.set(drivername=url.get_backend_name()).render_as_string(hide_password=False)
+
+
+def ensure_search_index(engine):
+    """创建全文索引表及同步触发器，新建索引时从toy_items全量重建"""
+    key = _database_key(engine)
+    if engine.dialect.name != "sqlite":
+        _fts_ready[key] = False
+        return False
+
+    columns = ", ".join(FTS_COLUMNS)
+    new_columns = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old_columns = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": FTS_TABLE}
+            ).first()
+            # trigram分词支持中文品名的任意子串匹配，且不区分大小写
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{columns}, content='toy_items', content_rowid='id', tokenize='trigram')"
+            ))
+            # 通过触发器保持索引与toy_items同步，ORM写入和批量导入都会自动生效
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON toy_items BEGIN "
+                f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_columns}); END"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON toy_items BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_columns}); END"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON toy_items BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_columns}); "
+                f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_columns}); END"
+            ))
+            if not exists:
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                logger.info("全文索引创建完成，已从现有数据重建")
+    except Exception as e:
+        # 部分SQLite编译版本不带FTS5或trigram分词器，此时退回模糊查询
+        logger.warning(f"全文索引不可用，搜索将使用模糊查询: {str(e)}")
+        _fts_ready[key] = False
+        return False
+
+    _fts_ready[key] = True
+    return True
+
+
+def is_enabled(bind):
+    return _fts_ready.get(_database_key(bind), False)
+
+
+def _quote(term):
+    # FTS5中双引号包裹的内容按短语处理，内部双引号需要转义
+    return '"' + term.replace('"', '""') + '"'
+
+
+def prefix_filter(column, prefix):
+    """前缀匹配：范围条件可以使用索引，LIKE条件保证结果准确"""
+    condition = column.startswith(prefix, autoescape=True)
+    if ord(prefix[-1]) < 0x10FFFF:
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        condition = and_(column >= prefix, column < upper, condition)
+    return condition
+
+
+def fold_term(term, bind):
+    """按数据库lower()的规则把检索词转为小写，与小写检索列中的值一致"""
+    if bind.dialect.name == "sqlite":
+        return term.translate(ASCII_LOWER)
+    return term.lower()
+
+
+def apply_search(query, bind, match="contains", **terms):
+    """为查询添加品名/厂名/货号过滤条件
+
+    contains方式下能走全文索引的检索词合并为一个MATCH表达式，并按相关度排序；
+    索引不可用或检索词过短时退回不区分大小写的模糊匹配。
+    prefix/exact方式使用小写检索列及其索引。返回(query, 是否使用了全文索引)。
+    """
+    if match not in MATCH_MODES:
+        raise HTTPException(status_code=400, detail=f"match只支持: {', '.join(MATCH_MODES)}")
+    use_fts = is_enabled(bind)
+    match_parts = []
+    for field, term in terms.items():
+        if not term:
+            continue
+        term = term.strip()
+        if not term:
+            continue
+        if match != "contains":
+            lower_column = getattr(models.ToyItem, f"{field}_lower")
+            if match == "exact":
+                query = query.filter(lower_column == fold_term(term, bind))
+            else:
+                query = query.filter(prefix_filter(lower_column, fold_term(term, bind)))
+        elif use_fts and len(term) >= MIN_TERM_LENGTH:
+            match_parts.append(f"{field} : {_quote(term)}")
+        else:
+            # 检索词中的%和_按普通字符匹配；PostgreSQL上为ILIKE，其他数据库为lower() LIKE lower()
+            query = query.filter(getattr(models.ToyItem, field).icontains(term, autoescape=True))
+
+    if not match_parts:
+        return query, False
+
+    query = query.join(fts, fts.c.rowid == models.ToyItem.id).filter(
+        literal_column(FTS_TABLE).op("MATCH")(" AND ".join(match_parts))
+    )
+    return query, True
+
+
+def rank_order():
+    # FTS5的rank隐藏列默认即bm25得分，数值越小越相关
+    return fts.c.rank
@@ -0,0 +1,75 @@
+from fastapi import HTTPException
+from decimal import Decimal
+from operator import attrgetter
+import orjson
+import models
+import image_service
+
+# 列表接口可返回的字段及其来源列，未指定fields时按此顺序返回全部字段
+LIST_FIELDS = {
+    "id": models.ToyItem.id,
+    "factory_code": models.ToyItem.factory_code,
+    "factory_name": models.ToyItem.factory_name,
+    "name": models.ToyItem.name,
+    "packaging": models.ToyItem.packaging,
+    "packing_quantity": models.ToyItem.packing_quantity,
+    "unit_price": models.ToyItem.unit_price,
+    "gross_weight": models.ToyItem.gross_weight,
+    "net_weight": models.ToyItem.net_weight,
+    "outer_box_size": models.ToyItem.outer_box_size,
+    "product_size": models.ToyItem.product_size,
+    "inner_box": models.ToyItem.inner_box,
+    "remarks": models.ToyItem.remarks,
+    "image_path": models.ToyItem.image_path,
+    "thumbnail_path": models.ToyItem.image_path,
+    "origin_sheet": models.ToyItem.origin_sheet,
+    "created_at": models.ToyItem.created_at,
+    "updated_at": models.ToyItem.updated_at,
+}
+# 生成下一页游标需要的列，即使客户端未请求也会查询（不返回）
+CURSOR_FIELDS = ("id", "updated_at")
+
+
+def parse_fields(fields):
+    """解析逗号分隔的字段列表，未指定时返回全部字段"""
+    if not fields:
+        return tuple(LIST_FIELDS)
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in LIST_FIELDS]
+    if not names or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的字段: {', '.join(unknown) or fields}，可选字段: {', '.join(LIST_FIELDS)}"
+        )
+    return names
+
+
+def list_columns(fields):
+    """查询需要的列（去重），只读取列表实际返回的字段"""
+    columns = {}
+    for name in (*fields, *CURSOR_FIELDS):
+        column = LIST_FIELDS[name]
+        columns[column.key] = column
+    return list(columns.values())
+
+
+def _thumbnail(row):
+    return image_service.derivative_url(row.image_path, "thumb") if row.image_path else None
+
+
+def rows_to_items(rows, fields):
+    """将查询到的列元组转换为响应中的记录"""
+    getters = [(name, _thumbnail if name == "thumbnail_path" else attrgetter(LIST_FIELDS[name].key)) for name in fields]
+    return [{name: getter(row) for name, getter in getters} for row in rows]
+
+
+def _default(value):
+    # 单价为Decimal，与FastAPI默认编码一致输出为数字
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def dumps(payload):
+    """一次性序列化为JSON字节串，datetime按ISO格式输出"""
+    return orjson.dumps(payload, default=_default)
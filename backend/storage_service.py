@@ -0,0 +1,205 @@
+from datetime import datetime, timedelta
+import os
+import shutil
+import threading
+import time
+import logging
+import models
+import image_service
+import import_service
+import job_service
+import upload_service
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 生成导入模板等临时导出文件的目录
+EXPORTS_DIR = os.path.join(BASE_DIR, "exports")
+
+# 修改时间在宽限期内的文件不回收：图片写入后、记录提交前，文件暂时没有记录引用；
+# 复用已有图片时会更新修改时间，因此重新被使用的旧图片同样受宽限期保护
+GC_GRACE_SECONDS = int(os.environ.get("TOY_GC_GRACE_SECONDS", 3600))
+# 后台导出任务的结果文件保留时间，过期后下载接口返回410
+JOB_RESULT_RETENTION = int(os.environ.get("TOY_JOB_RESULT_RETENTION", 7 * 24 * 3600))
+# 定期回收的间隔（秒），0表示不定期执行
+GC_INTERVAL = int(os.environ.get("TOY_GC_INTERVAL", 6 * 3600))
+# 从数据库流式读取图片路径时每批的行数
+SCAN_BATCH_SIZE = 1000
+
+# 统计的存储区域
+AREAS = ("uploads", "derivatives", "tmp", "jobs", "exports")
+
+_periodic_thread = None
+_periodic_stop = threading.Event()
+
+
+class Report:
+    """回收结果：各区域删除的文件数/字节数，以及回收后仍占用的文件数/字节数"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.removed = {area: {"files": 0, "bytes": 0} for area in AREAS}
+        self.usage = {area: {"files": 0, "bytes": 0} for area in AREAS}
+
+    def add(self, area, size, remove):
+        target = self.removed if remove else self.usage
+        target[area]["files"] += 1
+        target[area]["bytes"] += size
+
+    def to_dict(self):
+        return {
+            "dry_run": self.dry_run,
+            "bytes_reclaimed": sum(item["bytes"] for item in self.removed.values()),
+            "files_removed": sum(item["files"] for item in self.removed.values()),
+            "removed": self.removed,
+            "usage": self.usage,
+            "bytes_used": sum(item["bytes"] for item in self.usage.values()),
+        }
+
+
+def referenced_image_stems(db):
+    """流式读取所有记录引用的图片，返回文件名主干集合（原图与派生图共用主干）"""
+    stems = set()
+    query = db.query(models.ToyItem.image_path).filter(models.ToyItem.image_path.isnot(None)).distinct()
+    for (image_path,) in query.yield_per(SCAN_BATCH_SIZE):
+        stems.add(os.path.splitext(os.path.basename(image_path))[0])
+    return stems
+
+
+def _scan(directory):
+    """逐个返回目录下的文件（不递归），目录不存在时为空"""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+def _remove_if_stale(path, cutoff):
+    """删除前重新检查修改时间：扫描之后被复用（修改时间已更新）的文件保留，返回是否删除"""
+    try:
+        if os.stat(path).st_mtime >= cutoff:
+            return False
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return True
+
+
+def _sweep(report, area, directory, is_garbage, cutoff, lock_for=None):
+    """扫描目录，宽限期之前修改且判定为垃圾的文件删除，其余计入占用
+
+    lock_for返回文件对应的锁时，在锁内重新检查修改时间后再删除（用于图片，与复用图片互斥）。
+    """
+    for entry in _scan(directory):
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        remove = stat.st_mtime < cutoff and is_garbage(entry)
+        if remove and not report.dry_run:
+            try:
+                if lock_for is None:
+                    os.remove(entry.path)
+                else:
+                    with lock_for(entry.name):
+                        remove = _remove_if_stale(entry.path, cutoff)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"删除文件失败: {entry.path} - {str(e)}")
+                remove = False
+        report.add(area, stat.st_size, remove)
+
+
+def collect_garbage(session_factory=None, grace_seconds=None, dry_run=False, progress=None):
+    """回收没有记录引用的上传图片、派生图、临时文件和过期的任务结果
+
+    dry_run为True时只统计可回收的文件，不删除。返回Report.to_dict()。
+    """
+    grace_seconds = GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = time.time() - grace_seconds
+    report = Report(dry_run)
+
+    db = (session_factory or models.SessionLocal)()
+    try:
+        stems = referenced_image_stems(db)
+        # 未完成的任务仍在使用输入文件；未过期的任务结果仍可下载
+        active_inputs = {
+            os.path.abspath(path) for (path,) in db.query(models.Job.input_path).filter(
+                models.Job.status.in_([job_service.STATUS_PENDING, job_service.STATUS_RUNNING]),
+                models.Job.input_path.isnot(None)
+            )
+        }
+        retention_start = datetime.now() - timedelta(seconds=JOB_RESULT_RETENTION)
+        kept_results = {
+            os.path.abspath(path) for (path,) in db.query(models.Job.result_path).filter(
+                models.Job.result_path.isnot(None),
+                (models.Job.finished_at.is_(None)) | (models.Job.finished_at >= retention_start)
+            )
+        }
+    finally:
+        db.close()
+
+    def unreferenced(entry):
+        # 写入中断残留的临时文件（<文件名>.<uuid>.tmp）也一并回收
+        return entry.name.endswith(".tmp") or os.path.splitext(entry.name)[0] not in stems
+
+    if progress:
+        progress("gc_uploads", 0, len(AREAS))
+    # 原图：文件名主干不在引用集合中（包括历史遗留的temp_文件）
+    _sweep(report, "uploads", image_service.UPLOAD_DIR, unreferenced, cutoff, image_service.image_lock)
+    if progress:
+        progress("gc_derivatives", 1, len(AREAS))
+    for size in image_service.DERIVATIVE_SIZES:
+        _sweep(report, "derivatives", os.path.join(image_service.UPLOAD_DIR, size), unreferenced, cutoff,
+               image_service.image_lock)
+    if progress:
+        progress("gc_tmp", 2, len(AREAS))
+    _sweep(report, "tmp", import_service.TEMP_DIR, lambda entry: os.path.abspath(entry.path) not in active_inputs, cutoff)
+    # 超过有效期没有收到分块的上传会话整个目录删除
+    upload_cutoff = time.time() - max(grace_seconds, upload_service.UPLOAD_EXPIRY)
+    for directory, size, last_modified in upload_service.upload_sessions():
+        remove = last_modified < upload_cutoff
+        if remove and not dry_run:
+            shutil.rmtree(directory, ignore_errors=True)
+        report.add("tmp", size, remove)
+    if progress:
+        progress("gc_jobs", 3, len(AREAS))
+    # 结果文件在任务结束时才登记，运行中的导出文件由宽限期保护
+    _sweep(report, "jobs", job_service.JOBS_DIR, lambda entry: os.path.abspath(entry.path) not in kept_results, cutoff)
+    if progress:
+        progress("gc_exports", 4, len(AREAS))
+    _sweep(report, "exports", EXPORTS_DIR, lambda entry: True, cutoff)
+
+    result = report.to_dict()
+    if not dry_run:
+        logger.info(f"存储回收完成：删除 {result['files_removed']} 个文件，释放 {result['bytes_reclaimed']} 字节")
+    return result
+
+
+def start_periodic_gc(interval=None):
+    """启动后台线程，每隔interval秒执行一次回收"""
+    global _periodic_thread
+    interval = GC_INTERVAL if interval is None else interval
+    if interval <= 0 or (_periodic_thread and _periodic_thread.is_alive()):
+        return
+
+    def loop():
+        while not _periodic_stop.wait(interval):
+            try:
+                collect_garbage()
+            except Exception as e:
+                logger.error(f"定期存储回收失败: {str(e)}")
+
+    _periodic_stop.clear()
+    _periodic_thread = threading.Thread(target=loop, name="storage-gc", daemon=True)
+    _periodic_thread.start()
+
+
+def stop_periodic_gc():
+    _periodic_stop.set()
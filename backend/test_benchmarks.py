@@ -0,0 +1,43 @@
+import image_service
+import models
+from benchmarks import endpoints
+
+OPTIONS = {
+    "rows": 5, "sheets": 2, "images": 2, "import_repeat": 1,
+    "catalogue": 200, "catalogue_images": 2, "export_rows": 20, "export_repeat": 1,
+    "requests": 10, "concurrency": 2, "seed": 0,
+}
+
+
+def test_percentile_interpolates():
+    assert endpoints.percentile([4, 1, 3, 2], 50) == 2.5
+    assert endpoints.percentile([1, 2, 3, 4, 5], 99) == 4.96
+    assert endpoints.percentile([], 50) is None
+
+
+def test_suite_reports_each_scenario():
+    session_factory, upload_dir = models.SessionLocal, image_service.UPLOAD_DIR
+
+    report = endpoints.run_suite(OPTIONS, isolate=False)
+
+    assert set(report["results"]) == set(endpoints.SCENARIOS)
+    assert report["meta"]["options"] == OPTIONS
+    assert report["results"]["import"]["rows"] == 10
+    assert report["results"]["export"]["rows"] == 20
+    for result in report["results"].values():
+        assert result["p50_ms"] <= result["p99_ms"]
+        assert result["throughput_rps"] > 0
+    # 临时环境结束后恢复原来的数据库和目录
+    assert models.SessionLocal is session_factory and image_service.UPLOAD_DIR == upload_dir
+
+
+def test_compare_marks_direction():
+    before = {"results": {"list": {"throughput_rps": 100.0, "p99_ms": 20.0}}}
+    after = {"results": {"list": {"throughput_rps": 150.0, "p99_ms": 30.0}, "export": {"p99_ms": 1.0}}}
+
+    rows = endpoints.compare(before, after)
+
+    assert rows == [
+        ("list", "throughput_rps", 100.0, 150.0, 50.0, True),
+        ("list", "p99_ms", 20.0, 30.0, 50.0, False),
+    ]
@@ -0,0 +1,91 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import cache_service
+import models
+import routers
+
+
+def test_list_cache_evicts_least_recently_used():
+    cache = cache_service.ListCache(ttl=60, max_entries=2)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    assert cache.get("a").body == b'{"v":1}'
+    cache.put("c", {"v": 3})
+    # b最久未被访问，被淘汰
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+
+
+def test_list_cache_expires_and_can_be_disabled(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_service.time, "monotonic", lambda: now[0])
+    cache = cache_service.ListCache(ttl=5, max_entries=10)
+    cache.put("a", {"v": 1})
+    now[0] += 4
+    assert cache.get("a") is not None
+    now[0] += 2
+    assert cache.get("a") is None
+
+    disabled = cache_service.ListCache(ttl=0)
+    assert disabled.put("a", {"v": 1}).etag
+    assert disabled.get("a") is None
+
+
+def test_etag_follows_content():
+    etag = cache_service.CachedPage({"a": 1}).etag
+    assert etag == cache_service.CachedPage({"a": 1}).etag
+    assert etag != cache_service.CachedPage({"a": 2}).etag
+    assert cache_service.etag_matches(f'W/{etag}, "other"', etag)
+    assert not cache_service.etag_matches(None, etag)
+
+
+@pytest.fixture
+def client(async_db_session):
+    app = FastAPI()
+    app.include_router(routers.router)
+    app.dependency_overrides[models.get_async_db] = lambda: async_db_session
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+FORM = {
+    "factory_code": "A-1", "factory_name": "厂A", "name": "积木", "packaging": "彩盒",
+    "packing_quantity": "12", "unit_price": "1.5", "gross_weight": "5", "net_weight": "4",
+    "outer_box_size": "50*40*30", "product_size": "10*10", "inner_box": "2"
+}
+
+
+async def test_list_is_cached_until_write(client, db_session):
+    db_session.add(models.ToyItem(factory_code="OLD", name="旧货"))
+    db_session.commit()
+
+    async with client:
+        first = await client.get("/items/")
+        etag = first.headers["etag"]
+        assert first.json()["total"] == 1
+        assert first.headers["cache-control"] == "no-cache"
+
+        # 未变化的页面返回304，不带响应体
+        not_modified = await client.get("/items/", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.headers["etag"] == etag
+        assert not_modified.content == b""
+
+        # 不经过接口的写入在缓存有效期内不可见，说明结果来自缓存
+        db_session.add(models.ToyItem(factory_code="RAW", name="直接写入"))
+        db_session.commit()
+        assert (await client.get("/items/")).json()["total"] == 1
+
+        # 通过接口写入后缓存失效，旧ETag不再匹配
+        assert (await client.post("/items/", data=FORM)).status_code == 200
+        refreshed = await client.get("/items/", headers={"If-None-Match": etag})
+        assert refreshed.status_code == 200
+        assert refreshed.json()["total"] == 3
+        assert refreshed.headers["etag"] != etag
+
+        item_id = refreshed.json()["items"][0]["id"]
+        version = cache_service.data_version.value
+        assert (await client.delete(f"/items/{item_id}")).status_code == 200
+        assert cache_service.data_version.value == version + 1
+        assert (await client.get("/items/")).json()["total"] == 2
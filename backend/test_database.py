@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import text
+
+import database
+
+
+def test_sqlite_engine_applies_pragmas(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'pragma.db'}")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # NORMAL = 1
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == database.SQLITE_PRAGMAS["busy_timeout"]
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == database.SQLITE_PRAGMAS["cache_size"]
+    assert engine.pool.size() == database.POOL_SIZE
+    engine.dispose()
+
+
+def test_writes_commit_while_reader_holds_snapshot(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'wal.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE t (v INTEGER)"))
+        conn.execute(text("INSERT INTO t VALUES (1)"))
+
+    reader = engine.connect()
+    try:
+        # 模拟进行中的列表查询：读事务持有快照
+        reader.exec_driver_sql("BEGIN")
+        assert reader.execute(text("SELECT count(*) FROM t")).scalar() == 1
+        # 回滚日志模式下此时提交会等待读事务结束；WAL模式下立即提交
+        with engine.begin() as writer:
+            writer.execute(text("INSERT INTO t VALUES (2)"))
+        assert reader.execute(text("SELECT count(*) FROM t")).scalar() == 1
+        reader.exec_driver_sql("COMMIT")
+        assert reader.execute(text("SELECT count(*) FROM t")).scalar() == 2
+    finally:
+        reader.close()
+        engine.dispose()
+
+
+def test_async_url_uses_async_driver():
+    assert database.to_async_url("sqlite:///a.db").drivername == "sqlite+aiosqlite"
+    assert database.to_async_url("postgresql+psycopg2://u:p@h/db").drivername == "postgresql+asyncpg"
+    assert database.to_async_url("mysql+pymysql://u:p@h/db").drivername == "mysql+aiomysql"
+    assert database.to_async_url("postgresql+asyncpg://u:p@h/db").render_as_string(hide_password=False) == "postgresql+asyncpg://u:p@h/db"
+    # 显式指定的其他同步驱动也换成异步驱动，已是异步驱动的保持不变
+    assert database.to_async_url("sqlite+pysqlite:///a.db").drivername == "sqlite+aiosqlite"
+    assert database.to_async_url("sqlite+aiosqlite:///a.db").drivername == "sqlite+aiosqlite"
+    assert database.to_async_url("postgresql+pg8000://u:p@h/db").drivername == "postgresql+asyncpg"
+    assert database.to_async_url("mysql+mysqldb://u:p@h/db").drivername == "mysql+aiomysql"
+    with pytest.raises(ValueError):
+        database.to_async_url("oracle://u:p@h/db")
+
+
+async def test_async_engine_applies_pragmas(tmp_path):
+    engine = database.create_async_db_engine(f"sqlite:///{tmp_path / 'async.db'}")
+    try:
+        async with engine.connect() as conn:
+            assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+            assert (await conn.execute(text("PRAGMA busy_timeout"))).scalar() == database.SQLITE_PRAGMAS["busy_timeout"]
+    finally:
+        await engine.dispose()
@@ -0,0 +1,124 @@
+import os
+from io import BytesIO
+
+import pytest
+from openpyxl import load_workbook
+from PIL import Image as PILImage
+from sqlalchemy.orm import sessionmaker
+
+import database
+import export_service
+import image_service
+import models
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_service, "UPLOAD_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def session_factory(db_engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+
+def make_image(color, mode="RGB"):
+    buffer = BytesIO()
+    PILImage.new(mode, (400, 300), color).save(buffer, format="PNG")
+    return image_service.store_image_bytes(buffer.getvalue(), ".png")[0]
+
+
+def test_stream_export_builds_readable_workbook(upload_dir, db_session, session_factory):
+    red = make_image((255, 0, 0))
+    clear = make_image((0, 0, 255, 0), mode="RGBA")
+    items = [
+        models.ToyItem(factory_code="A-1", factory_name="厂A", name="小熊<&>", packing_quantity=12,
+                       unit_price=1.25, image_path=red),
+        models.ToyItem(factory_code="A-2", factory_name="厂A", name="赛车\x01", image_path=red),
+        models.ToyItem(factory_code="A-3", factory_name="厂A", name="积木", image_path=clear),
+        models.ToyItem(factory_code="A-4", factory_name="厂A", name="无图", image_path="uploads/missing.jpg"),
+    ]
+    db_session.add_all(items)
+    db_session.commit()
+
+    chunks = list(export_service.stream_export([item.id for item in items], session_factory))
+    assert len(chunks) > 1
+
+    wb = load_workbook(BytesIO(b"".join(chunks)))
+    ws = wb.active
+    assert ws.title == export_service.SHEET_TITLE
+    assert [cell.value for cell in ws[1]] == export_service.HEADERS
+    assert [ws.cell(row=row, column=2).value for row in range(2, 6)] == ["A-1", "A-2", "A-3", "A-4"]
+    assert ws["D2"].value == "小熊<&>"
+    assert ws["D3"].value == "赛车"
+    assert ws["F2"].value == 12
+    assert float(ws["G2"].value) == 1.25
+    assert ws.row_dimensions[2].height == export_service.ROW_HEIGHT
+    assert ws.column_dimensions["A"].width == 20
+    assert ws["B2"].alignment.horizontal == "center"
+
+    # 两行共用同一张图片，缺失的图片被跳过
+    anchored_rows = sorted(image.anchor._from.row + 1 for image in ws._images)
+    assert anchored_rows == [2, 3, 4]
+
+
+def test_stream_export_only_includes_requested_items(upload_dir, db_session, session_factory):
+    db_session.add_all([models.ToyItem(factory_code=f"C{i}") for i in range(5)])
+    db_session.commit()
+
+    data = b"".join(export_service.stream_export([2, 4, 999], session_factory))
+    ws = load_workbook(BytesIO(data)).active
+    assert [row[1] for row in ws.iter_rows(min_row=2, values_only=True)] == ["C1", "C3"]
+    assert ws._images == []
+
+
+def test_stream_export_splits_long_id_lists(upload_dir, db_session, session_factory, monkeypatch):
+    monkeypatch.setattr(database, "IN_CHUNK_SIZE", 2)
+    db_session.add_all([models.ToyItem(factory_code=f"C{i}") for i in range(5)])
+    db_session.commit()
+
+    # id分多次查询后仍按id顺序输出，重复的id只导出一次
+    data = b"".join(export_service.stream_export([5, 1, 3, 2, 4, 3, 999], session_factory))
+    ws = load_workbook(BytesIO(data)).active
+    assert [row[1] for row in ws.iter_rows(min_row=2, values_only=True)] == ["C0", "C1", "C2", "C3", "C4"]
+
+
+def test_export_route_streams_attachment(upload_dir, db_session, session_factory, monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    import routers
+
+    app = FastAPI()
+    app.include_router(routers.router)
+    app.dependency_overrides[models.get_db] = lambda: db_session
+    monkeypatch.setattr(models, "SessionLocal", session_factory)
+    client = TestClient(app)
+
+    item = models.ToyItem(factory_code="R-1")
+    db_session.add(item)
+    db_session.commit()
+
+    response = client.post("/items/export", json={"item_ids": [item.id]})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == export_service.MEDIA_TYPE
+    assert "attachment" in response.headers["content-disposition"]
+    assert load_workbook(BytesIO(response.content)).active["B2"].value == "R-1"
+
+    assert client.post("/items/export", json={"item_ids": [12345]}).status_code == 400
+
+
+def test_export_images_come_from_persistent_cache(upload_dir, db_session, session_factory):
+    paths = [make_image((i * 40, 0, 0)) for i in range(3)]
+    db_session.add_all([models.ToyItem(factory_code=f"P{i}", image_path=path) for i, path in enumerate(paths)])
+    db_session.commit()
+    ids = [item.id for item in db_session.query(models.ToyItem)]
+
+    list(export_service.stream_export(ids, session_factory))
+    cached = [image_service.derivative_abs_path(path, "export") for path in paths]
+    mtimes = [os.path.getmtime(path) for path in cached]
+
+    # 再次导出直接复用已生成的派生图
+    data = b"".join(export_service.stream_export(ids, session_factory))
+    assert [os.path.getmtime(path) for path in cached] == mtimes
+    assert len(load_workbook(BytesIO(data)).active._images) == 3
@@ -0,0 +1,317 @@
+import os
+import time
+from io import BytesIO
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import httpx
+from PIL import Image as PILImage
+
+import database
+import image_service
+import models
+import routers
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_service, "UPLOAD_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(routers.router)
+    return TestClient(app)
+
+
+def save_original(upload_dir, file_name, size=(2000, 1500), mode="RGB"):
+    PILImage.new(mode, size, (200, 30, 30, 128)[:len(mode)]).save(upload_dir / file_name)
+    return f"uploads/{file_name}"
+
+
+def test_generate_derivatives_from_file(upload_dir):
+    image_path = save_original(upload_dir, "big.jpg")
+    image_service.generate_derivatives_from_file(image_path)
+
+    for size, (max_width, max_height, _) in image_service.DERIVATIVE_SIZES.items():
+        with PILImage.open(upload_dir / size / "big.jpg") as img:
+            assert img.format == "JPEG"
+            assert img.width <= max_width and img.height <= max_height
+            # 保持宽高比
+            assert abs(img.width / img.height - 2000 / 1500) < 0.05
+
+
+def test_transparent_png_is_flattened(upload_dir):
+    image_path = save_original(upload_dir, "alpha.png", size=(300, 300), mode="RGBA")
+    path = image_service.ensure_derivative(image_path, "thumb")
+    assert path.endswith(os.path.join("thumb", "alpha.jpg"))
+    with PILImage.open(path) as img:
+        assert img.mode == "RGB"
+
+
+def test_derivative_endpoint_generates_missing_and_rejects_unknown(upload_dir, client):
+    save_original(upload_dir, "legacy.jpg")
+    response = client.get("/images/preview/legacy.jpg")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == image_service.REVALIDATE_CACHE_CONTROL
+    assert (upload_dir / "preview" / "legacy.jpg").exists()
+
+    assert client.get("/images/huge/legacy.jpg").status_code == 404
+    assert client.get("/images/thumb/..%2F..%2Fmodels.py").status_code == 404
+
+
+def test_failed_derivative_write_leaves_no_temp_file(upload_dir, monkeypatch):
+    image_path = save_original(upload_dir, "broken.jpg")
+
+    def fail_replace(src, dst):
+        raise OSError("磁盘已满")
+    monkeypatch.setattr(image_service.os, "replace", fail_replace)
+    with pytest.raises(OSError):
+        image_service.generate_derivatives_from_file(image_path, ["thumb"])
+    assert os.listdir(upload_dir / "thumb") == []
+
+
+def test_remove_image_deletes_derivatives(upload_dir):
+    image_path = save_original(upload_dir, "gone.jpg")
+    image_service.generate_derivatives_from_file(image_path)
+    image_service.remove_image(image_path)
+    assert not (upload_dir / "gone.jpg").exists()
+    for size in image_service.DERIVATIVE_SIZES:
+        assert not (upload_dir / size / "gone.jpg").exists()
+
+
+def test_store_image_bytes_dedupes_by_content(upload_dir):
+    first, created = image_service.store_image_bytes(b"same-bytes", ".png")
+    second, created_again = image_service.store_image_bytes(b"same-bytes", ".png")
+    assert first == second
+    assert created and not created_again
+    assert image_service.is_content_addressed(first)
+    assert image_service.cache_control_for(first) == image_service.IMMUTABLE_CACHE_CONTROL
+    assert image_service.cache_control_for("uploads/20240101120000.jpg") == image_service.REVALIDATE_CACHE_CONTROL
+    assert sorted(os.listdir(upload_dir)) == [os.path.basename(first)]
+
+
+def test_release_image_keeps_shared_files(upload_dir, db_session):
+    image_path, _ = image_service.store_image_bytes(b"shared", ".jpg")
+    first = models.ToyItem(factory_code="A", image_path=image_path)
+    second = models.ToyItem(factory_code="B", image_path=image_path)
+    db_session.add_all([first, second])
+    db_session.commit()
+
+    db_session.delete(first)
+    db_session.commit()
+    assert not image_service.release_image(db_session, image_path)
+    assert os.path.exists(image_service.original_abs_path(image_path))
+
+    db_session.delete(second)
+    db_session.commit()
+    assert image_service.release_image(db_session, image_path)
+    assert not os.path.exists(image_service.original_abs_path(image_path))
+
+
+def test_image_reused_after_release_decision_is_kept(upload_dir, db_session):
+    image_path, _ = image_service.store_image_bytes(b"reused", ".jpg")
+    released_at = time.time()
+    # 决定删除之后相同内容又被保存：复用已有文件并更新修改时间
+    assert not image_service.store_image_bytes(b"reused", ".jpg")[1]
+    assert not image_service.remove_image_if_unused_locked(image_path, released_at)
+    assert os.path.exists(image_service.original_abs_path(image_path))
+
+    assert image_service.release_image(db_session, image_path)
+    assert not os.path.exists(image_service.original_abs_path(image_path))
+
+
+def test_derivative_endpoint_supports_etag(upload_dir, client):
+    image_path = save_original(upload_dir, f"{'a' * 64}.jpg")
+    url = "/" + image_service.derivative_url(image_path, "thumb")
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == image_service.IMMUTABLE_CACHE_CONTROL
+
+    cached = client.get(url, headers={"If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+
+
+def png_bytes(color):
+    buffer = BytesIO()
+    PILImage.new("RGB", (300, 200), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def test_item_crud_uses_async_session(upload_dir, async_db_session):
+    app = FastAPI()
+    app.include_router(routers.router)
+    app.dependency_overrides[models.get_async_db] = lambda: async_db_session
+    form = {
+        "factory_code": "A-1", "factory_name": "厂A", "name": "积木", "packaging": "彩盒",
+        "packing_quantity": "12", "unit_price": "1.5", "gross_weight": "5", "net_weight": "4",
+        "outer_box_size": "50*40*30", "product_size": "10*10", "inner_box": "2"
+    }
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/items/", data=form, files={"image": ("red.png", png_bytes((255, 0, 0)), "image/png")})
+        assert response.status_code == 200
+        item = response.json()
+        old_image = item["image_path"]
+        assert image_service.has_derivatives(old_image)
+
+        # 更换图片后旧图片没有其他记录引用，随之删除
+        response = await client.put(f"/items/{item['id']}", data={**form, "name": "大积木"},
+                                    files={"image": ("blue.png", png_bytes((0, 0, 255)), "image/png")})
+        assert response.status_code == 200
+        new_image = response.json()["image_path"]
+        assert new_image != old_image
+        assert not os.path.exists(image_service.original_abs_path(old_image))
+
+        listing = (await client.get("/items/", params={"name": "大积木"})).json()
+        assert [row["id"] for row in listing["items"]] == [item["id"]]
+
+        assert (await client.delete(f"/items/{item['id']}")).status_code == 200
+        assert (await client.delete(f"/items/{item['id']}")).status_code == 404
+        assert not os.path.exists(image_service.original_abs_path(new_image))
+
+
+@pytest.fixture
+def async_client(async_db_session):
+    app = FastAPI()
+    app.include_router(routers.router)
+    app.dependency_overrides[models.get_async_db] = lambda: async_db_session
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def add_items_with_images(db_session):
+    shared, _ = image_service.store_image_bytes(png_bytes((255, 0, 0)), ".png")
+    kept, _ = image_service.store_image_bytes(png_bytes((0, 0, 255)), ".png")
+    for path in (shared, kept):
+        image_service.generate_derivatives_from_file(path)
+    items = [
+        models.ToyItem(factory_code="A", image_path=shared),
+        models.ToyItem(factory_code="B", image_path=shared),
+        models.ToyItem(factory_code="C", image_path=kept),
+        models.ToyItem(factory_code="D", image_path=kept),
+        models.ToyItem(factory_code="E"),
+    ]
+    db_session.add_all(items)
+    db_session.commit()
+    return [item.id for item in items], shared, kept
+
+
+async def test_batch_delete_removes_only_unreferenced_images(upload_dir, db_session, async_client, monkeypatch):
+    ids, shared, kept = add_items_with_images(db_session)
+    # 每批2个id，验证多条DELETE语句
+    monkeypatch.setattr(database, "IN_CHUNK_SIZE", 2)
+
+    async with async_client:
+        response = await async_client.request("DELETE", "/items/batch", json={"item_ids": ids[:3] + [ids[4], 9999]})
+
+    assert response.json() == {"message": "4 items deleted successfully"}
+    assert [item.factory_code for item in db_session.query(models.ToyItem)] == ["D"]
+    # 共用图片的记录全部删除后才删除文件，仍被D引用的图片保留
+    assert not os.path.exists(image_service.original_abs_path(shared))
+    assert not os.path.exists(image_service.derivative_abs_path(shared, "thumb"))
+    assert image_service.has_derivatives(kept)
+
+
+async def test_batch_delete_is_atomic(upload_dir, db_session, async_db_session, async_client, monkeypatch):
+    ids, shared, kept = add_items_with_images(db_session)
+    monkeypatch.setattr(database, "IN_CHUNK_SIZE", 2)
+    execute = async_db_session.execute
+    deletes = []
+
+    async def failing_execute(statement, *args, **kwargs):
+        if statement.is_delete:
+            deletes.append(statement)
+            if len(deletes) == 2:
+                raise RuntimeError("模拟第二批删除失败")
+        return await execute(statement, *args, **kwargs)
+
+    monkeypatch.setattr(async_db_session, "execute", failing_execute)
+    async with async_client:
+        with pytest.raises(RuntimeError):
+            await async_client.request("DELETE", "/items/batch", json={"item_ids": ids})
+
+    # 第一批已执行的删除随事务回滚，图片文件不受影响
+    await async_db_session.rollback()
+    assert db_session.query(models.ToyItem).count() == 5
+    assert os.path.exists(image_service.original_abs_path(shared))
+
+
+async def test_background_release_rechecks_references(upload_dir, db_session, async_db_engine):
+    image_path, _ = image_service.store_image_bytes(png_bytes((0, 255, 0)), ".png")
+    image_service.generate_derivatives_from_file(image_path)
+    released_at = time.time()
+    # 删除记录后、后台任务执行前，相同图片被新记录引用并已提交
+    db_session.add(models.ToyItem(factory_code="F", image_path=image_path))
+    db_session.commit()
+
+    await image_service.release_images_async(async_db_engine, [image_path], released_at)
+    assert image_service.has_derivatives(image_path)
+
+    db_session.query(models.ToyItem).delete()
+    db_session.commit()
+    await image_service.release_images_async(async_db_engine, [image_path], time.time())
+    assert not os.path.exists(image_service.original_abs_path(image_path))
+    assert not os.path.exists(image_service.derivative_abs_path(image_path, "thumb"))
+
+
+class CountingReader(BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+def test_store_image_stream_validates_while_streaming(upload_dir, monkeypatch):
+    monkeypatch.setattr(image_service, "UPLOAD_READ_SIZE", 100)
+    data = png_bytes((255, 0, 0))
+    reader = CountingReader(data)
+
+    image_path, created = image_service.store_image_stream(reader, ".png")
+
+    # 按块读取，文件名与一次性读入内存时相同
+    assert created and image_path == image_service.store_image_bytes(data, ".png")[0]
+    assert len(reader.reads) > 2 and all(size == 100 for size in reader.reads)
+    assert not image_service.store_image_stream(BytesIO(data), ".png")[1]
+    assert sorted(os.listdir(upload_dir)) == [os.path.basename(image_path)]
+
+
+def test_store_image_stream_rejects_bad_uploads(upload_dir):
+    with pytest.raises(image_service.ImageTooLargeError):
+        image_service.store_image_stream(BytesIO(png_bytes((0, 0, 0))), ".png", max_bytes=100)
+    with pytest.raises(ValueError):
+        image_service.store_image_stream(BytesIO(b"not an image"), ".png")
+    with pytest.raises(ValueError):
+        image_service.store_image_stream(BytesIO(png_bytes((0, 0, 0))[:-30]), ".png")
+    # 压缩后很小、解码后很大的图片只读取文件头即可拒绝
+    bomb = BytesIO()
+    PILImage.new("L", (4000, 3000)).save(bomb, format="PNG")
+    assert bomb.tell() < 100_000
+    with pytest.raises(image_service.ImageTooLargeError):
+        image_service.store_image_stream(BytesIO(bomb.getvalue()), ".png", max_pixels=10_000_000)
+    # 临时文件都已删除
+    assert os.listdir(upload_dir) == []
+
+
+async def test_item_upload_limits(upload_dir, async_client, monkeypatch):
+    form = {
+        "factory_code": "A-1", "factory_name": "厂A", "name": "积木", "packaging": "彩盒",
+        "packing_quantity": "12", "unit_price": "1.5", "gross_weight": "5", "net_weight": "4",
+        "outer_box_size": "50*40*30", "product_size": "10*10", "inner_box": "2"
+    }
+    monkeypatch.setattr(image_service, "MAX_UPLOAD_IMAGE_BYTES", 500)
+    async with async_client as client:
+        response = await client.post("/items/", data=form, files={"image": ("fake.png", b"plain text", "image/png")})
+        assert response.status_code == 400
+        # 错误信息不包含服务器上的路径
+        assert response.json()["detail"] == "无效的图片文件: 无法识别的图片格式"
+        assert str(upload_dir) not in response.text and ".tmp" not in response.text
+        response = await client.post("/items/", data=form, files={"image": ("red.png", png_bytes((255, 0, 0)), "image/png")})
+        assert response.status_code == 413
+        assert (await client.get("/items/")).json()["total"] == 0
+    # 上传目录与测试数据库在同一临时目录下，只检查图片和临时文件
+    assert not [name for name in os.listdir(upload_dir) if name.endswith((".png", ".tmp"))]
@@ -1,69 +1,87 @@
+import asyncio
+import os
+import threading
+import zipfile
+from io import BytesIO
+from unittest.mock import MagicMock
+
 import pytest
 from fastapi import UploadFile, HTTPException
-from sqlalchemy.orm import Session
-from unittest.mock import MagicMock, patch
-from datetime import datetime
-import os
-import shutil
-import uuid
 from openpyxl import Workbook
+from openpyxl.drawing.image import Image as XLImage
 from PIL import Image as PILImage
-from io import BytesIO
+from sqlalchemy.orm import Session
 
+import cache_service
+import image_service
+import import_service
 from import_service import import_items
 from models import ToyItem
 
+HEADERS = ["图片", "货号", "厂名", "品名", "包装", "装箱量PCS", "单价", "毛重KG", "净重KG", "外箱规格CM", "产品规格", "内箱", "备注"]
+
+
+@pytest.fixture(autouse=True)
+def work_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_service, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(import_service, "TEMP_DIR", str(tmp_path / "tmp"))
+    return tmp_path
+
+
 @pytest.fixture
 def mock_db():
     db = MagicMock(spec=Session)
     return db
 
-@pytest.fixture
-def mock_upload_file(tmp_path):
-    file_path = tmp_path / "test.xlsx"
+
+def add_image(ws, cell, color):
+    buffer = BytesIO()
+    PILImage.new("RGB", (200, 150), color).save(buffer, format="PNG")
+    ws.add_image(XLImage(buffer), cell)
+
+
+def image_color(image_path):
+    # JPEG有损压缩后颜色会有细微偏差，按通道取整到0或255比较
+    with PILImage.open(image_service.original_abs_path(image_path)) as img:
+        return tuple(255 if v > 127 else 0 for v in img.convert("RGB").getpixel((100, 75)))
+
+
+def make_upload(rows, headers=HEADERS, images=(), filename="test.xlsx"):
     wb = Workbook()
     ws = wb.active
     ws.title = "Test"
-    headers = ["图片", "货号", "厂名", "品名", "包装", "装箱量PCS", "单价", "毛重KG", "净重KG", "外箱规格CM", "产品规格", "内箱", "备注"]
-    for col, header in enumerate(headers, 1):
-        ws.cell(row=1, column=col, value=header)
-    wb.save(file_path)
-    return UploadFile(filename="test.xlsx", file=open(file_path, "rb"))
-
-@patch('import_service.os.makedirs')
-@patch('import_service.os.path.exists', return_value=True)
-@patch('import_service.os.remove')
-@patch('import_service.shutil.copyfileobj')
-@patch('import_service.load_workbook')
-@patch('import_service.PILImage.open')
-@patch('import_service.uuid.uuid4')
-@patch('import_service.datetime')
-async def test_import_items(mock_datetime, mock_uuid, mock_pil, mock_load_workbook, mock_copyfileobj, mock_remove, mock_exists, mock_makedirs, mock_db, mock_upload_file):
-    # Mock datetime
-    mock_datetime.now.return_value.strftime.return_value = "20230101000000"
-    # Mock uuid
-    mock_uuid.return_value.hex = "testuuid"
-    # Mock PILImage
-    mock_image = MagicMock()
-    mock_image.mode = "RGB"
-    mock_pil.return_value = mock_image
-    # Mock workbook
-    mock_workbook = MagicMock()
-    mock_sheet = MagicMock()
-    mock_sheet._images = []
-    mock_sheet.iter_rows.return_value = [
-        [MagicMock(value="test_code"), MagicMock(value="test_name"), MagicMock(value="test_packaging"), MagicMock(value=10)]
-    ]
-    mock_workbook.active = mock_sheet
-    mock_load_workbook.return_value = mock_workbook
-
-    # Test
-    result = await import_items(file=mock_upload_file, factory_name="test_factory", db=mock_db)
-
-    # Assert
+    ws.append(headers)
+    for row in rows:
+        ws.append(row)
+    for row_idx, color in images:
+        add_image(ws, f"A{row_idx}", color)
+    output = BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return UploadFile(filename=filename, file=output)
+
+
+@pytest.fixture
+def mock_upload_file():
+    return make_upload([[None, "test_code", None, "test_name", "test_packaging", 10, 1.5]])
+
+
+async def test_import_items(db_session, mock_upload_file):
+    version = cache_service.data_version.value
+    result = await import_items(file=mock_upload_file, factory_name="test_factory", db=db_session)
+
     assert result["imported_count"] == 1
-    mock_db.add.assert_called_once()
-    mock_db.commit.assert_called_once()
+    item = db_session.query(ToyItem).one()
+    assert (item.factory_code, item.name, item.factory_name) == ("test_code", "test_name", "test_factory")
+    assert item.packing_quantity == 10
+    assert item.origin_sheet == "Test"
+    assert item.created_at and item.updated_at
+    assert result["rows_per_second"] > 0
+    # 导入提交后列表缓存失效
+    assert cache_service.data_version.value > version
+    # 临时文件在导入结束后删除
+    assert os.listdir(import_service.TEMP_DIR) == []
+
 
 async def test_import_items_invalid_file_type(mock_db):
     mock_file = MagicMock(spec=UploadFile)
@@ -73,45 +91,252 @@ async def test_import_items_invalid_file_type(mock_db):
     assert exc_info.value.status_code == 400
     assert "只支持Excel文件格式" in exc_info.value.detail
 
-async def test_import_items_with_images(mock_db):
-    # Setup mock upload file with images
-    file_path = "d:\\toy-manage-system\\backend\\exports\\货物导入模板 (2).xlsx"
-    mock_file = UploadFile(filename="货物导入模板 (2).xlsx", file=open(file_path, "rb"))
-
-    # Mock necessary components
-    with patch('import_service.load_workbook') as mock_load_workbook, \
-         patch('import_service.PILImage.open') as mock_pil, \
-         patch('import_service.uuid.uuid4') as mock_uuid, \
-         patch('import_service.datetime') as mock_datetime, \
-         patch('import_service.os.makedirs'), \
-         patch('import_service.os.path.exists', return_value=True):
-
-        # Mock UUID
-        mock_uuid.return_value.hex = "testuuid"
-        # Mock datetime
-        mock_datetime.now.return_value.strftime.return_value = "20230101000000"
-        # Mock PILImage
-        mock_image = MagicMock()
-        mock_image.mode = "RGB"
-        mock_pil.return_value = mock_image
-
-        # Execute import
-        result = await import_items(file=mock_file, factory_name="test_factory", db=mock_db)
-
-        # Verify results
-        assert result["imported_count"] > 0
-        mock_db.add.assert_called()
-        mock_db.commit.assert_called()
-
-async def test_import_items_missing_required_columns(mock_db, mock_upload_file):
-    with patch('import_service.load_workbook') as mock_load_workbook:
-        mock_workbook = MagicMock()
-        mock_sheet = MagicMock()
-        mock_sheet._images = []
-        mock_sheet.iter_rows.return_value = []
-        mock_workbook.active = mock_sheet
-        mock_load_workbook.return_value = mock_workbook
-        with pytest.raises(HTTPException) as exc_info:
-            await import_items(file=mock_upload_file, factory_name="test_factory", db=mock_db)
-        assert exc_info.value.status_code == 400
-        assert "缺少必要的列" in exc_info.value.detail
\ No newline at end of file
+
+async def test_import_items_with_images(db_session):
+    upload = make_upload(
+        [[None, f"A-{i}", None, f"玩具{i}", "彩盒", 12] for i in range(3)],
+        images=[(2, (255, 0, 0)), (3, (0, 255, 0)), (4, (255, 0, 0))]
+    )
+
+    result = await import_items(file=upload, factory_name="test_factory", db=db_session)
+
+    assert result["imported_count"] == 3
+    paths = [item.image_path for item in db_session.query(ToyItem).order_by(ToyItem.id)]
+    assert all(paths)
+    # 相同内容的图片只保存一份
+    assert paths[0] == paths[2] != paths[1]
+    for path in set(paths):
+        assert os.path.exists(image_service.original_abs_path(path))
+        assert image_service.has_derivatives(path)
+
+
+async def test_import_items_missing_required_columns(mock_db):
+    upload = make_upload([["test_code"]], headers=["货号"])
+    with pytest.raises(HTTPException) as exc_info:
+        await import_items(file=upload, factory_name="test_factory", db=mock_db)
+    assert exc_info.value.status_code == 400
+    assert "缺少必要的列" in exc_info.value.detail
+
+
+async def test_import_does_not_block_event_loop(db_session, mock_upload_file):
+    loop_ran = threading.Event()
+    waited = []
+
+    def progress(stage, done, total, message):
+        # 导入在工作线程中执行时，事件循环仍能运行其他协程
+        waited.append(loop_ran.wait(timeout=5))
+
+    async def other_request():
+        loop_ran.set()
+
+    path = import_service.save_upload_to_temp(mock_upload_file)
+    result, _ = await asyncio.gather(
+        import_service.import_workbook(path, "test.xlsx", "test_factory", db_session, progress=progress),
+        other_request()
+    )
+
+    assert result["imported_count"] == 1
+    assert waited and all(waited)
+
+
+async def test_import_streams_sheets_with_short_rows(db_session):
+    wb = Workbook()
+    wb.active.title = "空表"
+    ws = wb.create_sheet("报价")
+    ws.append(HEADERS)
+    # 只读模式下行尾空单元格不会返回，较短的行按缺失字段处理
+    for i in range(7):
+        ws.append([None, f"B-{i}", "厂B", f"玩具{i}", "彩盒", "12PCS"])
+    ws.append([None, None, None, "缺货号", "彩盒"])
+    other = wb.create_sheet("补充")
+    other.append(["货号", "品名", "包装", "装箱量PCS", "单价"])
+    other.append(["C-1", "积木", "袋装", 6, 2.5])
+    path = os.path.join(import_service.TEMP_DIR, "multi.xlsx")
+    os.makedirs(import_service.TEMP_DIR, exist_ok=True)
+    wb.save(path)
+    stages = []
+
+    result = await import_service.import_workbook(
+        path, "multi.xlsx", "表单厂", db_session, batch_size=3,
+        progress=lambda stage, done, total, message: stages.append((stage, done, total, message))
+    )
+
+    assert result["imported_count"] == 8
+    items = db_session.query(ToyItem).order_by(ToyItem.id).all()
+    assert [item.origin_sheet for item in items] == ["报价"] * 7 + ["补充"]
+    assert items[0].packing_quantity == 12 and items[0].unit_price == 0.0
+    assert items[-1].factory_name == "表单厂" and items[-1].unit_price == 2.5
+    assert ("import_rows", 6, 8, "报价") in stages
+
+
+async def test_import_maps_images_by_anchor_row(db_session):
+    wb = Workbook()
+    first = wb.active
+    first.title = "第一页"
+    first.append(HEADERS)
+    for i in range(3):
+        first.append([None, f"A-{i}", None, f"玩具{i}", "彩盒", 12])
+    # 图片的添加顺序与行顺序不同，第3行（A-1）没有图片
+    add_image(first, "A4", (0, 0, 255))
+    add_image(first, "A2", (255, 0, 0))
+    second = wb.create_sheet("第二页")
+    second.append(HEADERS)
+    second.append([None, "B-0", None, "积木", "袋装", 6])
+    add_image(second, "A2", (0, 255, 0))
+    path = os.path.join(import_service.TEMP_DIR, "anchors.xlsx")
+    os.makedirs(import_service.TEMP_DIR, exist_ok=True)
+    wb.save(path)
+    # 没有被任何单元格引用的图片不会被处理
+    with zipfile.ZipFile(path, "a") as zf:
+        buffer = BytesIO()
+        PILImage.new("RGB", (10, 10), (9, 9, 9)).save(buffer, format="PNG")
+        zf.writestr("xl/media/orphan.png", buffer.getvalue())
+
+    images, anchors = import_service.extract_images(path)
+    assert "xl/media/orphan.png" not in images
+    assert sorted(anchors) == ["第一页", "第二页"]
+    assert sorted(anchors["第一页"]) == [2, 4]
+
+    result = await import_service.import_workbook(path, "anchors.xlsx", "厂A", db_session)
+
+    assert result["imported_count"] == 4
+    items = {item.factory_code: item for item in db_session.query(ToyItem)}
+    assert items["A-1"].image_path is None
+    assert image_color(items["A-0"].image_path) == (255, 0, 0)
+    assert image_color(items["A-2"].image_path) == (0, 0, 255)
+    assert image_color(items["B-0"].image_path) == (0, 255, 0)
+
+
+async def test_import_sheet_is_one_transaction(db_session):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "报价"
+    ws.append(["货号", "品名", "包装", "装箱量PCS", "单价"])
+    for i in range(5):
+        ws.append([f"A-{i}", f"玩具{i}", "彩盒", 12, 1.5])
+    # 单价不是数字，整张工作表（包括已批量写入的行）一起回滚
+    ws.append(["A-5", "玩具5", "彩盒", 12, "待定"])
+    path = os.path.join(import_service.TEMP_DIR, "bad.xlsx")
+    os.makedirs(import_service.TEMP_DIR, exist_ok=True)
+    wb.save(path)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await import_service.import_workbook(path, "bad.xlsx", "厂A", db_session, batch_size=2)
+
+    assert exc_info.value.status_code == 500
+    assert "单价列第7行" in exc_info.value.detail
+    assert db_session.query(ToyItem).count() == 0
+
+
+def save_workbook(name, rows, images=()):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "报价"
+    ws.append(HEADERS)
+    for row in rows:
+        ws.append(row)
+    for row_idx, color in images:
+        add_image(ws, f"A{row_idx}", color)
+    path = os.path.join(import_service.TEMP_DIR, name)
+    os.makedirs(import_service.TEMP_DIR, exist_ok=True)
+    wb.save(path)
+    return path
+
+
+async def test_upsert_skips_unchanged_rows_and_updates_changed(db_session, monkeypatch):
+    rows = [[None, f"A-{i}", None, f"玩具{i}", "彩盒", 12, 1.5] for i in range(4)]
+    first = save_workbook("week1.xlsx", rows, images=[(2, (255, 0, 0))])
+    result = await import_service.import_workbook(first, "week1.xlsx", "厂A", db_session, mode="upsert", batch_size=3)
+    assert (result["inserted"], result["updated"], result["unchanged"]) == (4, 0, 0)
+    ids = {item.factory_code: item.id for item in db_session.query(ToyItem)}
+
+    # 第二周：A-1改价，A-0换图，新增A-4，货号为数字的行按字符串匹配；已导入的图片不再处理
+    rows[1][6] = 2.0
+    rows.append([None, "A-4", None, "玩具4", "彩盒", 12, 1.5])
+    rows.append([None, 1005, None, "数字货号", "彩盒", 12, 1.5])
+    second = save_workbook("week2.xlsx", rows, images=[(2, (0, 0, 255)), (3, (255, 0, 0))])
+    processed = []
+    original = import_service.process_image_data
+    monkeypatch.setattr(import_service, "process_image_data", lambda data, *args: processed.append(data) or original(data, *args))
+    monkeypatch.setattr(image_service, "get_process_pool", lambda: None)
+    result = await import_service.import_workbook(second, "week2.xlsx", "厂A", db_session, mode="upsert", batch_size=3)
+
+    assert (result["inserted"], result["updated"], result["unchanged"]) == (2, 2, 2)
+    assert result["imported_count"] == 4 and not result["duplicate_file"]
+    assert len(processed) == 1  # 只有新的蓝色图片需要处理
+    db_session.expire_all()
+    items = {item.factory_code: item for item in db_session.query(ToyItem)}
+    assert len(items) == 6 and {code: items[code].id for code in ids} == ids
+    assert float(items["A-1"].unit_price) == 2.0
+    assert image_color(items["A-0"].image_path) == (0, 0, 255)
+    assert image_color(items["A-1"].image_path) == (255, 0, 0)
+
+    # 再次导入数字货号的文件，全部未变化
+    again = save_workbook("week2-copy.xlsx", rows, images=[(2, (0, 0, 255)), (3, (255, 0, 0))])
+    result = await import_service.import_workbook(again, "week2-copy.xlsx", "厂A", db_session, mode="upsert")
+    assert (result["inserted"], result["updated"], result["unchanged"]) == (0, 0, 6)
+
+
+async def test_upsert_releases_replaced_images_and_keeps_failed_ones(db_session, monkeypatch):
+    rows = [[None, f"A-{i}", None, f"玩具{i}", "彩盒", 12, 1.5] for i in range(2)]
+    first = save_workbook("week1.xlsx", rows, images=[(2, (255, 0, 0)), (3, (0, 255, 0))])
+    await import_service.import_workbook(first, "week1.xlsx", "厂A", db_session, mode="upsert")
+    old_paths = {item.factory_code: item.image_path for item in db_session.query(ToyItem)}
+
+    # A-0换图；A-1的新图片处理失败，其余内容未变化
+    second = save_workbook("week2.xlsx", rows, images=[(2, (0, 0, 255)), (3, (255, 255, 0))])
+    original = import_service.process_image_data
+
+    def fail_yellow(data, *args):
+        with PILImage.open(BytesIO(data)) as img:
+            if img.convert("RGB").getpixel((0, 0)) == (255, 255, 0):
+                return None
+        return original(data, *args)
+    monkeypatch.setattr(import_service, "process_image_data", fail_yellow)
+    monkeypatch.setattr(image_service, "get_process_pool", lambda: None)
+    result = await import_service.import_workbook(second, "week2.xlsx", "厂A", db_session, mode="upsert")
+
+    assert (result["updated"], result["unchanged"]) == (1, 1)
+    db_session.expire_all()
+    items = {item.factory_code: item for item in db_session.query(ToyItem)}
+    assert image_color(items["A-0"].image_path) == (0, 0, 255)
+    assert items["A-1"].image_path == old_paths["A-1"]
+    # 被替换且已无引用的旧图片及派生图已删除
+    assert not os.path.exists(image_service.original_abs_path(old_paths["A-0"]))
+    assert not os.path.exists(image_service.derivative_abs_path(old_paths["A-0"], "thumb"))
+    assert image_service.has_derivatives(old_paths["A-1"])
+
+
+async def test_upsert_recognizes_identical_file(db_session, monkeypatch):
+    path = save_workbook("same.xlsx", [[None, "A-0", None, "玩具", "彩盒", 12, 1.5], [None, "A-1", None, "积木", "彩盒", 6]])
+    result = await import_service.import_workbook(path, "same.xlsx", "厂A", db_session, mode="upsert")
+    assert result["inserted"] == 2
+
+    def fail(*args, **kwargs):
+        raise AssertionError("相同文件不应再解析")
+    monkeypatch.setattr(import_service, "load_workbook", fail)
+    result = await import_service.import_workbook(path, "same.xlsx", "厂A", db_session, mode="upsert")
+    assert result["duplicate_file"] and (result["inserted"], result["updated"], result["unchanged"]) == (0, 0, 2)
+
+    # 导入后记录被修改过时不能跳过，改动的行恢复为文件中的内容
+    monkeypatch.undo()
+    item = db_session.query(ToyItem).filter(ToyItem.factory_code == "A-0").one()
+    item.name = "手工修改"
+    item.row_fingerprint = None
+    db_session.commit()
+    result = await import_service.import_workbook(path, "same.xlsx", "厂A", db_session, mode="upsert")
+    assert not result["duplicate_file"] and (result["updated"], result["unchanged"]) == (1, 1)
+    db_session.refresh(item)
+    assert item.name == "玩具"
+
+
+async def test_insert_mode_still_duplicates_and_rejects_unknown_mode(db_session):
+    path = save_workbook("insert.xlsx", [[None, "A-0", None, "玩具", "彩盒", 12]])
+    await import_service.import_workbook(path, "insert.xlsx", "厂A", db_session)
+    result = await import_service.import_workbook(path, "insert.xlsx", "厂A", db_session)
+
+    assert (result["inserted"], result["unchanged"]) == (1, 0)
+    assert db_session.query(ToyItem).count() == 2
+    with pytest.raises(HTTPException) as exc_info:
+        await import_service.import_workbook(path, "insert.xlsx", "厂A", db_session, mode="merge")
+    assert exc_info.value.status_code == 400
@@ -0,0 +1,204 @@
+import ctypes
+import json
+import os
+import socket
+import subprocess
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from openpyxl import Workbook, load_workbook
+from sqlalchemy.orm import sessionmaker
+
+import import_service
+import job_service
+import models
+import routers
+
+
+class InlineExecutor:
+    """测试中同步执行任务，便于断言最终状态"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def session_factory(db_engine, tmp_path, monkeypatch):
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    monkeypatch.setattr(models, "SessionLocal", factory)
+    monkeypatch.setattr(job_service, "JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(import_service, "TEMP_DIR", str(tmp_path / "tmp"))
+    monkeypatch.setattr(job_service, "_get_executor", lambda: InlineExecutor())
+    return factory
+
+
+@pytest.fixture
+def client(session_factory):
+    def get_db():
+        # 与真实请求一样，每个请求使用独立的会话
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(routers.router)
+    app.dependency_overrides[models.get_db] = get_db
+    return TestClient(app)
+
+
+def workbook_bytes(rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["货号", "品名", "包装", "装箱量PCS", "单价"])
+    for row in rows:
+        ws.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def test_import_job_reports_progress_and_result(client, db_session):
+    data = workbook_bytes([("A-1", "小熊", "彩盒", 12, 1.5), ("A-2", "赛车", "吸塑", 24, 3)])
+    response = client.post(
+        "/jobs/import",
+        files={"file": ("price.xlsx", data)},
+        data={"factory_name": "星星玩具厂"}
+    )
+    job_id = response.json()["job_id"]
+
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == job_service.STATUS_SUCCEEDED
+    assert job["stage"] == "sheets"
+    assert job["progress_done"] == job["progress_total"] == 1
+    assert client.get(f"/jobs/{job_id}/result").json()["imported_count"] == 2
+    assert db_session.query(models.ToyItem).filter(models.ToyItem.factory_name == "星星玩具厂").count() == 2
+    # 输入文件在任务结束后删除
+    assert not list(Path(import_service.TEMP_DIR).glob("*"))
+
+
+def test_export_job_result_download(client, db_session):
+    items = [models.ToyItem(factory_code=f"E-{i}") for i in range(3)]
+    db_session.add_all(items)
+    db_session.commit()
+
+    job_id = client.post("/jobs/export", json={"item_ids": [item.id for item in items]}).json()["job_id"]
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == job_service.STATUS_SUCCEEDED
+    assert job["has_result_file"]
+
+    response = client.get(f"/jobs/{job_id}/result")
+    assert response.status_code == 200
+    ws = load_workbook(BytesIO(response.content)).active
+    assert [row[1] for row in ws.iter_rows(min_row=2, values_only=True)] == ["E-0", "E-1", "E-2"]
+
+
+def test_failed_job_records_error(client):
+    response = client.post(
+        "/jobs/import",
+        files={"file": ("broken.xlsx", b"not a workbook")},
+        data={"factory_name": "厂"}
+    )
+    job = client.get(f"/jobs/{response.json()['job_id']}").json()
+    assert job["status"] == job_service.STATUS_FAILED
+    assert "导入失败" in job["error"]
+    assert client.get(f"/jobs/{job['id']}/result").status_code == 409
+
+
+def test_cancel_pending_and_running_jobs(session_factory, db_session):
+    pending = models.Job(id="pending", kind="export", status=job_service.STATUS_PENDING, params="{}")
+    running = models.Job(id="running", kind="export", status=job_service.STATUS_RUNNING, params="{}")
+    db_session.add_all([pending, running])
+    db_session.commit()
+
+    job_service.request_cancel(db_session, pending)
+    assert pending.status == job_service.STATUS_CANCELLED
+
+    job_service.request_cancel(db_session, running)
+    assert running.status == job_service.STATUS_RUNNING
+    with pytest.raises(job_service.JobCancelled):
+        job_service.JobContext("running", session_factory).progress("export_rows", 1, 10)
+
+
+def test_cancelled_export_job_stops_and_cleans_up(session_factory, db_session, monkeypatch):
+    db_session.add_all([models.ToyItem(factory_code=f"C-{i}") for i in range(3)])
+    db_session.add(models.Job(
+        id="job1", kind="export", status=job_service.STATUS_PENDING,
+        params=json.dumps({"item_ids": [1, 2, 3], "file_name": "x.xlsx"})
+    ))
+    db_session.commit()
+
+    def cancel_during_progress(self, stage, done=0, total=0, message=None):
+        db = session_factory()
+        db.get(models.Job, "job1").cancel_requested = True
+        db.commit()
+        db.close()
+        raise job_service.JobCancelled()
+
+    monkeypatch.setattr(job_service.JobContext, "progress", cancel_during_progress)
+    job_service.run_job("job1", session_factory)
+
+    db_session.expire_all()
+    job = db_session.get(models.Job, "job1")
+    assert job.status == job_service.STATUS_CANCELLED
+    assert job.result_path is None
+
+
+def test_recover_jobs_only_fails_dead_local_workers(session_factory, db_session):
+    host = socket.gethostname()
+    db_session.add_all([
+        models.Job(id="dead", kind="import", status=job_service.STATUS_RUNNING, worker=f"{host}:999999999"),
+        models.Job(id="remote", kind="import", status=job_service.STATUS_RUNNING, worker="other-host:1"),
+        models.Job(id="done", kind="import", status=job_service.STATUS_SUCCEEDED, worker=f"{host}:999999999"),
+    ])
+    db_session.commit()
+
+    job_service.recover_jobs(session_factory)
+    db_session.expire_all()
+    assert db_session.get(models.Job, "dead").status == job_service.STATUS_FAILED
+    assert db_session.get(models.Job, "remote").status == job_service.STATUS_RUNNING
+    assert db_session.get(models.Job, "done").status == job_service.STATUS_SUCCEEDED
+
+
+def test_pid_alive_checks_local_processes():
+    assert job_service._pid_alive(os.getpid())
+    finished = subprocess.Popen([sys.executable, "-c", "pass"])
+    finished.wait()
+    assert not job_service._pid_alive(finished.pid)
+
+
+class FakeKernel32:
+    def __init__(self, exit_codes):
+        self.exit_codes = exit_codes
+        self.closed = []
+
+    def OpenProcess(self, access, inherit, pid):
+        return pid if pid in self.exit_codes else 0
+
+    def GetExitCodeProcess(self, handle, exit_code):
+        exit_code._obj.value = self.exit_codes[handle]
+        return 1
+
+    def CloseHandle(self, handle):
+        self.closed.append(handle)
+
+
+def test_pid_alive_on_windows_does_not_signal(monkeypatch):
+    kernel32 = FakeKernel32({100: job_service.STILL_ACTIVE, 200: 0})
+    monkeypatch.setattr(ctypes, "WinDLL", lambda name, use_last_error=False: kernel32, raising=False)
+    monkeypatch.setattr(ctypes, "get_last_error", lambda: 87, raising=False)
+
+    def fail_kill(pid, sig):
+        raise AssertionError("Windows上不能用os.kill探测进程")
+    monkeypatch.setattr(job_service.os, "kill", fail_kill)
+    monkeypatch.setattr(job_service.os, "name", "nt")
+    alive = [job_service._pid_alive(pid) for pid in (100, 200, 300)]
+    monkeypatch.undo()
+
+    assert alive == [True, False, False]
+    assert kernel32.closed == [100, 200]
@@ -0,0 +1,114 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from openpyxl import Workbook
+from prometheus_client import REGISTRY
+from sqlalchemy.orm import sessionmaker
+
+import export_service
+import image_service
+import import_service
+import metrics_service
+import models
+import routers
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def stage_count(operation, stage):
+    return sample("toy_stage_duration_seconds_count", operation=operation, stage=stage)
+
+
+@pytest.fixture
+def app(async_db_session):
+    app = FastAPI()
+    app.include_router(routers.router)
+    app.add_middleware(metrics_service.MetricsMiddleware)
+    app.dependency_overrides[models.get_async_db] = lambda: async_db_session
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def test_requests_are_labelled_by_route_template(db_session, client):
+    db_session.add(models.ToyItem(factory_code="A", name="积木"))
+    db_session.commit()
+    item_id = db_session.query(models.ToyItem.id).scalar()
+    requests_before = sample("toy_http_requests_total", method="GET", route="/items/", status="200")
+    missing_before = sample("toy_http_requests_total", method="DELETE", route="/items/{item_id}", status="404")
+    count_before, page_before = stage_count("list", "count"), stage_count("list", "page_query")
+    miss_before, hit_before = sample("toy_list_cache_requests_total", result="miss"), sample("toy_list_cache_requests_total", result="hit")
+
+    async with client:
+        assert (await client.get("/items/")).status_code == 200
+        assert (await client.get("/items/")).status_code == 200
+        assert (await client.delete(f"/items/{item_id + 1}")).status_code == 404
+        assert (await client.get("/no-such-path")).status_code == 404
+        response = await client.get("/metrics")
+
+    assert sample("toy_http_requests_total", method="GET", route="/items/", status="200") == requests_before + 2
+    # 路径参数不作为标签，未匹配的路径归为一类
+    assert sample("toy_http_requests_total", method="DELETE", route="/items/{item_id}", status="404") == missing_before + 1
+    assert sample("toy_http_requests_total", method="GET", route=metrics_service.UNMATCHED_ROUTE, status="404") >= 1
+    # 第二次请求命中缓存，不再查询数据库
+    assert stage_count("list", "count") == count_before + 1
+    assert stage_count("list", "page_query") == page_before + 1
+    assert sample("toy_list_cache_requests_total", result="miss") == miss_before + 1
+    assert sample("toy_list_cache_requests_total", result="hit") == hit_before + 1
+
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'toy_http_request_duration_seconds_bucket{le="0.005",method="GET",route="/items/"}' in response.text
+
+
+async def test_readiness_reports_db_latency(client, app):
+    pings_before = sample("toy_db_ping_duration_seconds_count")
+
+    async with client:
+        response = await client.get("/readyz")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ok" and response.json()["db_latency_ms"] >= 0
+
+        class BrokenSession:
+            async def execute(self, statement):
+                raise ConnectionError("connection refused")
+
+        app.dependency_overrides[models.get_async_db] = lambda: BrokenSession()
+        response = await client.get("/readyz")
+
+    assert response.status_code == 503
+    assert sample("toy_db_ping_duration_seconds_count") == pings_before + 1
+
+
+def test_import_and_export_stages_are_timed(tmp_path, db_engine, db_session, monkeypatch):
+    monkeypatch.setattr(image_service, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    wb = Workbook()
+    wb.active.append(["货号", "品名", "包装", "装箱量PCS"])
+    for idx in range(3):
+        wb.active.append([f"A-{idx}", "积木", "彩盒", 12])
+    file_path = str(tmp_path / "import.xlsx")
+    wb.save(file_path)
+    before = {
+        stage: stage_count("import", stage) for stage in ("extract_images", "import_rows", "commit", "total")
+    }
+    rows_before = sample("toy_rows_processed_total", operation="import")
+
+    import_service.import_workbook_sync(file_path, "import.xlsx", "厂A", db_session)
+
+    assert all(stage_count("import", stage) == count + 1 for stage, count in before.items())
+    assert sample("toy_rows_processed_total", operation="import") == rows_before + 3
+
+    item_ids = [item_id for (item_id,) in db_session.query(models.ToyItem.id)]
+    export_before = stage_count("export", "process_data"), stage_count("export", "generate_file")
+    rows_before = sample("toy_rows_processed_total", operation="export")
+
+    b"".join(export_service.stream_export(item_ids, sessionmaker(bind=db_engine)))
+
+    assert (stage_count("export", "process_data"), stage_count("export", "generate_file")) == (
+        export_before[0] + 1, export_before[1] + 1
+    )
+    assert sample("toy_rows_processed_total", operation="export") == rows_before + 3
@@ -0,0 +1,74 @@
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from alembic.config import Config
+from sqlalchemy import inspect, text
+
+import database
+import models
+import search_service
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # 与migrations/env.py相同：全文索引表不纳入迁移
+    return not (type_ == "table" and reflected and compare_to is None and name.startswith(search_service.FTS_TABLE))
+
+
+def head_revision():
+    config = Config(database.ALEMBIC_INI)
+    config.set_main_option("script_location", database.MIGRATIONS_DIR)
+    return ScriptDirectory.from_config(config).get_current_head()
+
+
+def current_revision(engine):
+    with engine.connect() as conn:
+        return MigrationContext.configure(conn).get_current_revision()
+
+
+def test_migrations_match_models(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    database.run_migrations(engine)
+    search_service.ensure_search_index(engine)
+
+    assert current_revision(engine) == head_revision()
+    with engine.connect() as conn:
+        # 迁移后的结构与models.py一致，没有需要再生成的差异
+        context = MigrationContext.configure(conn, opts={"include_object": include_object})
+        assert compare_metadata(context, models.Base.metadata) == []
+    engine.dispose()
+
+
+def test_migrations_upgrade_database_created_by_create_all(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    # 引入迁移之前的数据库由create_all创建，没有版本记录
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO toy_items (factory_code, name) VALUES ('A-1', '小熊')"))
+
+    database.run_migrations(engine)
+    database.run_migrations(engine)  # 重复执行不会出错
+
+    assert current_revision(engine) == head_revision()
+    assert "jobs" in inspect(engine).get_table_names()
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT name FROM toy_items")).scalar() == "小熊"
+    engine.dispose()
+
+
+def test_chunked_splits_long_id_lists():
+    chunks = list(database.chunked(range(1201), size=500))
+    assert [len(chunk) for chunk in chunks] == [500, 500, 201]
+
+
+def test_search_columns_migration_fills_existing_rows(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'v1.db'}")
+    database.run_migrations(engine, "0001")
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO toy_items (factory_code, factory_name, name) VALUES ('AB-1', 'Star厂', 'Teddy熊')"))
+
+    database.run_migrations(engine)
+
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT factory_code_lower, factory_name_lower, name_lower FROM toy_items")).one()
+    assert tuple(row) == ("ab-1", "star厂", "teddy熊")
+    engine.dispose()
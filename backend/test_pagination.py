@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import models
+import pagination
+import routers
+
+
+@pytest.fixture
+def catalogue(db_session):
+    base = datetime(2024, 1, 1)
+    for i in range(25):
+        # 每5条共用一个更新时间，验证相同时间下按ID续读
+        db_session.add(models.ToyItem(
+            factory_code=f"C{i:03d}", name=f"item{i}",
+            updated_at=base + timedelta(minutes=i // 5)
+        ))
+    db_session.commit()
+    return db_session
+
+
+async def test_cursor_pages_match_offset_pages(catalogue, list_items):
+    offset_ids = []
+    for page in range(1, 4):
+        result = await list_items(page=page, page_size=10)
+        offset_ids += [item["id"] for item in result["items"]]
+
+    cursor_ids = []
+    cursor = None
+    while True:
+        result = await list_items(page_size=10, cursor=cursor, total_mode="none")
+        assert result["total"] is None
+        cursor_ids += [item["id"] for item in result["items"]]
+        cursor = result["next_cursor"]
+        if not cursor:
+            break
+
+    assert cursor_ids == offset_ids
+    assert len(cursor_ids) == 25
+
+
+async def test_cached_total_reuses_count(catalogue, list_items):
+    pagination.count_cache.clear()
+    assert (await list_items(total_mode="cached"))["total"] == 25
+    catalogue.add(models.ToyItem(factory_code="NEW", name="new"))
+    catalogue.commit()
+    assert (await list_items(total_mode="cached"))["total"] == 25
+    assert (await list_items(total_mode="exact"))["total"] == 26
+
+
+async def test_invalid_cursor_and_total_mode(catalogue, list_items):
+    with pytest.raises(HTTPException) as exc_info:
+        await list_items(cursor="not-a-cursor")
+    assert exc_info.value.status_code == 400
+    with pytest.raises(HTTPException):
+        await list_items(total_mode="approx")
+
+
+async def test_concurrent_list_requests(catalogue, async_db_engine):
+    factory = async_sessionmaker(async_db_engine, expire_on_commit=False)
+    ticks = 0
+    finished = False
+
+    async def get_db():
+        # 每个请求使用独立的异步会话，与get_async_db一致
+        async with factory() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(routers.router)
+    app.dependency_overrides[models.get_async_db] = get_db
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def list_page(page):
+        return (await client.get("/items/", params={"page": page, "page_size": 5})).json()
+
+    async def ticker():
+        nonlocal ticks
+        while not finished:
+            ticks += 1
+            await asyncio.sleep(0)
+
+    ticker_task = asyncio.create_task(ticker())
+    async with client:
+        results = await asyncio.gather(*(list_page(page % 5 + 1) for page in range(30)))
+    finished = True
+    await ticker_task
+
+    assert all(result["total"] == 25 for result in results)
+    assert [item["id"] for item in results[0]["items"]] == [25, 24, 23, 22, 21]
+    # 等待数据库期间事件循环仍在运行其他协程
+    assert ticks > len(results)
+
+
+def test_keyset_query_uses_composite_index(catalogue):
+    updated_at, item_id = datetime(2024, 1, 1, 0, 3), 20
+    plan = catalogue.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM toy_items "
+        "WHERE (updated_at, id) < (:updated_at, :id) ORDER BY updated_at DESC, id DESC LIMIT 10"
+    ), {"updated_at": updated_at, "id": item_id}).fetchall()
+    details = " ".join(row[-1] for row in plan)
+    assert "ix_toy_items_updated_at_id" in details
+    assert "TEMP B-TREE" not in details
@@ -0,0 +1,105 @@
+import os
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import profiling_service
+import routers
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(1000))
+    return total
+
+
+@pytest.fixture
+def profiles_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling_service, "PROFILES_DIR", str(tmp_path / "profiles"))
+    monkeypatch.setattr(profiling_service, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiling_service, "SLOW_REQUEST_SECONDS", 0)
+    monkeypatch.setattr(profiling_service, "SAMPLE_INTERVAL", 0.002)
+    return tmp_path / "profiles"
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(routers.router)
+
+    # 同步路由在线程池中执行，采样需覆盖工作线程
+    @app.get("/slow")
+    def slow(seconds: float = 0.2):
+        busy_loop(seconds)
+        return {"ok": True}
+
+    app.add_middleware(profiling_service.ProfilingMiddleware)
+    return TestClient(app)
+
+
+def test_requested_profile_is_saved_and_downloadable(profiles_dir, client):
+    response = client.get("/slow", headers={"X-Profile": "1", "X-Request-ID": "req-1"})
+    assert response.headers["x-request-id"] == "req-1"
+
+    profiles = client.get("/admin/profiles").json()
+    assert [profile["request_id"] for profile in profiles] == ["req-1"]
+    assert profiles[0]["reason"] == "requested" and profiles[0]["path"] == "/slow"
+    assert profiles[0]["samples"] > 0
+
+    folded = client.get("/admin/profiles/req-1")
+    assert folded.status_code == 200
+    lines = folded.text.splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("busy_loop (test_profiling_service.py" in line for line in lines)
+    summary = client.get("/admin/profiles/req-1", params={"format": "json"}).json()
+    assert any(item["function"].startswith("busy_loop") for item in summary["top_functions"])
+
+    # 非法ID不会访问目录外的文件
+    assert client.get("/admin/profiles/..%2Fsecret").status_code == 404
+
+    # 重复的请求ID不覆盖已有结果
+    response = client.get("/slow", params={"seconds": 0}, headers={"X-Profile": "1", "X-Request-ID": "req-1"})
+    second_id = response.headers["x-request-id"]
+    assert second_id.startswith("req-1-")
+    assert sorted(profile["request_id"] for profile in client.get("/admin/profiles").json()) == ["req-1", second_id]
+    assert client.get("/admin/profiles/req-1", params={"format": "json"}).json()["path"] == "/slow"
+    assert client.get("/admin/profiles/req-1", params={"format": "json"}).json()["samples"] == profiles[0]["samples"]
+
+
+def test_query_flag_and_disabled_switch(profiles_dir, client, monkeypatch):
+    request_id = client.get("/slow", params={"seconds": 0, "profile": "1"}).headers["x-request-id"]
+    assert client.get(f"/admin/profiles/{request_id}").status_code == 200
+
+    # 总开关关闭时请求头不生效，剖析结果接口也不可访问
+    monkeypatch.setattr(profiling_service, "PROFILING_ENABLED", False)
+    response = client.get("/slow", params={"seconds": 0}, headers={"X-Profile": "1"})
+    assert "x-request-id" not in response.headers
+    assert client.get("/admin/profiles").status_code == 404
+    assert client.get(f"/admin/profiles/{request_id}").status_code == 404
+    monkeypatch.setattr(profiling_service, "PROFILING_ENABLED", True)
+    assert len(client.get("/admin/profiles").json()) == 1
+
+
+def test_slow_requests_are_captured_automatically(profiles_dir, client, monkeypatch):
+    # 首个请求会构建各路由的依赖信息，耗时可能超过阈值，先预热（阈值为0时不保存剖析结果）
+    client.get("/slow", params={"seconds": 0})
+    monkeypatch.setattr(profiling_service, "SLOW_REQUEST_SECONDS", 0.1)
+    monkeypatch.setattr(profiling_service, "PROFILE_KEEP", 2)
+
+    client.get("/slow", params={"seconds": 0})
+    assert not os.path.exists(profiles_dir) or not os.listdir(profiles_dir)
+
+    ids = []
+    for _ in range(3):
+        ids.append(client.get("/slow", params={"seconds": 0.15}).headers["x-request-id"])
+        time.sleep(0.01)
+
+    profiles = client.get("/admin/profiles").json()
+    # 只保留最近的PROFILE_KEEP个结果
+    assert [profile["request_id"] for profile in profiles] == ids[:0:-1]
+    assert all(profile["reason"] == "slow" and profile["duration_ms"] >= 150 for profile in profiles)
+    assert sorted(os.listdir(profiles_dir)) == sorted(f"{request_id}{ext}" for request_id in ids[1:] for ext in (".folded", ".json"))
@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy.orm import Session
+
+import database
+import search_service
+from benchmarks import query_plans
+
+# 各访问路径应使用的索引
+EXPECTED_INDEXES = {
+    "最新货物（第一页）": "ix_toy_items_updated_at_id",
+    "游标翻页": "ix_toy_items_updated_at_id",
+    "某工厂的最新货物": "ix_toy_items_factory_name_lower_updated_at",
+    "按货号精确查找": "ix_toy_items_factory_code_lower",
+    "按货号前缀查找": "ix_toy_items_factory_code_lower",
+    "按品名前缀查找": "ix_toy_items_name_lower",
+    "按品名包含查找（全文索引）": search_service.FTS_TABLE,
+}
+
+
+@pytest.fixture
+def bench_session(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    database.run_migrations(engine)
+    search_service.ensure_search_index(engine)
+    query_plans.populate(engine, 2000)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def test_access_paths_use_indexes(bench_session):
+    paths = query_plans.access_paths(bench_session)
+    assert set(paths) == set(EXPECTED_INDEXES)
+    for name, query in paths.items():
+        plan = query_plans.explain(bench_session, query)
+        assert not any(step.startswith("SCAN toy_items") and "INDEX" not in step for step in plan), (name, plan)
+        assert any(EXPECTED_INDEXES[name] in step for step in plan), (name, plan)
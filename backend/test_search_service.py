@@ -0,0 +1,92 @@
+import pytest
+from fastapi import HTTPException
+
+import cache_service
+import models
+import search_service
+
+
+def add_items(db, *rows):
+    for name, factory_name, factory_code in rows:
+        db.add(models.ToyItem(name=name, factory_name=factory_name, factory_code=factory_code))
+    db.commit()
+
+
+@pytest.fixture
+def search_db(db_engine, db_session):
+    assert search_service.ensure_search_index(db_engine)
+    add_items(
+        db_session,
+        ("毛绒玩具小熊", "星星玩具厂", "XX-1001"),
+        ("遥控赛车", "星星玩具厂", "XX-2002"),
+        ("毛绒兔子", "月亮工厂", "YL-1001"),
+    )
+    return db_session
+
+
+async def test_search_matches_chinese_substring(search_db, list_items):
+    result = await list_items(name="玩具小")
+    assert result["total"] == 1
+    assert result["items"][0]["name"] == "毛绒玩具小熊"
+
+
+async def test_search_combines_fields_case_insensitive(search_db, list_items):
+    result = await list_items(factory_name="星星玩具", factory_code="xx-2")
+    assert [item["name"] for item in result["items"]] == ["遥控赛车"]
+
+
+async def test_short_terms_fall_back_to_like(search_db, list_items):
+    result = await list_items(name="毛绒")
+    assert result["total"] == 2
+
+
+async def test_like_fallback_escapes_wildcards(search_db, list_items):
+    add_items(search_db, ("纯棉100%", "厂A", "A_1"), ("纯棉1000", "厂A", "AB1"))
+    # %和_按普通字符匹配
+    assert [item["name"] for item in (await list_items(name="0%"))["items"]] == ["纯棉100%"]
+    assert [item["name"] for item in (await list_items(factory_code="_1"))["items"]] == ["纯棉100%"]
+
+
+async def test_prefix_and_exact_match_use_lower_columns(search_db, list_items):
+    result = await list_items(factory_code="xx-", match="prefix")
+    assert sorted(item["name"] for item in result["items"]) == ["毛绒玩具小熊", "遥控赛车"]
+    result = await list_items(factory_name="月亮工厂", factory_code="yl-1001", match="exact")
+    assert [item["name"] for item in result["items"]] == ["毛绒兔子"]
+    # 前缀匹配不命中中间的子串
+    assert (await list_items(name="玩具", match="prefix"))["total"] == 0
+
+
+async def test_prefix_and_exact_match_non_ascii_letters(search_db, list_items):
+    add_items(search_db, ("ＡＢＣ积木", "Élan工厂", "ＸＹ-9"))
+    # SQLite的lower()不转换非ASCII字母，检索词按同样规则转换后仍能匹配
+    assert (await list_items(name="ＡＢＣ", match="prefix"))["total"] == 1
+    assert (await list_items(factory_name="Élan工厂", match="exact"))["total"] == 1
+    assert (await list_items(factory_name="élan工厂", match="exact"))["total"] == 0
+    assert (await list_items(factory_code="ＸＹ-9", match="exact"))["total"] == 1
+
+
+async def test_invalid_match_mode(search_db, list_items):
+    with pytest.raises(HTTPException) as exc_info:
+        await list_items(name="玩具", match="fuzzy")
+    assert exc_info.value.status_code == 400
+
+
+async def test_index_follows_update_and_delete(search_db, list_items):
+    item = search_db.query(models.ToyItem).filter(models.ToyItem.factory_code == "XX-2002").one()
+    item.name = "遥控飞机"
+    search_db.commit()
+    # 不经过接口直接写数据库，需手动使列表缓存失效
+    cache_service.invalidate_items()
+    assert (await list_items(name="遥控赛车"))["total"] == 0
+    assert (await list_items(name="遥控飞机"))["total"] == 1
+
+    search_db.delete(item)
+    search_db.commit()
+    cache_service.invalidate_items()
+    assert (await list_items(name="遥控飞机"))["total"] == 0
+
+
+async def test_rebuild_indexes_existing_rows(db_engine, db_session, list_items):
+    add_items(db_session, ("声光积木", "月亮工厂", "YL-3003"))
+    assert search_service.ensure_search_index(db_engine)
+    assert (await list_items(name="光积木"))["total"] == 1
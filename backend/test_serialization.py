@@ -0,0 +1,65 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event
+
+import image_service
+import models
+import serialization
+
+
+@pytest.fixture
+def items(db_session):
+    db_session.add_all([
+        models.ToyItem(
+            factory_code="A-1", factory_name="厂A", name="积木", packaging="彩盒", packing_quantity=12,
+            unit_price=Decimal("1.250"), gross_weight=5.5, net_weight=4.0, remarks="备注",
+            image_path=f"uploads/{'a' * 64}.jpg", origin_sheet="报价",
+            created_at=datetime(2024, 1, 1, 8, 30), updated_at=datetime(2024, 1, 2, 9, 15, 0, 123456)
+        ),
+        models.ToyItem(factory_code="B-1", name="赛车", updated_at=datetime(2024, 1, 1)),
+    ])
+    db_session.commit()
+    return db_session
+
+
+async def test_full_response_matches_default_encoding(items, list_items):
+    item = items.query(models.ToyItem).filter(models.ToyItem.factory_code == "A-1").one()
+    expected = {field: getattr(item, column.key) for field, column in serialization.LIST_FIELDS.items()}
+    expected["thumbnail_path"] = image_service.derivative_url(item.image_path, "thumb")
+
+    result = await list_items()
+
+    # 与改用orjson之前由jsonable_encoder编码的结果一致
+    assert result["items"][0] == jsonable_encoder(expected)
+    assert list(result["items"][0]) == list(serialization.LIST_FIELDS)
+    assert result["items"][1]["thumbnail_path"] is None
+
+
+async def test_fields_select_narrow_projection(items, list_items, async_db_engine):
+    statements = []
+    event.listen(
+        async_db_engine.sync_engine, "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement)
+    )
+
+    result = await list_items(fields="id, name,thumbnail_path,name", page_size=1)
+
+    assert result["items"] == [{
+        "id": 1, "name": "积木",
+        "thumbnail_path": image_service.derivative_url(f"uploads/{'a' * 64}.jpg", "thumb")
+    }]
+    # 未请求updated_at也能生成下一页游标
+    assert result["next_cursor"]
+    page_query = statements[-1]
+    assert "toy_items.remarks" not in page_query and "toy_items.factory_code" not in page_query
+
+
+async def test_unknown_field_is_rejected(items, list_items):
+    with pytest.raises(HTTPException) as exc_info:
+        await list_items(fields="id,password")
+    assert exc_info.value.status_code == 400
+    assert "password" in exc_info.value.detail
@@ -0,0 +1,156 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+import image_service
+import import_service
+import job_service
+import models
+import routers
+import storage_service
+
+OLD = time.time() - 2 * 24 * 3600
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def storage(tmp_path, db_engine, monkeypatch):
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    monkeypatch.setattr(models, "SessionLocal", factory)
+    monkeypatch.setattr(image_service, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(import_service, "TEMP_DIR", str(tmp_path / "tmp"))
+    monkeypatch.setattr(job_service, "JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(storage_service, "EXPORTS_DIR", str(tmp_path / "exports"))
+    monkeypatch.setattr(job_service, "_get_executor", lambda: InlineExecutor())
+    return factory
+
+
+def write(path, size=100, mtime=OLD):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def layout(factory):
+    """准备各目录的文件，返回应被回收和应保留的路径"""
+    uploads = image_service.UPLOAD_DIR
+    garbage, kept = [], []
+    db = factory()
+    db.add_all([
+        models.ToyItem(factory_code="A", image_path=f"uploads/{'a' * 64}.jpg"),
+        models.ToyItem(factory_code="B", image_path="uploads/legacy.photo.png"),
+    ])
+    kept += [write(os.path.join(uploads, f"{'a' * 64}.jpg")), write(os.path.join(uploads, "legacy.photo.png"))]
+    kept += [write(image_service.derivative_abs_path(f"uploads/{'a' * 64}.jpg", size)) for size in image_service.DERIVATIVE_SIZES]
+    kept.append(write(image_service.derivative_abs_path("uploads/legacy.photo.png", "thumb")))
+    # 没有记录引用的原图、派生图、历史临时文件和写入中断的残留文件
+    garbage += [
+        write(os.path.join(uploads, f"{'b' * 64}.png"), 300),
+        write(image_service.derivative_abs_path(f"uploads/{'b' * 64}.png", "thumb"), 50),
+        write(os.path.join(uploads, "temp_报价.xlsx"), 1000),
+        write(os.path.join(uploads, f"{'a' * 64}.jpg.0123abcd.tmp"), 10),
+    ]
+    # 宽限期内的文件即使没有引用也保留
+    kept.append(write(os.path.join(uploads, f"{'c' * 64}.jpg"), mtime=time.time()))
+
+    active_input = write(os.path.join(import_service.TEMP_DIR, "import_active.xlsx"))
+    kept.append(active_input)
+    garbage.append(write(os.path.join(import_service.TEMP_DIR, "import_stale.xlsx"), 500))
+    fresh_result = write(os.path.join(job_service.JOBS_DIR, "fresh.xlsx"))
+    expired_result = write(os.path.join(job_service.JOBS_DIR, "expired.xlsx"), 700)
+    kept.append(fresh_result)
+    garbage += [expired_result, write(os.path.join(job_service.JOBS_DIR, "unknown.xlsx"), 20)]
+    garbage.append(write(os.path.join(storage_service.EXPORTS_DIR, "import_template.xlsx"), 40))
+    db.add_all([
+        models.Job(id="active", kind="import", status=job_service.STATUS_RUNNING, input_path=active_input),
+        models.Job(id="fresh", kind="export", status=job_service.STATUS_SUCCEEDED,
+                   result_path=fresh_result, finished_at=datetime.now()),
+        models.Job(id="expired", kind="export", status=job_service.STATUS_SUCCEEDED, result_path=expired_result,
+                   finished_at=datetime.now() - timedelta(seconds=storage_service.JOB_RESULT_RETENTION + 60)),
+    ])
+    db.commit()
+    db.close()
+    return garbage, kept
+
+
+def test_dry_run_reports_without_deleting(storage):
+    garbage, kept = layout(storage)
+
+    report = storage_service.collect_garbage(dry_run=True)
+
+    assert report["files_removed"] == len(garbage)
+    assert report["bytes_reclaimed"] == sum(os.path.getsize(path) for path in garbage)
+    assert report["usage"]["uploads"]["files"] == 3
+    assert all(os.path.exists(path) for path in garbage + kept)
+
+
+def test_collect_garbage_removes_only_orphans(storage):
+    garbage, kept = layout(storage)
+    expected_bytes = sum(os.path.getsize(path) for path in garbage)
+
+    report = storage_service.collect_garbage()
+
+    assert report["bytes_reclaimed"] == expected_bytes
+    assert report["removed"]["derivatives"] == {"files": 1, "bytes": 50}
+    assert report["removed"]["jobs"] == {"files": 2, "bytes": 720}
+    assert not any(os.path.exists(path) for path in garbage)
+    assert all(os.path.exists(path) for path in kept)
+    # 再次执行没有可回收的文件
+    assert storage_service.collect_garbage()["files_removed"] == 0
+
+
+def test_gc_job_and_usage_endpoint(storage):
+    garbage, kept = layout(storage)
+
+    def get_db():
+        db = storage()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(routers.router)
+    app.dependency_overrides[models.get_db] = get_db
+    client = TestClient(app)
+
+    usage = client.get("/storage/usage").json()
+    assert usage["dry_run"] and usage["files_removed"] == len(garbage)
+
+    job_id = client.post("/jobs/gc", json={}).json()["job_id"]
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == job_service.STATUS_SUCCEEDED
+    assert job["result"]["bytes_reclaimed"] == usage["bytes_reclaimed"]
+    assert not any(os.path.exists(path) for path in garbage)
+    # 过期的导出结果已被清理
+    assert client.get("/jobs/expired/result").status_code == 410
+
+
+def test_image_reused_during_gc_is_kept(storage, monkeypatch):
+    image_path, _ = image_service.store_image_bytes(b"old-orphan", ".png")
+    original = image_service.original_abs_path(image_path)
+    os.utime(original, (OLD, OLD))
+    snapshot = storage_service.referenced_image_stems
+
+    def reuse_after_snapshot(db):
+        stems = snapshot(db)
+        # 读取引用之后、删除之前，相同内容的图片被重新上传
+        assert not image_service.store_image_bytes(b"old-orphan", ".png")[1]
+        return stems
+
+    monkeypatch.setattr(storage_service, "referenced_image_stems", reuse_after_snapshot)
+    report = storage_service.collect_garbage()
+
+    assert os.path.exists(original)
+    assert report["removed"]["uploads"]["files"] == 0
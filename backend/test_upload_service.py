@@ -0,0 +1,176 @@
+import hashlib
+import os
+import time
+from io import BytesIO
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from openpyxl import Workbook
+from sqlalchemy.orm import sessionmaker
+
+import image_service
+import import_service
+import job_service
+import models
+import routers
+import storage_service
+import upload_service
+
+CHUNK_SIZE = 1024
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def client(tmp_path, db_engine, monkeypatch):
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    monkeypatch.setattr(models, "SessionLocal", factory)
+    monkeypatch.setattr(image_service, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(import_service, "TEMP_DIR", str(tmp_path / "tmp"))
+    monkeypatch.setattr(job_service, "JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(job_service, "_get_executor", lambda: InlineExecutor())
+    # 接收时每写入一块就落盘，覆盖分多次写入同一分块的情况
+    monkeypatch.setattr(upload_service, "WRITE_BUFFER_SIZE", 100)
+
+    def get_db():
+        db = factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(routers.router)
+    app.dependency_overrides[models.get_db] = get_db
+    return TestClient(app)
+
+
+def workbook_bytes(rows=30):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["货号", "品名", "包装", "装箱量PCS", "单价", "备注"])
+    for i in range(rows):
+        ws.append([f"A-{i}", f"玩具{i}", "彩盒", 12, 1.5, "x" * 50])
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def chunks_of(data):
+    return [data[start:start + CHUNK_SIZE] for start in range(0, len(data), CHUNK_SIZE)]
+
+
+def init_upload(client, data, **extra):
+    body = {"filename": "报价.xlsx", "size": len(data), "chunk_size": CHUNK_SIZE,
+            "sha256": hashlib.sha256(data).hexdigest(), **extra}
+    response = client.post("/imports/uploads", json=body)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_resumed_upload_is_imported(client, db_engine):
+    data = workbook_bytes()
+    chunks = chunks_of(data)
+    upload = init_upload(client, data)
+    upload_id = upload["upload_id"]
+    assert upload["total_chunks"] == len(chunks) > 2 and upload["missing"] == list(range(len(chunks)))
+    assert oct(os.stat(os.path.join(upload_service.uploads_root(), upload_id)).st_mode & 0o777) == "0o700"
+
+    # 分块可以乱序上传；中途断开（长度不足）的分块不计入已收到
+    for index in reversed(range(1, len(chunks))):
+        assert client.put(f"/imports/uploads/{upload_id}/chunks/{index}", content=chunks[index]).status_code == 200
+    assert client.put(f"/imports/uploads/{upload_id}/chunks/0", content=chunks[0][:10]).status_code == 400
+    status = client.get(f"/imports/uploads/{upload_id}").json()
+    assert status["missing"] == [0] and len(status["received"]) == len(chunks) - 1
+    assert client.post(f"/imports/uploads/{upload_id}/complete", json={"factory_name": "厂A"}).status_code == 409
+
+    # 续传缺少的分块，带分块哈希校验
+    response = client.put(
+        f"/imports/uploads/{upload_id}/chunks/0", content=chunks[0],
+        headers={"X-Chunk-SHA256": hashlib.sha256(chunks[0]).hexdigest()}
+    )
+    assert response.json()["size"] == CHUNK_SIZE
+    # 重传已收到的分块中途断开时，该分块重新计为未收到
+    assert client.put(f"/imports/uploads/{upload_id}/chunks/1", content=bytes(10)).status_code == 400
+    assert client.get(f"/imports/uploads/{upload_id}").json()["missing"] == [1]
+    assert client.post(f"/imports/uploads/{upload_id}/complete", json={"factory_name": "厂A"}).status_code == 409
+    assert client.put(f"/imports/uploads/{upload_id}/chunks/1", content=chunks[1]).status_code == 200
+    response = client.post(f"/imports/uploads/{upload_id}/complete", json={"factory_name": "厂A", "mode": "upsert"})
+    assert response.status_code == 200
+    assert response.json()["sha256"] == hashlib.sha256(data).hexdigest()
+
+    job = client.get(f"/jobs/{response.json()['job_id']}").json()
+    assert job["status"] == job_service.STATUS_SUCCEEDED
+    assert job["result"]["inserted"] == 30
+    db = sessionmaker(bind=db_engine)()
+    try:
+        # 完成时已计算的哈希直接用于识别相同文件
+        assert db.query(models.ImportFile.file_hash).scalar() == hashlib.sha256(data).hexdigest()
+    finally:
+        db.close()
+    # 会话目录已删除，导入后的临时文件也已清理
+    assert not os.path.exists(os.path.join(upload_service.uploads_root(), upload_id))
+    assert client.get(f"/imports/uploads/{upload_id}").status_code == 404
+    assert not [name for name in os.listdir(import_service.TEMP_DIR) if name.startswith("import_")]
+
+
+def test_chunks_are_written_without_pwrite(client, monkeypatch):
+    # Windows上没有os.pwrite
+    monkeypatch.delattr(os, "pwrite", raising=False)
+    data = workbook_bytes(5)
+    chunks = chunks_of(data)
+    upload_id = init_upload(client, data)["upload_id"]
+    # 乱序写入各分块，每块按偏移写到正确位置
+    for index in reversed(range(len(chunks))):
+        assert client.put(f"/imports/uploads/{upload_id}/chunks/{index}", content=chunks[index]).status_code == 200
+
+    response = client.post(f"/imports/uploads/{upload_id}/complete", json={"factory_name": "厂A"})
+    assert response.status_code == 200
+    assert response.json()["sha256"] == hashlib.sha256(data).hexdigest()
+
+
+def test_corrupted_upload_is_rejected(client):
+    data = workbook_bytes(5)
+    chunks = chunks_of(data)
+    upload_id = init_upload(client, data)["upload_id"]
+
+    assert client.put(f"/imports/uploads/{upload_id}/chunks/{len(chunks)}", content=b"x").status_code == 400
+    assert client.put(f"/imports/uploads/{upload_id}/chunks/0", content=chunks[0] + b"x").status_code == 400
+    response = client.put(f"/imports/uploads/{upload_id}/chunks/0", content=chunks[0], headers={"X-Chunk-SHA256": "0" * 64})
+    assert response.status_code == 400
+
+    # 内容被篡改的分块长度正确，完成时整个文件的哈希不一致，会话保留以便重传
+    client.put(f"/imports/uploads/{upload_id}/chunks/0", content=bytes(len(chunks[0])))
+    for index in range(1, len(chunks)):
+        client.put(f"/imports/uploads/{upload_id}/chunks/{index}", content=chunks[index])
+    response = client.post(f"/imports/uploads/{upload_id}/complete", json={"factory_name": "厂A"})
+    assert response.status_code == 400
+    assert client.get(f"/imports/uploads/{upload_id}").json()["missing"] == []
+
+    assert client.delete(f"/imports/uploads/{upload_id}").status_code == 200
+    assert client.get(f"/imports/uploads/{upload_id}").status_code == 404
+    assert client.get("/imports/uploads/..%2F..%2Fetc").status_code == 404
+    assert client.post("/imports/uploads", json={"filename": "a.csv", "size": 10}).status_code == 400
+    assert client.post("/imports/uploads", json={"filename": "a.xlsx", "size": 0}).status_code == 400
+
+
+def test_gc_removes_abandoned_uploads(client, monkeypatch):
+    data = workbook_bytes(5)
+    stale_id = init_upload(client, data)["upload_id"]
+    client.put(f"/imports/uploads/{stale_id}/chunks/0", content=chunks_of(data)[0])
+    active_id = init_upload(client, data)["upload_id"]
+    old = time.time() - upload_service.UPLOAD_EXPIRY - 60
+    stale_dir = os.path.join(upload_service.uploads_root(), stale_id)
+    for root, _, files in os.walk(stale_dir):
+        for name in files:
+            os.utime(os.path.join(root, name), (old, old))
+
+    report = storage_service.collect_garbage(grace_seconds=0)
+
+    assert report["removed"]["tmp"]["files"] == 1 and report["removed"]["tmp"]["bytes"] > 0
+    assert not os.path.exists(stale_dir)
+    assert client.get(f"/imports/uploads/{active_id}").status_code == 200
@@ -0,0 +1,239 @@
+from datetime import datetime
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import uuid
+import logging
+from fastapi import HTTPException
+import import_service
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 分块上传：客户端先创建上传会话，再按序号上传各分块（可并行、可重传），全部收到后校验哈希并导入
+# 默认分块大小与上限（字节）
+UPLOAD_CHUNK_SIZE = int(os.environ.get("TOY_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# 单个文件的大小上限（字节）
+MAX_UPLOAD_SIZE = int(os.environ.get("TOY_UPLOAD_MAX_SIZE", 2 * 1024 * 1024 * 1024))
+# 超过此秒数没有收到分块的上传会话由存储回收删除
+UPLOAD_EXPIRY = int(os.environ.get("TOY_UPLOAD_EXPIRY", 24 * 3600))
+# 接收分块时累积到此字节数再写盘，内存占用与分块大小无关
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def uploads_root():
+    # 位于导入临时目录下，每个会话一个仅当前用户可访问的子目录
+    return os.path.join(import_service.TEMP_DIR, "chunked")
+
+
+def _upload_dir(upload_id):
+    if not UPLOAD_ID_RE.match(upload_id or ""):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return os.path.join(uploads_root(), upload_id)
+
+
+def _data_path(directory):
+    return os.path.join(directory, "data")
+
+
+def _chunk_marker(directory, index):
+    return os.path.join(directory, "chunks", str(index))
+
+
+def load_upload(upload_id):
+    """读取上传会话信息，不存在时返回404"""
+    directory = _upload_dir(upload_id)
+    try:
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    meta["total_chunks"] = max(1, math.ceil(meta["size"] / meta["chunk_size"]))
+    return meta
+
+
+def received_chunks(upload_id):
+    try:
+        return sorted(int(name) for name in os.listdir(os.path.join(_upload_dir(upload_id), "chunks")))
+    except FileNotFoundError:
+        return []
+
+
+def upload_status(upload_id):
+    meta = load_upload(upload_id)
+    received = received_chunks(upload_id)
+    received_set = set(received)
+    return {
+        "upload_id": upload_id,
+        "filename": meta["filename"],
+        "size": meta["size"],
+        "chunk_size": meta["chunk_size"],
+        "total_chunks": meta["total_chunks"],
+        "received": received,
+        "missing": [index for index in range(meta["total_chunks"]) if index not in received_set],
+    }
+
+
+def create_upload(filename, size, sha256=None, chunk_size=None):
+    """创建上传会话：在独立目录中预分配文件，返回会话状态"""
+    if not filename or not filename.endswith((".xlsx", ".xls")):
+        raise HTTPException(status_code=400, detail="只支持Excel文件格式(.xlsx, .xls)")
+    if not isinstance(size, int) or size <= 0 or size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=400, detail=f"文件大小必须在1到{MAX_UPLOAD_SIZE}字节之间")
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    if not isinstance(chunk_size, int) or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail=f"分块大小必须在1到{MAX_CHUNK_SIZE}字节之间")
+    if sha256 is not None:
+        sha256 = str(sha256).lower()
+        if not SHA256_RE.match(sha256):
+            raise HTTPException(status_code=400, detail="sha256必须是64位十六进制字符串")
+
+    upload_id = uuid.uuid4().hex
+    directory = os.path.join(uploads_root(), upload_id)
+    os.makedirs(os.path.join(directory, "chunks"), mode=0o700)
+    os.chmod(directory, 0o700)
+    # 预分配到最终大小，各分块按偏移写入同一个文件，完成时无需再拼接
+    with open(_data_path(directory), "wb") as f:
+        f.truncate(size)
+    meta = {
+        "filename": os.path.basename(filename),
+        "size": size,
+        "chunk_size": chunk_size,
+        "sha256": sha256,
+        "created_at": datetime.now().isoformat(),
+    }
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    logger.info(f"创建分块上传: {upload_id}（{meta['filename']}，{size}字节）")
+    return upload_status(upload_id)
+
+
+def chunk_range(meta, index):
+    """分块在文件中的(偏移, 长度)，序号无效时返回400"""
+    if not 0 <= index < meta["total_chunks"]:
+        raise HTTPException(status_code=400, detail=f"分块序号必须在0到{meta['total_chunks'] - 1}之间")
+    offset = index * meta["chunk_size"]
+    return offset, min(meta["chunk_size"], meta["size"] - offset)
+
+
+class ChunkWriter:
+    """把一个分块按偏移写入预分配的文件，同时计算分块的SHA-256
+
+    add只计算哈希并缓存数据，可在事件循环中调用；缓存达到WRITE_BUFFER_SIZE后由flush写盘，
+    flush/finish在工作线程中调用。
+    """
+
+    def __init__(self, upload_id, index):
+        self.upload_id = upload_id
+        self.index = index
+        self.meta = load_upload(upload_id)
+        self.directory = _upload_dir(upload_id)
+        self.offset, self.length = chunk_range(self.meta, index)
+        self.received = 0
+        self.digest = hashlib.sha256()
+        self._buffer = bytearray()
+        self._fd = os.open(_data_path(self.directory), os.O_WRONLY | getattr(os, "O_BINARY", 0))
+        # 重传已收到的分块时先取消登记：写到一半中断时该分块按未收到处理，需再次上传
+        try:
+            os.remove(_chunk_marker(self.directory, index))
+        except FileNotFoundError:
+            pass
+
+    def add(self, data):
+        """接收一段数据，返回缓冲区是否需要写盘"""
+        self.received += len(data)
+        if self.received > self.length:
+            raise HTTPException(status_code=400, detail=f"分块{self.index}超过应有长度{self.length}字节")
+        self.digest.update(data)
+        self._buffer += data
+        return len(self._buffer) >= WRITE_BUFFER_SIZE
+
+    def flush(self):
+        view = memoryview(self._buffer)
+        # os.pwrite在Windows上不可用；每个写入器使用自己的文件描述符，先定位再写入即可
+        os.lseek(self._fd, self.offset + self.received - len(self._buffer), os.SEEK_SET)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+        self._buffer = bytearray()
+
+    def finish(self, expected_sha256=None):
+        """写完剩余数据并登记分块；长度或哈希不符时不登记，客户端需重传"""
+        self.flush()
+        if self.received != self.length:
+            raise HTTPException(status_code=400, detail=f"分块{self.index}应为{self.length}字节，收到{self.received}字节")
+        if expected_sha256 and self.digest.hexdigest() != expected_sha256.lower():
+            raise HTTPException(status_code=400, detail=f"分块{self.index}校验失败")
+        os.fsync(self._fd)
+        # 标记文件在数据写入后创建，中途断开的分块不会被当作已收到
+        with open(_chunk_marker(self.directory, self.index), "w"):
+            pass
+
+    def close(self):
+        os.close(self._fd)
+
+
+def assemble_upload(upload_id):
+    """检查分块齐全并校验整个文件的哈希，把文件移出会话目录，返回(文件路径, 文件名, SHA-256)
+
+    在工作线程中执行。哈希不符时保留会话，客户端可重传分块后再次完成。
+    """
+    status = upload_status(upload_id)
+    if status["missing"]:
+        raise HTTPException(status_code=409, detail=f"还有{len(status['missing'])}个分块未上传")
+    meta = load_upload(upload_id)
+    directory = _upload_dir(upload_id)
+    try:
+        file_hash = import_service.file_sha256(_data_path(directory))
+    except FileNotFoundError:
+        raise HTTPException(status_code=409, detail="上传已完成")
+    if meta["sha256"] and file_hash != meta["sha256"]:
+        raise HTTPException(status_code=400, detail="文件校验失败，SHA-256与创建上传时提供的不一致")
+
+    file_ext = os.path.splitext(meta["filename"])[1].lower()
+    target = os.path.join(import_service.TEMP_DIR, f"import_{uuid.uuid4().hex}{file_ext}")
+    try:
+        # 改名即完成，同一会话被重复完成时只有一次成功
+        os.rename(_data_path(directory), target)
+    except FileNotFoundError:
+        raise HTTPException(status_code=409, detail="上传已完成")
+    shutil.rmtree(directory, ignore_errors=True)
+    logger.info(f"分块上传完成: {upload_id}（{meta['filename']}）")
+    return target, meta["filename"], file_hash
+
+
+def delete_upload(upload_id):
+    directory = _upload_dir(upload_id)
+    if not os.path.isdir(directory):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def upload_sessions():
+    """逐个返回上传会话：(目录, 占用字节数, 最后一次写入的时间戳)"""
+    try:
+        entries = list(os.scandir(uploads_root()))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        size, latest = 0, 0.0
+        for root, _, files in os.walk(entry.path):
+            for name in files:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                # 预分配的文件按实际占用的磁盘块计算
+                size += stat.st_blocks * 512 if hasattr(stat, "st_blocks") else stat.st_size
+                latest = max(latest, stat.st_mtime)
+        yield entry.path, size, latest